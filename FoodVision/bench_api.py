@@ -0,0 +1,319 @@
+"""
+Load benchmark for the API hot path: main.app under uvicorn, with fake Gemini and
+Identity Toolkit servers (fake_services.py), so runs need no network or API keys and
+are repeatable. Reports throughput, p50/p95/p99 latency, memory and the mean time per
+pipeline stage (from /metrics). Every run is saved to bench_results/<label>.json.
+
+    python bench_api.py                                      # every profile at concurrency 1, 8, 32
+    python bench_api.py --profiles analyze stream --concurrency 16 64 --requests 400 \\
+        --gemini-latency-ms 1500 --gemini-error-rate 0.02
+    python bench_api.py --label baseline                     # save as the reference run
+    python bench_api.py --compare baseline                   # exit 1 on a regression
+
+Profiles:
+    analyze   POST /analyze-meal/, a new image per request (result cache misses)
+    cached    POST /analyze-meal/, one image from one user (result cache hits)
+    stream    POST /analyze-meal/stream, new images, SSE read to the end
+    batch     POST /analyze-meals/ with 4 new images, NDJSON read to the end
+    summary   GET /meals/summary (rollup reads)
+
+The load generator shares the process (and the GIL) with the app. Compare runs made
+with the same options on the same machine, not absolute numbers across machines.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import httpx
+from PIL import Image, ImageDraw
+
+from fake_services import FakeGemini, FakeIdentityToolkit, start_app
+
+PROFILES = ("analyze", "cached", "stream", "batch", "summary")
+BATCH_SIZE = 4
+BASE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploaded_image.jpg")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+STAGE_LINE = re.compile(r'^diablife_stage_duration_seconds_(sum|count)\{stage="(\w+)"\} (\S+)$', re.M)
+
+
+# --- WORKLOAD ---
+class Images:
+    """Distinct JPEGs of the sample meal photo (a small coloured mark makes each one unique)."""
+
+    def __init__(self):
+        self.base = Image.open(BASE_IMAGE).convert("RGB")
+        self.next = 0
+
+    def take(self, count):
+        images = []
+        for _ in range(count):
+            self.next += 1
+            image = self.base.copy()
+            x, y = (self.next * 37) % (image.width - 24), (self.next * 53) % (image.height - 24)
+            ImageDraw.Draw(image).rectangle(
+                (x, y, x + 24, y + 24), fill=(self.next % 251, (self.next * 7) % 253, (self.next * 13) % 255)
+            )
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=90)
+            images.append(buffer.getvalue())
+        return images
+
+
+def auth_headers(index, tokens):
+    """Cycles through `tokens` users (0 = a new token, hence an Identity Toolkit call, every request)."""
+    token = f"bench-{index % tokens if tokens else index}"
+    return {"Authorization": f"Bearer {token}"}
+
+
+def prepare(profile, total, images):
+    """Request payloads for one run, built before the clock starts."""
+    if profile in ("analyze", "stream"):
+        return images.take(total)
+    if profile == "cached":
+        return images.take(1) * total
+    if profile == "batch":
+        return [images.take(BATCH_SIZE) for _ in range(total)]
+    return [None] * total
+
+
+async def send(client, profile, payload, headers):
+    """One request; returns its outcome ("200", "503", "error_event", "partial", ...)."""
+    if profile in ("analyze", "cached"):
+        response = await client.post("/analyze-meal/", files={"file": ("meal.jpg", payload, "image/jpeg")}, headers=headers)
+        return str(response.status_code)
+    if profile == "stream":
+        async with client.stream(
+            "POST", "/analyze-meal/stream", files={"file": ("meal.jpg", payload, "image/jpeg")}, headers=headers
+        ) as response:
+            body = await response.aread()
+        if response.status_code == 200 and b"event: error" in body:
+            return "error_event"
+        return str(response.status_code)
+    if profile == "batch":
+        files = [("files", (f"meal-{n}.jpg", image, "image/jpeg")) for n, image in enumerate(payload)]
+        response = await client.post("/analyze-meals/", files=files, headers=headers)
+        if response.status_code == 200 and any(
+            not json.loads(line)["ok"] for line in response.text.splitlines() if line
+        ):
+            return "partial"
+        return str(response.status_code)
+    response = await client.get("/meals/summary", headers=headers)
+    return str(response.status_code)
+
+
+# --- MEASUREMENT ---
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def memory_mb():
+    """(current RSS, peak RSS) of this process in MB; Linux /proc, else peak only."""
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+        return peak, peak
+
+
+async def stage_totals(client):
+    """{stage: [seconds, count]} from /metrics."""
+    totals = {}
+    for kind, stage, value in STAGE_LINE.findall((await client.get("/metrics")).text):
+        totals.setdefault(stage, [0.0, 0])[0 if kind == "sum" else 1] = float(value)
+    return totals
+
+
+async def run_profile(url, profile, concurrency, total, tokens, images, heap):
+    payloads = prepare(profile, concurrency + total, images)
+    # the result cache is per user
+    tokens = 1 if profile == "cached" else tokens
+    # one unmeasured request per worker: connections open, code paths (and the cache for `cached`) warm
+    warmup, payloads = payloads[:concurrency], payloads[concurrency:]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=300, limits=limits) as client:
+        await asyncio.gather(*(send(client, profile, payload, auth_headers(n, tokens)) for n, payload in enumerate(warmup)))
+
+        stages_before = await stage_totals(client)
+        if heap:
+            tracemalloc.reset_peak()
+        latencies, outcomes = [], {}
+        pending = iter(enumerate(payloads))
+
+        async def worker():
+            for index, payload in pending:
+                started = time.perf_counter()
+                try:
+                    outcome = await send(client, profile, payload, auth_headers(index, tokens))
+                except httpx.HTTPError as e:
+                    outcome = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stages_after = await stage_totals(client)
+
+    latencies.sort()
+    rss, rss_peak = memory_mb()
+    stages = {}
+    for stage, (seconds, count) in stages_after.items():
+        before_seconds, before_count = stages_before.get(stage, (0.0, 0))
+        if count > before_count:
+            stages[stage] = round((seconds - before_seconds) / (count - before_count) * 1000, 3)
+    ok = outcomes.get("200", 0)
+    return {
+        "profile": profile,
+        "concurrency": concurrency,
+        "requests": total,
+        "outcomes": outcomes,
+        "error_rate": round(1 - ok / total, 4),
+        "throughput_rps": round(total / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "rss_mb": round(rss, 1),
+        "rss_peak_mb": round(rss_peak, 1),
+        "heap_peak_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if heap else None,
+        "stage_mean_ms": stages,
+    }
+
+
+def print_result(result):
+    stages = ", ".join(f"{stage} {ms:g}" for stage, ms in sorted(result["stage_mean_ms"].items(), key=lambda s: -s[1])[:4])
+    print(
+        f"{result['profile']:>8} c={result['concurrency']:<3} {result['throughput_rps']:8.1f} req/s | "
+        f"p50 {result['p50_ms']:8.1f}  p95 {result['p95_ms']:8.1f}  p99 {result['p99_ms']:8.1f} ms | "
+        f"err {result['error_rate']:.1%} | rss {result['rss_mb']:.0f} MB | {stages}"
+    )
+
+
+# --- BASELINES ---
+def results_path(label):
+    return label if label.endswith(".json") else os.path.join(RESULTS_DIR, f"{label}.json")
+
+
+def compare(run, baseline, tolerance):
+    """Lines describing regressions beyond `tolerance` (throughput, p95, RSS) vs the baseline."""
+    if run["config"] != baseline["config"]:
+        print("WARNING: baseline was recorded with different options; comparing anyway")
+    reference = {(r["profile"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in run["results"]:
+        base = reference.get((result["profile"], result["concurrency"]))
+        if base is None:
+            continue
+        name = f"{result['profile']} c={result['concurrency']}"
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} -> {result['p95_ms']} ms")
+        if result["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {base['error_rate']:.1%} -> {result['error_rate']:.1%}")
+    base_rss = max((r["rss_peak_mb"] for r in baseline["results"]), default=0)
+    run_rss = max((r["rss_peak_mb"] for r in run["results"]), default=0)
+    if base_rss and run_rss > base_rss * (1 + tolerance):
+        regressions.append(f"peak RSS {base_rss} -> {run_rss} MB")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per profile and concurrency")
+    parser.add_argument("--tokens", type=int, default=20, help="distinct users (0 = new token per request)")
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=100)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-bad-json-rate", type=float, default=0.0, help="answers that need the repair call")
+    parser.add_argument("--auth-latency-ms", type=float, default=40)
+    parser.add_argument("--auth-jitter-ms", type=float, default=10)
+    parser.add_argument("--auth-error-rate", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true", help="keep the app's per-request log lines")
+    parser.add_argument("--heap", action="store_true", help="also track Python heap peaks (tracemalloc; slows the app)")
+    parser.add_argument("--label", default=None, help="saved as bench_results/<label>.json (default: timestamp)")
+    parser.add_argument("--compare", default=None, help="baseline label or .json path; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown (default 0.15)")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("label", "compare", "tolerance")}
+    baseline = None
+    if args.compare:
+        with open(results_path(args.compare)) as f:
+            baseline = json.load(f)
+
+    gemini = FakeGemini(
+        latency_ms=args.gemini_latency_ms, jitter_ms=args.gemini_jitter_ms,
+        error_rate=args.gemini_error_rate, bad_json_rate=args.gemini_bad_json_rate,
+    ).start()
+    identity = FakeIdentityToolkit(
+        latency_ms=args.auth_latency_ms, jitter_ms=args.auth_jitter_ms, error_rate=args.auth_error_rate
+    ).start()
+    results = []
+    with contextlib.ExitStack() as stack:
+        data_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        _, server = start_app(data_dir, gemini, identity)
+        if args.heap:
+            tracemalloc.start()
+        try:
+            images = Images()
+            app_log = sys.stdout if args.verbose else stack.enter_context(open(os.devnull, "w"))
+            for profile in args.profiles:
+                for concurrency in args.concurrency:
+                    # the app prints a line or two per request; keep them out of the report
+                    with contextlib.redirect_stdout(app_log):
+                        result = asyncio.run(run_profile(
+                            server.url, profile, concurrency, args.requests, args.tokens, images, args.heap
+                        ))
+                    print_result(result)
+                    results.append(result)
+        finally:
+            server.stop()
+            gemini.stop()
+            identity.stop()
+
+    run = {
+        "label": args.label or datetime.now().strftime("run-%Y%m%d-%H%M%S"),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.machine()} x{os.cpu_count()}",
+        "config": config,
+        "fakes": {"gemini": gemini.counts, "identity_toolkit": identity.counts},
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(results_path(run["label"]), "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"saved {results_path(run['label'])}")
+
+    if baseline is not None:
+        regressions = compare(run, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions vs {baseline['label']} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,87 @@
+"""
+PDF report throughput: memoized single-meal reports, date-range reports and the
+process-pool bulk export, in pages/sec.
+
+    python bench_reports.py                          # 16 patients x 30 days, all cores
+    python bench_reports.py --patients 64 --days 90 --workers 1 4 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import report_generator
+from meal_log import MealLog
+
+COMPONENTS = [
+    ("Basmati Rice", "1 cup", 45, "High"), ("Grilled Chicken", "150g", 0, "Low"),
+    ("Mixed Salad", "2 cups", 5, "Low"), ("Whole Wheat Bread", "2 slices", 24, "Medium"),
+    ("Apple", "1 medium", 25, "Low"), ("Pasta", "200g", 60, "Medium"),
+]
+
+
+def fake_analysis(rng):
+    components = [
+        {"name": name, "portion_est": portion, "carbs_g": carbs, "glycemic_index": gi}
+        for name, portion, carbs, gi in rng.sample(COMPONENTS, rng.randint(2, 4))
+    ]
+    return {
+        "meal_summary": " and ".join(c["name"] for c in components),
+        "total_carbs_est": sum(c["carbs_g"] for c in components),
+        "components": components,
+        "diasense_advice": {
+            "risk_level": rng.choice(["Low", "Moderate", "High"]),
+            "suggested_bolus_strategy": "Standard Bolus",
+            "prediction": "Moderate rise expected, peaking after about 60 minutes.",
+        },
+    }
+
+
+def fill_meal_log(meal_log, patients, days, end):
+    rng = random.Random(0)
+    for patient in range(patients):
+        for offset in range(days):
+            day = end - timedelta(days=offset + 1)
+            for hour in (8, 13, 19):
+                meal_log.log_meal(f"patient-{patient:03d}", fake_analysis(rng), ts=day.replace(hour=hour))
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=16)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    end = datetime.combine(datetime.now().date(), datetime.min.time())
+    start = end - timedelta(days=args.days)
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+        meal_log = MealLog(url)
+        fill_meal_log(meal_log, args.patients, args.days, end)
+
+        meal = fake_analysis(random.Random(1))
+        _, cold = timed(lambda: report_generator.generate_pdf(meal))
+        _, warm = timed(lambda: report_generator.generate_pdf(meal))
+        print(f"single meal: {cold * 1000:.1f} ms rendered, {warm * 1000:.3f} ms memoized")
+
+        pdf_bytes, cold = timed(lambda: report_generator.meal_log_report(meal_log, "patient-000", start, end))
+        _, warm = timed(lambda: report_generator.meal_log_report(meal_log, "patient-000", start, end))
+        print(f"{args.days}-day report: {len(pdf_bytes) / 1024:.0f} KB, {cold * 1000:.0f} ms rendered, "
+              f"{warm * 1000:.1f} ms memoized (query + hash)")
+
+        jobs = [(f"patient-{patient:03d}", start, end) for patient in range(args.patients)]
+        for workers in args.workers:
+            out_dir = os.path.join(tmp, f"export-{workers}")
+            results, elapsed = timed(lambda: report_generator.export_reports(jobs, out_dir, url, workers=workers))
+            pages = sum(page_count for _, page_count in results)
+            print(f"bulk export, {workers:>2} workers: {len(results)} reports, {pages} pages in {elapsed:.1f}s "
+                  f"= {pages / elapsed:.0f} pages/s")
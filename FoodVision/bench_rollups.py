@@ -0,0 +1,100 @@
+"""
+Dashboard refresh cost vs history length: rollup reads (meal_log.dashboard +
+last_days) against recomputing the same metrics from every raw meal and reading.
+
+    python bench_rollups.py                    # 30 days, 1 year, 5 years of history
+    python bench_rollups.py --days 90 3650 --runs 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import rollups
+from meal_log import GLUCOSE, INSULIN, MealLog, meals, readings
+
+UID = "bench-user"
+
+
+def fill_history(meal_log, days, today, seed=0):
+    """3 meals, 24 glucose values and 3 insulin doses per day, bulk inserted, then rolled up."""
+    rng = random.Random(seed)
+    meal_rows, reading_rows = [], []
+    for offset in range(days):
+        day = datetime.combine(today - timedelta(days=offset), datetime.min.time())
+        for hour in (8, 13, 19):
+            carbs = rng.uniform(20, 90)
+            meal_rows.append({
+                "uid": UID, "ts": day + timedelta(hours=hour), "meal_summary": "bench meal",
+                "total_carbs": carbs, "glycemic_load": carbs * 0.4, "risk_level": "Moderate",
+                "payload": "{}",
+            })
+            reading_rows.append({"uid": UID, "ts": day + timedelta(hours=hour), "kind": INSULIN, "value": carbs / 12})
+        for hour in range(24):
+            reading_rows.append({
+                "uid": UID, "ts": day + timedelta(hours=hour, minutes=30), "kind": GLUCOSE, "value": rng.gauss(130, 35),
+            })
+    with meal_log.engine.begin() as conn:
+        conn.execute(meals.insert(), meal_rows)
+        conn.execute(readings.insert(), reading_rows)
+    meal_log.rebuild_rollups(UID)
+    return len(meal_rows) + len(reading_rows)
+
+
+def naive_metrics(meal_log, today):
+    """What the dashboard would cost without rollups: every raw row on every refresh."""
+    days = {}
+    with meal_log.engine.connect() as conn:
+        for ts, carbs, glycemic_load in conn.execute(
+            meals.select().with_only_columns(meals.c.ts, meals.c.total_carbs, meals.c.glycemic_load)
+            .where(meals.c.uid == UID)
+        ):
+            rollups.add(days.setdefault(ts.date(), rollups.empty()), rollups.delta(1, carbs, glycemic_load))
+        for ts, kind, value in conn.execute(
+            readings.select().with_only_columns(readings.c.ts, readings.c.kind, readings.c.value)
+            .where(readings.c.uid == UID)
+        ):
+            delta = rollups.delta(glucose=value) if kind == GLUCOSE else rollups.delta(insulin=value)
+            rollups.add(days.setdefault(ts.date(), rollups.empty()), delta)
+    window = [days.get(today - timedelta(days=offset), rollups.empty()) for offset in range(13, -1, -1)]
+    return rollups.dashboard_metrics(rollups.summarize(window[7:]), rollups.summarize(window[:7]))
+
+
+def time_ms(fn, runs):
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def bench(days, runs):
+    today = date.today()
+    with tempfile.TemporaryDirectory() as tmp:
+        meal_log = MealLog(f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+        rows = fill_history(meal_log, days, today)
+
+        rolled = meal_log.dashboard(UID, today=today)["metrics"]
+        assert rolled == naive_metrics(meal_log, today), "rollups disagree with a full recompute"
+
+        def refresh():
+            meal_log.dashboard(UID, today=today)
+            meal_log.last_days(UID, days=7, today=today)
+
+        rollup_ms = time_ms(refresh, runs)
+        naive_ms = time_ms(lambda: naive_metrics(meal_log, today), max(1, runs // 10))
+        meal_log.engine.dispose()
+    print(f"{days:>6} days {rows:>9,} rows | rollups {rollup_ms:7.2f} ms | full recompute {naive_ms:9.1f} ms")
+    return rollup_ms, naive_ms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365, 5 * 365])
+    parser.add_argument("--runs", type=int, default=100)
+    args = parser.parse_args()
+
+    for days in args.days:
+        bench(days, args.runs)
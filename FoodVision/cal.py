@@ -1,139 +1,128 @@
 # cal.py
 
-import torch
-from ultralytics import YOLO
-import cv2
+import os
 import numpy as np
-import matplotlib.pyplot as plt
 import streamlit as st
+from nutrition_store import get_store
+# Detector-agnostic helpers (no UI imports; shared with onnx_detector.py), re-exported here
+from detection import (
+    CLASSES, to_bgr, detect_batch, draw_detections, boxes_to_details, predict_images, predict_image,
+)
+# torch / ultralytics are imported lazily in load_model so the ONNX runtime path
+# (FOODVISION_RUNTIME=onnx) never pays for them.
 # Configuration class
 class Config:
     
-    CLASSES = ['asparagus', 'avocados', 'broccoli', 'cabbage',        #4
-               'celery', 'cucumber', 'green_apples', 'green_beans', #4
-               'green_capsicum', 'green_grapes', 'kiwifruit', #3
-               'lettuce', 'limes', 'peas', 'spinach',  #4
-               'Banana', 'Cauliflower', 'Date', 'Garlic', #4
-               'Ginger', 'Mushroom', 'Onion', 'Parsnip', #4
-               'Peach', 'Pear', 'Potato', 'Turnip', #4
-               'Beetroot', 'Blackberry', 'Blueberry', 'Cherry', #4
-               'Eggplant', 'Plum', 'Purple asparagus', 'Purple grapes',  #4
-               'Radish', 'Raspberry', 'Red Apple', 'Red Grape', #4
-               'Red cabbage', 'Red capsicum', 'Strawberry', 'Tomato', #4
-               'Watermelon', 'apricot', 'carrot', 'corn', #4
-               'grapefruit', 'lemon', 'mango', 'nectarine', #4
-               'orange', 'pineapple', 'pumpkin', 'sweet_potato'] #4
+    CLASSES = CLASSES
     
-    CALORIES_DICT = {
-        # Green foods (existing)
-        'asparagus': 20,
-        'avocados': 160,
-        'broccoli': 55,
-        'cabbage': 25,
-        'celery': 16,
-        'cucumber': 16,
-        'green_apples': 52,
-        'green_beans': 31,
-        'green_capsicum': 20,
-        'green_grapes': 69,
-        'kiwifruit': 61,
-        'lettuce': 15,
-        'limes': 30,
-        'peas': 81,
-        'spinach': 23,
-        
-        # White/Beige foods
-        'Banana': 89,
-        'Cauliflower': 25,
-        'Date': 282,
-        'Garlic': 149,
-        'Ginger': 80,
-        'Mushroom': 22,
-        'Onion': 40,
-        'Parsnip': 75,
-        'Peach': 39,
-        'Pear': 57,
-        'Potato': 77,
-        'Turnip': 28,
-        
-        # Purple/Red foods
-        'Beetroot': 43,
-        'Blackberry': 43,
-        'Blueberry': 57,
-        'Cherry': 50,
-        'Eggplant': 25,
-        'Plum': 46,
-        'Purple asparagus': 20,
-        'Purple grapes': 69,
-        'Radish': 16,
-        'Raspberry': 52,
-        'Red Apple': 52,
-        'Red Grape': 69,
-        'Red cabbage': 31,
-        'Red capsicum': 31,
-        'Strawberry': 32,
-        'Tomato': 18,
-        'Watermelon': 30,
-        
-        # Orange/Yellow foods
-        'apricot': 48,
-        'carrot': 41,
-        'corn': 86,
-        'grapefruit': 42,
-        'lemon': 29,
-        'mango': 60,
-        'nectarine': 44,
-        'orange': 47,
-        'pineapple': 50,
-        'pumpkin': 26,
-        'sweet_potato': 86
-    }
+    # Nutrition values come from the shared store (nutrition_store.py / nutrition_data.csv);
+    # these per-class views keep the existing Config API.
+    # kcal per 100 g
+    CALORIES_DICT = {name: get_store()[name].kcal for name in CLASSES}
+
+    # Carbohydrates (g per 100 g, USDA approx.) and glycemic index per class.
+    # Used by the local inference backend to build MealComponents.
+    CARBS_GI_DICT = {name: (get_store()[name].carbs_g, get_store()[name].gi) for name in CLASSES}
 
 # Load the model
 @st.cache_resource
 def load_model():
+    if os.getenv("FOODVISION_RUNTIME", "torch").lower() == "onnx":
+        from onnx_detector import OnnxDetector
+        return OnnxDetector(
+            os.getenv("FOODVISION_ONNX_PATH", "./best.onnx"),
+            num_threads=int(os.getenv("FOODVISION_ONNX_THREADS", "0")),
+        )
+    # Weights preloaded by model_server.py before forking are shared copy-on-write
+    from model_server import get_preloaded
+    preloaded = get_preloaded("foodvision")
+    if preloaded is not None:
+        return preloaded
+    from ultralytics import YOLO
     model = YOLO('./best.pt')
     return model
 
-# Function to make predictions on a single image
-def predict_image(image_path, model, conf_threshold=0.03):
-    # Perform inference on the image
-    results = model.predict(
-        source=image_path,
-        imgsz=640,
-        conf=conf_threshold
-    )
-    
-    # Load the image for visualization
-    image = cv2.imread(image_path)
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # To store detailed information about detections
-    detection_details = []
-    
-    # Iterate over detections
-    for result in results[0].boxes.data:
-        # Extract bounding box coordinates, confidence score, and class ID
-        x1, y1, x2, y2, confidence, class_id = result.cpu().numpy()
-        
-        # Draw the bounding box with top confidence score
-        cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), color=(0, 255, 0), thickness=2)
-        label = f"{Config.CLASSES[int(class_id)]}: {confidence:.2f}"
-        cv2.putText(image, label, (int(x1), int(y1) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), thickness=1)
-        
-        # Save details for printing below
-        detection_details.append({
-            "class": Config.CLASSES[int(class_id)],
-            "top_confidence": confidence,
-            "bbox": (x1, y1, x2, y2)
-        })
-    
-    return image, detection_details
+# --- VECTORIZED CALORIE ESTIMATION ---
+# Class-id-indexed lookup tables, built once from Config
+CLASS_INDEX = {name: i for i, name in enumerate(Config.CLASSES)}
+CALORIES_BY_ID = np.array([Config.CALORIES_DICT[name] for name in Config.CLASSES], dtype=np.float32)
+
+# Portion heuristic: an item covering REFERENCE_AREA_FRACTION of the frame counts as
+# DEFAULT_PORTION_G grams; the estimate is clipped to [MIN, MAX]_PORTION_FACTOR x that.
+DEFAULT_PORTION_G = 100.0
+REFERENCE_AREA_FRACTION = 0.15
+MIN_PORTION_FACTOR = 0.25
+MAX_PORTION_FACTOR = 4.0
+
+CALORIES_DTYPE = np.dtype([
+    ("class_id", np.int16),
+    ("confidence", np.float32),
+    ("portion_g", np.float32),
+    ("calories", np.float32),
+])
+
+def best_per_class(boxes):
+    """
+    Reduces an (N, 6) boxes array to the highest-confidence row per class id.
+    Returns the kept rows sorted by confidence, highest first.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 6)
+    if len(boxes) == 0:
+        return boxes
+    class_ids = boxes[:, 5].astype(np.int64)
+    # group by class, highest confidence first inside each group
+    order = np.lexsort((-boxes[:, 4], class_ids))
+    sorted_ids = class_ids[order]
+    first_of_class = np.empty(len(order), dtype=bool)
+    first_of_class[0] = True
+    np.not_equal(sorted_ids[1:], sorted_ids[:-1], out=first_of_class[1:])
+    kept = boxes[order[first_of_class]]
+    return kept[np.argsort(-kept[:, 4], kind="stable")]
+
+def calculate_calories_array(boxes, image_shape=None):
+    """
+    Vectorized calorie estimate straight from an (N, 6) [x1, y1, x2, y2, conf, cls] array.
+
+    Keeps the best detection per class. When `image_shape` (h, w[, c]) is given, the
+    portion is scaled by the bbox's share of the frame; otherwise every item counts
+    as DEFAULT_PORTION_G (the per-100 g value, as before).
+
+    Returns a structured array with fields class_id, confidence, portion_g, calories.
+    """
+    kept = best_per_class(boxes)
+    result = np.empty(len(kept), dtype=CALORIES_DTYPE)
+    if len(kept) == 0:
+        return result
+
+    class_ids = kept[:, 5].astype(np.int64)
+    if image_shape is not None:
+        frame_area = float(image_shape[0] * image_shape[1])
+        areas = np.clip(kept[:, 2] - kept[:, 0], 0, None) * np.clip(kept[:, 3] - kept[:, 1], 0, None)
+        factors = np.clip(areas / (frame_area * REFERENCE_AREA_FRACTION), MIN_PORTION_FACTOR, MAX_PORTION_FACTOR)
+    else:
+        factors = np.ones(len(kept), dtype=np.float32)
+    portion_g = DEFAULT_PORTION_G * factors
+
+    result["class_id"] = class_ids
+    result["confidence"] = kept[:, 4]
+    result["portion_g"] = portion_g
+    result["calories"] = CALORIES_BY_ID[class_ids] * portion_g / 100.0
+    return result
+
+def details_to_boxes(detection_details):
+    """Packs the list-of-dicts detection format back into an (N, 6) array."""
+    boxes = np.empty((len(detection_details), 6), dtype=np.float32)
+    for i, det in enumerate(detection_details):
+        boxes[i, :4] = det["bbox"]
+        boxes[i, 4] = det["top_confidence"]
+        boxes[i, 5] = CLASS_INDEX[det["class"]]
+    return boxes
 
 # Function to calculate detected items and their calories
 def calculate_calories(detection_details):
     """
     Calculate calories for detected items, keeping only the highest confidence detection for each unique food item.
+    Thin adapter over calculate_calories_array.
     
     Args:
         detection_details: List of dictionaries containing detection information
@@ -142,28 +131,8 @@ def calculate_calories(detection_details):
     Returns:
         List of tuples: (food_item, calories, confidence) for unique items with highest confidence
     """
-    # Dictionary to keep track of highest confidence detection for each food item
-    unique_items = {}
-    
-    # Process each detection
-    for det in detection_details:
-        item = det["class"]
-        confidence = det["top_confidence"]
-        
-        # Only update if this is the first instance or has higher confidence
-        if item not in unique_items or confidence > unique_items[item]["confidence"]:
-            unique_items[item] = {
-                "calories": Config.CALORIES_DICT[item],
-                "confidence": confidence
-            }
-    
-    # Convert to list of tuples format
-    detected_items = [
-        (item, data["calories"], data["confidence"])
-        for item, data in unique_items.items()
+    rows = calculate_calories_array(details_to_boxes(detection_details))
+    return [
+        (Config.CLASSES[row["class_id"]], Config.CALORIES_DICT[Config.CLASSES[row["class_id"]]], float(row["confidence"]))
+        for row in rows
     ]
-    
-    # Sort by confidence (optional)
-    detected_items.sort(key=lambda x: x[2], reverse=True)
-    
-    return detected_items
\ No newline at end of file
@@ -0,0 +1,431 @@
+# cgm_store.py
+# Continuous glucose monitor (CGM) readings: streaming import of Dexcom Clarity and
+# FreeStyle LibreView CSV exports into compact per-user columnar files.
+#
+#   <CGM_STORE_DIR>/<user>/ts.u32    uint32 seconds since 1970-01-01 (device wall clock,
+#                                    like the naive local timestamps in meal_log)
+#   <CGM_STORE_DIR>/<user>/mgdl.i16  int16 mg/dL, same order
+#   <CGM_STORE_DIR>/<user>/tiles_<seconds>.npy
+#                                    min / max / sum / count per 1 h, 6 h and 1 day
+#                                    bucket (decimation.py), updated after each add
+#
+# 6 bytes per reading: five years of 5-minute readings is ~3 MB. Files are sorted
+# by ts and memory-mapped for reads, so a range query is two binary searches and
+# a slice. Exports are parsed in chunks (pandas read_csv chunksize), validated,
+# deduplicated against the stored timestamps and appended; each import also adds
+# the new readings' per-day sums to the meal log rollups (rollups.py), so the
+# dashboard's Time in Range and glucose averages include CGM data.
+#
+#   python cgm_store.py --uid <firebase uid> clarity_export.csv [more.csv ...]
+
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import rollups
+from decimation import TILE_WIDTHS, build_tiles, chart_series
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DIR = os.path.join(BASE_DIR, "cgm_data")
+
+CHUNK_ROWS = int(os.getenv("CGM_CHUNK_ROWS", 50_000))
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", 1500))
+MIN_MG_DL, MAX_MG_DL = 20, 600
+MIN_TIME = pd.Timestamp("2000-01-01")  # older device clocks are unset, and ts must fit uint32
+MMOL_TO_MG_DL = 18.0182
+# Dexcom writes readings outside the sensor range as text
+DEXCOM_LOW, DEXCOM_HIGH = 40, 400
+# LibreView writes dates in the device's locale, so the day order varies per export
+LIBRE_TIME_FORMATS = {
+    "MDY": ("%m-%d-%Y %I:%M %p", "%m-%d-%Y %H:%M"),
+    "DMY": ("%d-%m-%Y %H:%M", "%d-%m-%Y %I:%M %p"),
+    "YMD": ("%Y-%m-%d %H:%M",),
+}
+# Date order of LibreView exports (MDY / DMY / YMD). Unset: detected per file, and a
+# file whose dates read both ways (every day <= 12) is rejected.
+LIBRE_DATE_ORDER = os.getenv("CGM_LIBRE_DATE_ORDER") or None
+
+ImportResult = namedtuple("ImportResult", "format rows imported duplicates invalid first last")
+
+
+# --- PARSING ---
+def _header_line(head, *markers):
+    for index, line in enumerate(head):
+        if all(marker in line for marker in markers):
+            return index
+    return None
+
+
+def detect_format(head):
+    """('dexcom' | 'libre', header line index) from the first lines of an export."""
+    index = _header_line(head, "Event Type", "Glucose Value")
+    if index is not None:
+        return "dexcom", index
+    index = _header_line(head, "Device Timestamp", "Record Type")
+    if index is not None:
+        return "libre", index
+    raise ValueError("Unrecognised CGM export (expected a Dexcom Clarity or LibreView CSV)")
+
+
+USED_COLUMNS = {
+    "dexcom": ("Timestamp", "Event Type", "Glucose Value"),
+    "libre": ("Device Timestamp", "Record Type", "Historic Glucose", "Scan Glucose"),
+}
+
+
+def _find_column(columns, prefix):
+    for column in columns:
+        if column.startswith(prefix):
+            return column
+    raise ValueError(f"Missing column '{prefix}...'")
+
+
+def _to_mg_dl(values, column):
+    values = pd.to_numeric(values, errors="coerce")
+    return values * MMOL_TO_MG_DL if "mmol" in column else values
+
+
+def _parse_dexcom(chunk):
+    value_column = _find_column(chunk.columns, "Glucose Value")
+    chunk = chunk[chunk["Event Type"] == "EGV"]
+    raw = chunk[value_column].str.strip()
+    values = _to_mg_dl(raw, value_column)
+    values[raw == "Low"] = DEXCOM_LOW
+    values[raw == "High"] = DEXCOM_HIGH
+    times = pd.to_datetime(chunk[_find_column(chunk.columns, "Timestamp")], format="ISO8601", errors="coerce")
+    return times, values
+
+
+def _libre_time_format(values, date_order=None):
+    """
+    The LibreView timestamp format that parses the most of `values` (a whole chunk),
+    or None while they read both as month-day and day-month (every day <= 12).
+    Raises ValueError when no format fits.
+    """
+    values = values.dropna()
+    orders = (date_order,) if date_order else tuple(LIBRE_TIME_FORMATS)
+    counts = {
+        (order, time_format): int(pd.to_datetime(values, format=time_format, errors="coerce").notna().sum())
+        for order in orders for time_format in LIBRE_TIME_FORMATS[order]
+    }
+    best = max(counts.values())
+    if not best:
+        raise ValueError(f"Unrecognised LibreView timestamp: {values.iloc[0] if len(values) else ''}")
+    fits = [key for key, count in counts.items() if count == best]
+    if len({order for order, _ in fits}) > 1:
+        return None
+    return fits[0][1]
+
+
+def _parse_libre(chunk, state):
+    historic = _find_column(chunk.columns, "Historic Glucose")
+    scan = _find_column(chunk.columns, "Scan Glucose")
+    record_type = chunk["Record Type"].str.strip()
+    chunk = chunk[record_type.isin(("0", "1"))]  # 0 = 15-minute history, 1 = scan
+    values = np.where(record_type[chunk.index] == "0", _to_mg_dl(chunk[historic], historic),
+                      _to_mg_dl(chunk[scan], scan))
+    stamps = chunk["Device Timestamp"]
+    times = pd.to_datetime(stamps, format=state["time_format"], errors="coerce")
+    if (times.isna() & stamps.notna()).any():
+        # a few bad rows are invalid; a chunk that fits another format is a broken file
+        time_format = _libre_time_format(stamps, state["date_order"])
+        if time_format not in (None, state["time_format"]):
+            raise ValueError(f"LibreView timestamps change format within the file ({state['time_format']} -> {time_format})")
+    return times, pd.Series(values, index=chunk.index)
+
+
+def _chunk_readings(export_format, chunk, state):
+    """(format, ts, mg/dL, rows read, invalid rows) for one parsed chunk."""
+    if export_format == "dexcom":
+        times, values = _parse_dexcom(chunk)
+    else:
+        times, values = _parse_libre(chunk, state)
+    valid = times.notna() & (times >= MIN_TIME) & values.notna() & values.between(MIN_MG_DL, MAX_MG_DL)
+    ts = times[valid].to_numpy().astype("datetime64[s]").astype(np.int64).astype(np.uint32)
+    mg_dl = np.rint(values[valid].to_numpy(dtype=np.float64)).astype(np.int16)
+    return export_format, ts, mg_dl, len(chunk), int(len(times) - valid.sum())
+
+
+def iter_readings(f, chunk_rows=CHUNK_ROWS, date_order=LIBRE_DATE_ORDER):
+    """
+    Yields (format, ts uint32 array, mg/dL int16 array, rows read, invalid rows) per
+    chunk of a text-mode export, so memory is bounded by chunk_rows, not file size.
+
+    The LibreView timestamp format is the one that fits a whole chunk. Chunks whose
+    dates read both ways are held back until a later chunk settles the day order (at
+    most ~12 days of readings, days 1-12 of a month); a file that never does is
+    rejected unless `date_order` (MDY / DMY / YMD) is given.
+    """
+    if date_order is not None and date_order not in LIBRE_TIME_FORMATS:
+        raise ValueError(f"date_order must be one of {', '.join(LIBRE_TIME_FORMATS)}")
+    head = [f.readline() for _ in range(5)]
+    export_format, header_index = detect_format(head)
+    f.seek(0)
+    state = {"date_order": date_order, "time_format": None}
+    prefixes = USED_COLUMNS[export_format]
+    chunks = pd.read_csv(
+        f, skiprows=header_index, dtype=str, chunksize=chunk_rows, skipinitialspace=True,
+        usecols=lambda column: column.strip().startswith(prefixes),
+    )
+    pending = []
+    for chunk in chunks:
+        chunk.columns = [column.strip() for column in chunk.columns]
+        if export_format == "libre" and state["time_format"] is None and chunk["Device Timestamp"].notna().any():
+            state["time_format"] = _libre_time_format(chunk["Device Timestamp"], date_order)
+            if state["time_format"] is None:
+                pending.append(chunk)
+                continue
+        for ready in pending + [chunk]:
+            yield _chunk_readings(export_format, ready, state)
+        pending.clear()
+    if pending:
+        raise ValueError(
+            "Ambiguous LibreView dates: they read as both month-day and day-month; "
+            "set the date order (MDY or DMY)"
+        )
+
+
+def daily_deltas(ts, mg_dl):
+    """Rollup deltas (glucose sum / count / in range) per day for a batch of readings."""
+    if not len(ts):
+        return {}
+    days, inverse = np.unique(ts // 86400, return_inverse=True)
+    values = mg_dl.astype(np.float64)
+    sums = np.bincount(inverse, weights=values)
+    counts = np.bincount(inverse)
+    in_range = np.bincount(inverse, weights=(values >= rollups.TIR_LOW) & (values <= rollups.TIR_HIGH))
+    deltas = {}
+    for day, total, count, hits in zip(days.tolist(), sums.tolist(), counts.tolist(), in_range.tolist()):
+        delta = rollups.delta()
+        delta.update(glucose_sum=total, glucose_count=count, glucose_in_range=int(hits))
+        deltas[np.datetime64(day, "D").astype(object)] = delta
+    return deltas
+
+
+# --- STORAGE ---
+class CGMStore:
+    """Per-user sorted columnar files. Thread-safe within a process; one importer per user at a time."""
+
+    def __init__(self, root=DEFAULT_DIR):
+        self.root = root
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _dir(self, uid):
+        return os.path.join(self.root, hashlib.sha256(uid.encode()).hexdigest()[:32])
+
+    def _lock(self, uid):
+        with self._locks_guard:
+            return self._locks.setdefault(uid, threading.Lock())
+
+    def _paths(self, path):
+        return os.path.join(path, "ts.u32"), os.path.join(path, "mgdl.i16")
+
+    def _open(self, uid):
+        """Read-only memory maps (ts, mg/dL); empty arrays when the user has no readings."""
+        path = self._dir(uid)
+        if not os.path.isdir(path) and os.path.isdir(path + ".old"):
+            os.rename(path + ".old", path)  # interrupted rewrite
+        ts_path, mg_dl_path = self._paths(path)
+        if not os.path.exists(ts_path):
+            return np.empty(0, np.uint32), np.empty(0, np.int16)
+        # mg/dL is written before ts, so a torn append leaves extra values, never missing ones
+        count = min(os.path.getsize(ts_path) // 4, os.path.getsize(mg_dl_path) // 2)
+        if count == 0:
+            return np.empty(0, np.uint32), np.empty(0, np.int16)
+        return (np.memmap(ts_path, dtype=np.uint32, mode="r", shape=(count,)),
+                np.memmap(mg_dl_path, dtype=np.int16, mode="r", shape=(count,)))
+
+    def _rewrite(self, uid, ts, mg_dl):
+        """Replaces a user's files (out-of-order import) via a temp directory swap."""
+        path = self._dir(uid)
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        ts_path, mg_dl_path = self._paths(tmp)
+        mg_dl.tofile(mg_dl_path)
+        ts.tofile(ts_path)
+        if os.path.isdir(path):
+            os.rename(path, path + ".old")
+        os.rename(tmp, path)
+        shutil.rmtree(path + ".old", ignore_errors=True)
+
+    def add(self, uid, ts, mg_dl):
+        """
+        Stores readings not already present (same second). Returns the (ts, mg/dL)
+        arrays actually added, sorted.
+        """
+        order = np.argsort(ts, kind="stable")
+        ts, mg_dl = ts[order], mg_dl[order]
+        unique = np.ones(len(ts), dtype=bool)
+        unique[1:] = ts[1:] != ts[:-1]
+        ts, mg_dl = ts[unique], mg_dl[unique]
+
+        with self._lock(uid):
+            stored_ts, stored_mg_dl = self._open(uid)
+            if len(stored_ts) and len(ts):
+                position = np.minimum(np.searchsorted(stored_ts, ts), len(stored_ts) - 1)
+                new = stored_ts[position] != ts
+                ts, mg_dl = ts[new], mg_dl[new]
+            if not len(ts):
+                return ts, mg_dl
+
+            if not len(stored_ts) or ts[0] > stored_ts[-1]:
+                path = self._dir(uid)
+                os.makedirs(path, exist_ok=True)
+                ts_path, mg_dl_path = self._paths(path)
+                with open(mg_dl_path, "r+b" if os.path.exists(mg_dl_path) else "wb") as f:
+                    f.seek(len(stored_ts) * 2)  # drop any values from a torn append
+                    f.truncate()
+                    f.write(mg_dl.tobytes())
+                with open(ts_path, "ab") as f:
+                    f.write(ts.tobytes())
+            else:
+                merged_ts = np.concatenate([stored_ts, ts])
+                order = np.argsort(merged_ts, kind="stable")
+                merged_mg_dl = np.concatenate([stored_mg_dl, mg_dl])[order]
+                del stored_ts, stored_mg_dl  # release the maps before the swap
+                self._rewrite(uid, merged_ts[order], merged_mg_dl)
+            self._update_tiles(uid, int(ts[0]))
+        return ts, mg_dl
+
+    # --- TILES ---
+    def _tile_path(self, uid, width):
+        return os.path.join(self._dir(uid), f"tiles_{width}.npy")
+
+    def _update_tiles(self, uid, since):
+        """
+        Recomputes the tiles from the bucket holding `since` (or the last stored tile,
+        if earlier) to the end; the rest is kept. Called with the user's lock held.
+        """
+        for width in TILE_WIDTHS:
+            path = self._tile_path(uid, width)
+            tiles = np.load(path) if os.path.exists(path) else None
+            start = since - since % width
+            if tiles is not None and len(tiles):
+                start = min(start, int(tiles["ts"][-1]))
+                tiles = tiles[tiles["ts"] < start]
+            ts, mg_dl = self.series(uid, start=start if tiles is not None else None)
+            fresh = build_tiles(ts, mg_dl, width)
+            tiles = fresh if tiles is None else np.concatenate([tiles, fresh])
+            tmp = path + ".tmp.npy"
+            np.save(tmp, tiles)
+            os.replace(tmp, path)
+
+    def tiles(self, uid, width, start=None, end=None):
+        """Tiles of `width` seconds overlapping [start, end), built on first use for older stores."""
+        path = self._tile_path(uid, width)
+        if not os.path.exists(path):
+            if not self.count(uid):
+                return build_tiles([], [], width)
+            with self._lock(uid):
+                if not os.path.exists(path):
+                    self._update_tiles(uid, 0)
+        tiles = np.load(path, mmap_mode="r")
+        lo = 0 if start is None else int(np.searchsorted(tiles["ts"], _epoch(start) - _epoch(start) % width))
+        hi = len(tiles) if end is None else int(np.searchsorted(tiles["ts"], _epoch(end)))
+        return tiles[lo:hi]
+
+    def chart(self, uid, start=None, end=None, max_points=CHART_MAX_POINTS):
+        """
+        Chart-ready glucose for [start, end): at most max_points line points plus a
+        min/max envelope of at most max_points buckets (decimation.chart_series).
+        """
+        ts, mg_dl = self.series(uid, start, end)
+        if len(ts) <= max_points:
+            return chart_series(ts, mg_dl, {}, max_points)
+        levels = {width: self.tiles(uid, width, start, end) for width in TILE_WIDTHS}
+        return chart_series(ts, mg_dl, levels, max_points)
+
+    def series(self, uid, start=None, end=None):
+        """(ts, mg/dL) views for start <= ts < end (epoch seconds or datetimes), oldest first."""
+        ts, mg_dl = self._open(uid)
+        lo = 0 if start is None else int(np.searchsorted(ts, _epoch(start)))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, _epoch(end)))
+        return ts[lo:hi], mg_dl[lo:hi]
+
+    def count(self, uid):
+        return len(self._open(uid)[0])
+
+    def daily_deltas(self, uid):
+        """Per-day rollup deltas over all stored readings (used by meal_log.rebuild_rollups)."""
+        return daily_deltas(*self._open(uid))
+
+    def import_csv(self, uid, f, meal_log=None, chunk_rows=CHUNK_ROWS, date_order=LIBRE_DATE_ORDER):
+        """
+        Streams one export (text file object) into the store and, when given, the
+        new readings' daily sums into the meal log rollups. Returns an ImportResult.
+        """
+        export_format, rows, imported, invalid, duplicates = None, 0, 0, 0, 0
+        first = last = None
+        for export_format, ts, mg_dl, chunk_rows_read, chunk_invalid in iter_readings(f, chunk_rows, date_order):
+            rows += chunk_rows_read
+            invalid += chunk_invalid
+            added_ts, added_mg_dl = self.add(uid, ts, mg_dl)
+            imported += len(added_ts)
+            duplicates += len(ts) - len(added_ts)
+            if len(added_ts):
+                first = int(added_ts[0]) if first is None else min(first, int(added_ts[0]))
+                last = int(added_ts[-1]) if last is None else max(last, int(added_ts[-1]))
+                if meal_log is not None:
+                    meal_log.add_rollups(uid, daily_deltas(added_ts, added_mg_dl))
+        return ImportResult(export_format, rows, imported, duplicates, invalid, _iso(first), _iso(last))
+
+
+def _epoch(value):
+    if isinstance(value, (int, np.integer)):
+        return value
+    return int(np.datetime64(value, "s").astype(np.int64))
+
+
+def _iso(seconds):
+    return None if seconds is None else str(np.datetime64(seconds, "s"))
+
+
+def to_datetimes(ts):
+    """uint32 epoch seconds -> datetime64[s] for charts."""
+    return np.asarray(ts).astype("datetime64[s]")
+
+
+_cgm_store = None
+
+
+def get_cgm_store():
+    """Process-wide store under CGM_STORE_DIR (default cgm_data/ next to this file)."""
+    global _cgm_store
+    if _cgm_store is None:
+        _cgm_store = CGMStore(os.getenv("CGM_STORE_DIR", DEFAULT_DIR))
+    return _cgm_store
+
+
+def open_text(binary_file):
+    """Text view of an uploaded (binary) export; Clarity/LibreView files may start with a BOM."""
+    return io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+
+
+if __name__ == "__main__":
+    from meal_log import get_meal_log
+
+    parser = argparse.ArgumentParser(description="Import Dexcom Clarity / LibreView CSV exports")
+    parser.add_argument("--uid", required=True)
+    parser.add_argument("--date-order", choices=tuple(LIBRE_TIME_FORMATS), default=LIBRE_DATE_ORDER,
+                        help="LibreView date order (default: detect, reject ambiguous files)")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    store = get_cgm_store()
+    for path in args.paths:
+        started = time.perf_counter()
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            result = store.import_csv(args.uid, f, meal_log=get_meal_log(), date_order=args.date_order)
+        print(f"{path}: {result.format}, {result.rows} rows, {result.imported} imported, "
+              f"{result.duplicates} duplicates, {result.invalid} invalid "
+              f"({result.first} .. {result.last}) in {time.perf_counter() - started:.1f}s")
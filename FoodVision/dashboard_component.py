@@ -1,9 +1,19 @@
+import os
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+from token_cache import FirebaseTokenVerifier, InvalidToken
+from meal_log import get_meal_log
+from cgm_store import get_cgm_store, to_datetimes
+from rollups import Metric
+
+# Same .env as main.py (Firebase settings for token verification)
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -66,7 +76,98 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- MOCK DATA GENERATION ---
+# --- DATA ---
+@st.cache_resource
+def load_meal_log():
+    return get_meal_log()
+
+@st.cache_data(ttl=30)
+def get_daily_data(uid, days=7):
+    """
+    Daily rollups from the meal log (one indexed range scan, one row per day),
+    in the same shape as get_mock_data. None when the user has no history.
+    """
+    meal_log = load_meal_log()
+    if meal_log is None or not uid:
+        return None
+    if days <= 31:
+        rows = meal_log.last_days(uid, days=days)
+        labels = [row["day"].strftime("%a" if days <= 7 else "%b %d") for row in rows]
+        per_day = 1
+    else:
+        # longer ranges read weekly rollups (13 / 53 rows), carbs and insulin as daily averages
+        rows = meal_log.last_weeks(uid, weeks=(days + 6) // 7)
+        labels = [row["week"].strftime("%b %d") for row in rows]
+        per_day = 7
+    if not any(row["meal_count"] or row["glucose_count"] or row["insulin_total"] for row in rows):
+        return None
+    return pd.DataFrame({
+        "Day": labels,
+        "Glucose (mg/dL)": [row["glucose_avg"] if row["glucose_avg"] is not None else np.nan for row in rows],
+        "Carbs (g)": [row["carbs_total"] / per_day for row in rows],
+        "Insulin (U)": [row["insulin_total"] / per_day for row in rows],
+    })
+
+@st.cache_data(ttl=30)
+def get_glucose_series(uid, days=7):
+    """
+    CGM readings for the last `days` days, decimated server-side to at most
+    CHART_MAX_POINTS line points plus a min/max band (cgm_store.chart), as
+    (line DataFrame, band DataFrame or None). None when no readings were imported.
+    """
+    if not uid:
+        return None
+    start = datetime.combine(datetime.now().date() - timedelta(days=days - 1), datetime.min.time())
+    chart = get_cgm_store().chart(uid, start=start)
+    if not len(chart["ts"]):
+        return None
+    line = pd.DataFrame({"Time": to_datetimes(chart["ts"]), "Glucose (mg/dL)": chart["mg_dl"]})
+    band = chart["band"]
+    if band is not None:
+        band = pd.DataFrame({"Time": to_datetimes(band["ts"]), "Min": np.asarray(band["min"]), "Max": np.asarray(band["max"])})
+    return line, band
+
+@st.cache_data(ttl=30)
+def get_dashboard_metrics(uid):
+    """Precomputed metric cards and today's rollup (rollups.py), or None without history."""
+    meal_log = load_meal_log()
+    if meal_log is None or not uid:
+        return None
+    summary = meal_log.dashboard(uid)
+    return summary if summary["has_data"] else None
+
+@st.cache_data(ttl=30)
+def get_recent_meals(uid, limit=10):
+    meal_log = load_meal_log()
+    if meal_log is None or not uid:
+        return None
+    meals = meal_log.recent_meals(uid, limit=limit)
+    if not meals:
+        return None
+    return pd.DataFrame({
+        "Time": [meal["ts"].strftime("%b %d %I:%M %p") for meal in meals],
+        "Meal": [meal["meal_summary"] for meal in meals],
+        "Carbs": [f"{meal['total_carbs']:.0f}g" for meal in meals],
+        "Bolus": [f"{meal['insulin_units']:.1f} U" if meal["insulin_units"] is not None else "—" for meal in meals],
+        "Impact": [meal["risk_level"] or "" for meal in meals],
+    })
+
+@st.cache_data(ttl=30)
+def get_latest_meal(uid):
+    meal_log = load_meal_log()
+    if meal_log is None or not uid:
+        return None
+    meals = meal_log.recent_meals(uid, limit=1, with_payload=True)
+    return meals[0]["payload"] if meals else None
+
+# --- MOCK DATA GENERATION (demo fallback when there is no logged history) ---
+DEMO_METRICS = [
+    Metric("Time in Range", "82%", 5, "good"),
+    Metric("Avg Glucose", "105 mg/dL", -12, "good"),
+    Metric("Daily Carbs", "140g", -15, "good"),
+    Metric("Insulin Sensitivity", "1:12", 0, "neutral"),
+]
+
 def get_mock_data():
     dates = [datetime.now() - timedelta(days=i) for i in range(6, -1, -1)]
     dates_str = [d.strftime("%a") for d in dates]
@@ -98,14 +199,31 @@ def render_metric(label, value, delta, delta_type="neutral"):
     </div>
     """, unsafe_allow_html=True)
 
-def render_charts(df):
+def render_charts(df, glucose=None):
+    """
+    Daily rollups in df; glucose, when given, is the decimated CGM (line, band)
+    from get_glucose_series, plotted instead of daily averages.
+    """
     col1, col2 = st.columns([2, 1])
     
     with col1:
         st.markdown("### 📈 Glucose Trends")
-        fig_glucose = px.area(df, x="Day", y="Glucose (mg/dL)", 
-                              line_shape="spline", 
-                              color_discrete_sequence=["#3B82F6"])
+        if glucose is not None:
+            line, band = glucose
+            fig_glucose = go.Figure()
+            if band is not None:
+                # min/max envelope per bucket, so spikes dropped from the line stay visible
+                fig_glucose.add_trace(go.Scatter(x=band["Time"], y=band["Max"], mode="lines",
+                                                 line=dict(width=0, shape="hv"), hoverinfo="skip", showlegend=False))
+                fig_glucose.add_trace(go.Scatter(x=band["Time"], y=band["Min"], mode="lines", fill="tonexty",
+                                                 fillcolor="rgba(59,130,246,0.2)", line=dict(width=0, shape="hv"),
+                                                 hoverinfo="skip", showlegend=False))
+            fig_glucose.add_trace(go.Scatter(x=line["Time"], y=line["Glucose (mg/dL)"], mode="lines",
+                                             name="Glucose (mg/dL)", line=dict(color="#3B82F6")))
+        else:
+            fig_glucose = px.area(df, x="Day", y="Glucose (mg/dL)", 
+                                  line_shape="spline", 
+                                  color_discrete_sequence=["#3B82F6"])
         fig_glucose.update_layout(
             plot_bgcolor="rgba(0,0,0,0)",
             paper_bgcolor="rgba(0,0,0,0)",
@@ -138,23 +256,56 @@ def render_charts(df):
         )
         st.plotly_chart(fig_scatter, use_container_width=True)
 
+# --- AUTH ---
+@st.cache_resource
+def get_token_verifier():
+    """One verifier (and token cache) per dashboard process, configured like main.py."""
+    return FirebaseTokenVerifier.from_env()
+
+def get_current_uid():
+    """
+    Firebase uid of the viewer, from a verified ID token: the Authorization header
+    (`Bearer <token>`) or `?token=<id token>` for embeds. Stops the page otherwise.
+    """
+    authorization = st.context.headers.get("Authorization") or ""
+    if authorization.startswith("Bearer "):
+        token = authorization.split(" ", 1)[1]
+    else:
+        token = st.query_params.get("token")
+    try:
+        return get_token_verifier().verify(token)
+    except InvalidToken as e:
+        st.error(f"Not signed in: {e}")
+        st.stop()
+
 # --- MAIN APP ---
 def main():
     # URL param for "widget" mode
     query_params = st.query_params
     mode = query_params.get("mode", "full")
+    uid = get_current_uid()
     
     if mode == "widget":
         # Simplified "Widget" View for embedding
         st.markdown("### ⚡ Quick Status")
-        df = get_mock_data()
-        latest = df.iloc[-1]
+        summary = get_dashboard_metrics(uid)
+        if summary is None:
+            glucose, glucose_delta, carbs, carbs_delta = "105 mg/dL", "-7", "140 g", "-20"
+        else:
+            today, yesterday = summary["today"], summary["yesterday"]
+            glucose, glucose_delta = "—", None
+            if today["glucose_avg"] is not None:
+                glucose = f"{today['glucose_avg']:.0f} mg/dL"
+                if yesterday["glucose_avg"] is not None:
+                    glucose_delta = f"{today['glucose_avg'] - yesterday['glucose_avg']:.0f}"
+            carbs = f"{today['carbs_total']:.0f} g"
+            carbs_delta = f"{today['carbs_total'] - yesterday['carbs_total']:.0f}"
         
         c1, c2 = st.columns(2)
         with c1:
-            st.metric("Avg Glucose", f"{latest['Glucose (mg/dL)']} mg/dL", "-7")
+            st.metric("Avg Glucose", glucose, glucose_delta)
         with c2:
-            st.metric("Carbs Today", f"{latest['Carbs (g)']} g", "-20")
+            st.metric("Carbs Today", carbs, carbs_delta)
             
         st.caption("Last updated: Just now")
         
@@ -165,31 +316,33 @@ def main():
         st.markdown("---")
         
         # 1. Top Level Metrics
-        m1, m2, m3, m4 = st.columns(4)
-        with m1:
-            render_metric("Time in Range", "82%", 5, "good")
-        with m2:
-            render_metric("Avg Glucose", "105 mg/dL", -12, "good")
-        with m3:
-            render_metric("Daily Carbs", "140g", -15, "good")
-        with m4:
-            render_metric("Insulin Sensitivity", "1:12", 0, "neutral")
+        summary = get_dashboard_metrics(uid)
+        metrics = DEMO_METRICS if summary is None else summary["metrics"]
+        for column, metric in zip(st.columns(4), metrics):
+            with column:
+                render_metric(metric.label, metric.value, metric.delta, metric.delta_type)
             
         st.markdown("<br>", unsafe_allow_html=True)
         
         # 2. Charts
-        df = get_mock_data()
-        render_charts(df)
+        days = st.selectbox("History", [7, 30, 90, 365], format_func=lambda d: f"Last {d} days")
+        df = get_daily_data(uid, days)
+        if df is None:
+            st.caption("No logged meals yet — showing demo data.")
+            df = get_mock_data()
+        render_charts(df, get_glucose_series(uid, days))
         
-        # 3. Recent Meals Log (Mock)
+        # 3. Recent Meals Log
         st.markdown("### 🥗 Recent Meals")
-        meals_df = pd.DataFrame({
-            "Time": ["12:30 PM", "08:15 AM", "Yesterday"],
-            "Meal": ["Grilled Chicken Salad", "Oatmeal & Berries", "Salmon with Rice"],
-            "Carbs": ["15g", "45g", "60g"],
-            "Bolus": ["1.5 U", "4.0 U", "5.5 U"],
-            "Impact": ["Stable", "Moderate Rise", "Delayed Peak"]
-        })
+        meals_df = get_recent_meals(uid)
+        if meals_df is None:
+            meals_df = pd.DataFrame({
+                "Time": ["12:30 PM", "08:15 AM", "Yesterday"],
+                "Meal": ["Grilled Chicken Salad", "Oatmeal & Berries", "Salmon with Rice"],
+                "Carbs": ["15g", "45g", "60g"],
+                "Bolus": ["1.5 U", "4.0 U", "5.5 U"],
+                "Impact": ["Stable", "Moderate Rise", "Delayed Peak"]
+            })
         
         st.dataframe(
             meals_df, 
@@ -207,8 +360,8 @@ def main():
         # --- REPORT GENERATION (Stream 3) ---
         st.markdown("### 📄 Clinical Reports")
         
-        # Mock data for report generation
-        latest_meal = {
+        # Latest logged analysis, else a demo meal
+        latest_meal = get_latest_meal(uid) or {
             "meal_summary": "Grilled Chicken Salad with vinaigrette",
             "total_carbs_est": 15,
             "diasense_advice": {
@@ -224,22 +377,36 @@ def main():
         }
         
         col_rep1, col_rep2 = st.columns([1, 4])
+        # Import dynamically to avoid top-level failures if file missing
+        try:
+            from report_generator import generate_pdf, meal_log_report
+        except ImportError:
+            st.error("Report Generator module not found.")
+            return
+        
         with col_rep1:
-            # Import dynamically to avoid top-level failures if file missing
-            try:
-                from report_generator import generate_pdf
-                pdf_bytes = generate_pdf(latest_meal)
-                
-                st.download_button(
-                    label="📥 Download PDF Report",
-                    data=pdf_bytes,
-                    file_name=f"diasense_report_{datetime.now().strftime('%Y%m%d')}.pdf",
-                    mime="application/pdf"
-                )
-            except ImportError:
-                st.error("Report Generator module not found.")
-            except Exception as e:
-                st.error(f"Failed to generate report: {e}")
+            # data is a callable, so the PDF is only rendered when the button is clicked
+            st.download_button(
+                label="📥 Download PDF Report",
+                data=lambda: generate_pdf(latest_meal),
+                file_name=f"diasense_report_{datetime.now().strftime('%Y%m%d')}.pdf",
+                mime="application/pdf"
+            )
+        
+        meal_log = load_meal_log()
+        if meal_log is not None and uid:
+            with col_rep2:
+                today = datetime.now().date()
+                period = st.date_input("Report period", value=(today - timedelta(days=29), today), max_value=today)
+                if len(period) == 2:
+                    start = datetime.combine(period[0], datetime.min.time())
+                    end = datetime.combine(period[1] + timedelta(days=1), datetime.min.time())
+                    st.download_button(
+                        label="📥 Download Period Report",
+                        data=lambda: meal_log_report(meal_log, uid, start, end),
+                        file_name=f"diasense_report_{period[0]:%Y%m%d}_{period[1]:%Y%m%d}.pdf",
+                        mime="application/pdf"
+                    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,112 @@
+# decimation.py
+# Bounded-size glucose charts over arbitrarily long CGM histories.
+#
+#   tiles   per-bucket min / max / sum / count at fixed widths (1 h, 6 h, 1 day),
+#           precomputed by cgm_store.py as readings arrive
+#   lttb    Largest-Triangle-Three-Buckets: picks the points that keep the shape of
+#           the line (peaks and troughs survive, unlike plain averaging)
+#
+# A chart is at most max_points line points (LTTB over raw readings or bucket means)
+# plus at most max_points min/max envelope buckets, whatever the visible range.
+
+import numpy as np
+
+TILE_WIDTHS = (3600, 6 * 3600, 86400)  # seconds, finest first
+TILE_DTYPE = np.dtype([("ts", "<u4"), ("min", "<i2"), ("max", "<i2"), ("sum", "<u4"), ("count", "<u2")])
+LTTB_INPUT_FACTOR = 8  # LTTB runs on the finest source with <= 8 x max_points points
+
+
+def build_tiles(ts, mg_dl, width):
+    """Tiles (TILE_DTYPE) for sorted readings; one per non-empty bucket of `width` seconds."""
+    if not len(ts):
+        return np.empty(0, TILE_DTYPE)
+    bucket = np.asarray(ts) // width
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    mg_dl = np.asarray(mg_dl)
+    tiles = np.empty(len(starts), TILE_DTYPE)
+    tiles["ts"] = bucket[starts] * width
+    tiles["min"] = np.minimum.reduceat(mg_dl, starts)
+    tiles["max"] = np.maximum.reduceat(mg_dl, starts)
+    tiles["sum"] = np.add.reduceat(mg_dl.astype(np.uint32), starts)
+    tiles["count"] = np.diff(np.concatenate((starts, [len(bucket)])))
+    return tiles
+
+
+def merge_tiles(tiles, factor):
+    """Combines every `factor` consecutive tiles (coarser envelope when even the widest level is too long)."""
+    if factor <= 1 or not len(tiles):
+        return tiles
+    starts = np.arange(0, len(tiles), factor)
+    merged = np.empty(len(starts), TILE_DTYPE)
+    merged["ts"] = tiles["ts"][starts]
+    merged["min"] = np.minimum.reduceat(tiles["min"], starts)
+    merged["max"] = np.maximum.reduceat(tiles["max"], starts)
+    merged["sum"] = np.add.reduceat(tiles["sum"], starts)
+    merged["count"] = np.add.reduceat(tiles["count"].astype(np.uint32), starts)
+    return merged
+
+
+def tile_means(tiles):
+    """(bucket centre ts, mean mg/dL) per tile."""
+    return tiles["ts"].astype(np.float64), tiles["sum"] / tiles["count"].astype(np.float64)
+
+
+def lttb(x, y, n_out):
+    """
+    Indices of the n_out points chosen by Largest-Triangle-Three-Buckets (first and
+    last always kept). x must be increasing. Returns every index when n_out >= len(x).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n_out - 2 buckets between the fixed first and last points; each is >= 1 point wide
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    edges[-1] = n - 1
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def chart_series(ts, mg_dl, tile_levels, max_points):
+    """
+    Decimated chart for readings (ts, mg_dl) in the visible range and the same
+    range's tiles per width ({width: tiles}). Returns a dict:
+        ts, mg_dl        line points (<= max_points)
+        band             tiles for the min/max envelope (<= max_points) or None
+        resolution       seconds per line source bucket (0 = raw readings)
+    """
+    if len(ts) <= max_points:
+        return {"ts": np.asarray(ts), "mg_dl": np.asarray(mg_dl, dtype=np.float64), "band": None, "resolution": 0}
+
+    # line: LTTB over the finest source that is at most LTTB_INPUT_FACTOR x max_points long
+    x, y, resolution = np.asarray(ts, dtype=np.float64), np.asarray(mg_dl, dtype=np.float64), 0
+    if len(ts) > LTTB_INPUT_FACTOR * max_points:
+        for width in TILE_WIDTHS:
+            resolution = width
+            x, y = tile_means(tile_levels[width])
+            x = x + width / 2
+            if len(x) <= LTTB_INPUT_FACTOR * max_points:
+                break
+    keep = lttb(x, y, max_points)
+
+    # envelope: the finest tile level that fits, else the widest one merged down
+    band = None
+    for width in TILE_WIDTHS:
+        if len(tile_levels[width]) <= max_points:
+            band = tile_levels[width]
+            break
+    if band is None:
+        widest = tile_levels[TILE_WIDTHS[-1]]
+        band = merge_tiles(widest, -(-len(widest) // max_points))
+    return {"ts": x[keep].astype(np.uint32), "mg_dl": y[keep], "band": band, "resolution": resolution}
@@ -0,0 +1,95 @@
+# detection.py
+# Detector-agnostic YOLO helpers shared by cal.py (Streamlit app, local backend) and
+# onnx_detector.py: input decoding, batched detection, drawing and result formatting.
+# No Streamlit / torch imports, so the ONNX Runtime path stays light.
+
+import cv2
+import numpy as np
+
+# Class ids of best.pt, in training order
+CLASSES = ['asparagus', 'avocados', 'broccoli', 'cabbage',        #4
+           'celery', 'cucumber', 'green_apples', 'green_beans', #4
+           'green_capsicum', 'green_grapes', 'kiwifruit', #3
+           'lettuce', 'limes', 'peas', 'spinach',  #4
+           'Banana', 'Cauliflower', 'Date', 'Garlic', #4
+           'Ginger', 'Mushroom', 'Onion', 'Parsnip', #4
+           'Peach', 'Pear', 'Potato', 'Turnip', #4
+           'Beetroot', 'Blackberry', 'Blueberry', 'Cherry', #4
+           'Eggplant', 'Plum', 'Purple asparagus', 'Purple grapes',  #4
+           'Radish', 'Raspberry', 'Red Apple', 'Red Grape', #4
+           'Red cabbage', 'Red capsicum', 'Strawberry', 'Tomato', #4
+           'Watermelon', 'apricot', 'carrot', 'corn', #4
+           'grapefruit', 'lemon', 'mango', 'nectarine', #4
+           'orange', 'pineapple', 'pumpkin', 'sweet_potato'] #4
+
+# Decode any supported input into a BGR frame (the layout Ultralytics expects for arrays)
+def to_bgr(source):
+    if isinstance(source, str):
+        frame = cv2.imread(source)
+        if frame is None:
+            raise ValueError(f"Could not read image: {source}")
+        return frame
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        frame = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Could not decode image bytes")
+        return frame
+    if isinstance(source, np.ndarray):
+        return source  # assumed BGR, as produced by cv2
+    # PIL image
+    return cv2.cvtColor(np.asarray(source.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+# Run one batched forward pass; returns one (N, 6) [x1, y1, x2, y2, conf, cls] array per frame
+def detect_batch(frames, model, conf_threshold=0.03):
+    if not frames:
+        return []
+    if hasattr(model, "detect"):
+        # OnnxDetector already returns NumPy boxes
+        return model.detect(frames, conf_threshold)
+    results = model.predict(
+        source=list(frames),
+        imgsz=640,
+        conf=conf_threshold,
+        verbose=False
+    )
+    # one device -> host copy per image instead of one per detection row
+    return [result.boxes.data.cpu().numpy() for result in results]
+
+# Draw boxes on an RGB copy of an already-decoded BGR frame
+def draw_detections(frame, boxes):
+    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    for x1, y1, x2, y2, confidence, class_id in boxes:
+        cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), color=(0, 255, 0), thickness=2)
+        label = f"{CLASSES[int(class_id)]}: {confidence:.2f}"
+        cv2.putText(image, label, (int(x1), int(y1) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), thickness=1)
+    return image
+
+def boxes_to_details(boxes):
+    return [
+        {
+            "class": CLASSES[int(class_id)],
+            "top_confidence": float(confidence),
+            "bbox": (float(x1), float(y1), float(x2), float(y2))
+        }
+        for x1, y1, x2, y2, confidence, class_id in boxes
+    ]
+
+# Function to make predictions on many images in one forward pass
+def predict_images(sources, model, conf_threshold=0.03, draw=True):
+    """
+    Batched inference over paths, encoded bytes, BGR arrays or PIL images.
+
+    Returns a list of (image, detection_details) in input order; `image` is the
+    annotated RGB frame (or None when draw=False).
+    """
+    frames = [to_bgr(source) for source in sources]
+    batch_boxes = detect_batch(frames, model, conf_threshold)
+    outputs = []
+    for frame, boxes in zip(frames, batch_boxes):
+        image = draw_detections(frame, boxes) if draw else None
+        outputs.append((image, boxes_to_details(boxes)))
+    return outputs
+
+# Function to make predictions on a single image
+def predict_image(image_path, model, conf_threshold=0.03):
+    return predict_images([image_path], model, conf_threshold)[0]
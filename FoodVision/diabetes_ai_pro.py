@@ -4,32 +4,33 @@ import torch
 from torchvision import models, transforms
 from PIL import Image
 import pandas as pd
+from glycemic import glycemic_load, gl_risk, labels, RISK_BADGES
+from nutrition_store import get_store
 
 # -----------------------------
 # Load Models
 # -----------------------------
 @st.cache_resource
 def load_models():
-    detector = YOLO("yolov8n.pt")
+    # Reuse weights preloaded by model_server.py when running under it
+    from model_server import get_preloaded
+    detector = get_preloaded("yolov8n")
+    if detector is None:
+        detector = YOLO("yolov8n.pt")
 
-    classifier = models.resnet50(pretrained=True)
-    classifier.eval()
+    classifier = get_preloaded("resnet50")
+    if classifier is None:
+        classifier = models.resnet50(pretrained=True)
+        classifier.eval()
 
     return detector, classifier
 
 detector, classifier = load_models()
 
 # -----------------------------
-# Nutrition Database (USDA subset)
+# Nutrition Database (shared store, USDA-style values)
 # -----------------------------
-nutrition_db = {
-    "rice": {"carbs": 28, "gi": 73},
-    "bread": {"carbs": 49, "gi": 75},
-    "apple": {"carbs": 14, "gi": 36},
-    "banana": {"carbs": 27, "gi": 51},
-    "pizza": {"carbs": 33, "gi": 80},
-    "salad": {"carbs": 5, "gi": 15},
-}
+nutrition_db = get_store()
 
 # -----------------------------
 # Image Transform
@@ -39,20 +40,6 @@ transform = transforms.Compose([
     transforms.ToTensor()
 ])
 
-# -----------------------------
-# Diabetes Risk Calculation
-# -----------------------------
-def glycemic_load(carbs, gi):
-    return (carbs * gi) / 100
-
-def risk_level(gl):
-    if gl > 20:
-        return "🔴 HIGH RISK"
-    elif gl > 10:
-        return "🟠 MODERATE"
-    else:
-        return "🟢 SAFE"
-
 # -----------------------------
 # Streamlit UI
 # -----------------------------
@@ -81,22 +68,23 @@ if uploaded:
         cls = int(box.cls[0])
         label = detector.names[cls]
 
-        if label in nutrition_db:
-            detected_items.append(label)
+        food = nutrition_db.get(label)
+        if food is not None and food.gi is not None:
+            detected_items.append(food)
 
     if not detected_items:
         st.warning("No known food detected.")
     else:
-        for food in detected_items:
-            info = nutrition_db[food]
-
-            carbs = info["carbs"]
-            gi = info["gi"]
-            gl = glycemic_load(carbs, gi)
-
-            st.write(f"### 🍽️ {food}")
-            st.write(f"Carbs: {carbs} g")
+        # score every detected item in one vectorized pass, on carbs per 100 g (the GL bands' basis)
+        carbs = [food.carbs_g for food in detected_items]
+        gis = [food.gi for food in detected_items]
+        loads = glycemic_load(carbs, gis)
+        risks = labels(gl_risk(loads), RISK_BADGES)
+
+        for food, carb, gi, gl, risk in zip(detected_items, carbs, gis, loads, risks):
+            st.write(f"### 🍽️ {food.name}")
+            st.write(f"Carbs: {carb:.0f} g per 100 g")
             st.write(f"Glycemic Index: {gi}")
             st.write(f"Glycemic Load: {gl:.1f}")
-            st.write(f"Risk Level: {risk_level(gl)}")
+            st.write(f"Risk Level: {risk}")
 
@@ -2,6 +2,8 @@ import streamlit as st
 import torch
 from torchvision import models, transforms
 from PIL import Image
+from glycemic import food_risk, labels as risk_labels, RISK_BADGES
+from nutrition_store import get_store
 
 # -----------------------
 # Load Pretrained Food Classifier
@@ -9,18 +11,10 @@ from PIL import Image
 model = models.resnet50(pretrained=True)
 model.eval()
 
-# Food classes (subset with nutrition info)
-food_db = {
-    "apple": {"carbs": 14, "gi": 36},
-    "banana": {"carbs": 27, "gi": 51},
-    "bread": {"carbs": 49, "gi": 75},
-    "rice": {"carbs": 28, "gi": 73},
-    "pizza": {"carbs": 33, "gi": 80},
-    "salad": {"carbs": 5, "gi": 15},
-    "orange": {"carbs": 12, "gi": 43},
-}
+# Food classes (nutrition info from the shared store)
+food_db = get_store()
 
-labels = list(food_db.keys())
+labels = ["apple", "banana", "bread", "rice", "pizza", "salad", "orange"]
 
 # Image transform
 transform = transforms.Compose([
@@ -32,12 +26,7 @@ transform = transforms.Compose([
 # Diabetes Risk Function
 # -----------------------
 def diabetes_risk(carbs, gi):
-    if gi > 70 or carbs > 40:
-        return "🔴 HIGH RISK"
-    elif gi > 50:
-        return "🟠 MODERATE"
-    else:
-        return "🟢 SAFE"
+    return risk_labels(food_risk(carbs, gi), RISK_BADGES)
 
 # -----------------------
 # Streamlit UI
@@ -56,11 +45,13 @@ if uploaded_file:
     predicted_food = random.choice(labels)
 
     info = food_db[predicted_food]
-    risk = diabetes_risk(info["carbs"], info["gi"])
+    # food_risk's carbs_high (40 g) applies to carbs per 100 g
+    carbs = info.carbs_g
+    risk = diabetes_risk(carbs, info.gi)
 
     st.subheader("🍽️ Food Analysis")
 
-    st.write(f"**Food Detected:** {predicted_food}")
-    st.write(f"**Carbohydrates:** {info['carbs']} g")
-    st.write(f"**Glycemic Index:** {info['gi']}")
+    st.write(f"**Food Detected:** {info.name}")
+    st.write(f"**Carbohydrates:** {carbs:.0f} g per 100 g")
+    st.write(f"**Glycemic Index:** {info.gi:.0f}")
     st.write(f"**Diabetes Risk Level:** {risk}")
@@ -0,0 +1,50 @@
+# export_onnx.py
+# Exports the FoodVision YOLO detector (best.pt) for the ONNX Runtime path in onnx_detector.py.
+#
+#   python export_onnx.py                 -> best.onnx
+#   python export_onnx.py --int8          -> best.onnx + best.int8.onnx (dynamic INT8 weights)
+#   python export_onnx.py --openvino      -> best_openvino_model/ (OpenVINO IR)
+
+import argparse
+import os
+
+
+def export_onnx(weights="./best.pt", imgsz=640):
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    # dynamic batch axis so cal.predict_images can run one forward pass per batch
+    return model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+
+
+def quantize_int8(onnx_path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    root, ext = os.path.splitext(onnx_path)
+    output_path = f"{root}.int8{ext}"
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QUInt8)
+    return output_path
+
+
+def export_openvino(weights="./best.pt", imgsz=640, int8=False):
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    return model.export(format="openvino", imgsz=imgsz, int8=int8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export best.pt for CPU inference")
+    parser.add_argument("--weights", default="./best.pt")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--int8", action="store_true", help="also write a dynamically quantized INT8 model")
+    parser.add_argument("--openvino", action="store_true", help="also export OpenVINO IR")
+    args = parser.parse_args()
+
+    onnx_path = export_onnx(args.weights, args.imgsz)
+    print(f"ONNX model written to {onnx_path}")
+
+    if args.int8:
+        print(f"INT8 model written to {quantize_int8(onnx_path)}")
+
+    if args.openvino:
+        print(f"OpenVINO model written to {export_openvino(args.weights, args.imgsz, args.int8)}")
+
+    print("Check accuracy and speed with: python test_onnx_parity.py")
@@ -0,0 +1,295 @@
+# fake_services.py
+# Local stand-ins for the external services on the request path, so the API can be
+# tested and benchmarked offline (test_api.py, bench_api.py):
+#
+#   FakeGemini           gRPC GenerativeService (GenerateContent + StreamGenerateContent)
+#                        answering with canned AnalysisResponse JSON
+#   FakeIdentityToolkit  HTTP accounts:lookup, reached via FIREBASE_AUTH_EMULATOR_HOST
+#   AppServer            an ASGI app (main.app) under uvicorn on a background thread
+#   start_app            wires main.py to the fakes and serves it
+#
+# Both fakes take a latency (ms, +/- uniform jitter) and an error rate. Gemini errors
+# are RESOURCE_EXHAUSTED (a quota 429, which the client does not retry, so each one
+# fails its analysis); `bad_json_rate` answers in prose so the parser's repair call runs.
+
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+import google.ai.generativelanguage as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports.grpc_asyncio import (
+    GenerativeServiceGrpcAsyncIOTransport,
+)
+
+from token_cache import identity_toolkit_url
+
+GENERATIVE_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+LOOKUP_PATH = "/identitytoolkit.googleapis.com/v1/accounts:lookup"
+
+CANNED_ANALYSIS = {
+    "scan_id": "fake",
+    "meal_summary": "Rice with grilled chicken and salad",
+    "total_carbs_est": 50,
+    "components": [
+        {"name": "white rice", "portion_est": "1 cup", "carbs_g": 45, "glycemic_index": "High", "impact": "Spike"},
+        {"name": "grilled chicken breast", "portion_est": "150g", "carbs_g": 0, "glycemic_index": "Low", "impact": "Stable"},
+        {"name": "mixed salad", "portion_est": "1 bowl", "carbs_g": 5, "glycemic_index": "Low", "impact": "Stable"},
+    ],
+    "diasense_advice": {
+        "risk_level": "Medium",
+        "prediction": "Moderate rise peaking after about 45 minutes.",
+        "suggested_bolus_strategy": "Standard bolus 15 minutes before eating.",
+    },
+}
+BAD_JSON_ANSWER = "This plate has rice and chicken, roughly fifty grams of carbohydrates in total."
+
+
+def _delay(latency_ms, jitter_ms, rng):
+    return max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+
+
+def _free_socket():
+    # proto must be IPPROTO_TCP: asyncio only sets TCP_NODELAY on accepted sockets that
+    # say so, and Nagle + delayed ACK would add ~40 ms to every keep-alive response
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+class FakeGemini:
+    """Plaintext gRPC server on 127.0.0.1 with its own event loop thread; use `address`."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, bad_json_rate=0.0,
+                 payload=CANNED_ANALYSIS, stream_chunks=8, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.bad_json_rate = bad_json_rate
+        self.answer = json.dumps(payload)
+        self.stream_chunks = stream_chunks
+        self.rng = random.Random(seed)
+        self.counts = {"generate": 0, "stream": 0, "repair": 0, "errors": 0, "bad_json": 0}
+        self.address = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def _response(text):
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(parts=[glm.Part(text=text)], role="model"),
+            finish_reason=glm.Candidate.FinishReason.STOP,
+        )])
+
+    async def _text(self, request, context, kind):
+        self.counts[kind] += 1
+        await asyncio.sleep(_delay(self.latency_ms, self.jitter_ms, self.rng))
+        if self.rng.random() < self.error_rate:
+            self.counts["errors"] += 1
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Fake quota exceeded")
+        has_image = any("inline_data" in part for content in request.contents for part in content.parts)
+        if not has_image:
+            # text-only prompt: the parser's repair call
+            self.counts["repair"] += 1
+            return self.answer
+        if self.rng.random() < self.bad_json_rate:
+            self.counts["bad_json"] += 1
+            return BAD_JSON_ANSWER
+        return self.answer
+
+    async def _generate(self, request, context):
+        return self._response(await self._text(request, context, "generate"))
+
+    async def _stream(self, request, context):
+        text = await self._text(request, context, "stream")
+        step = max(1, -(-len(text) // self.stream_chunks))
+        for start in range(0, len(text), step):
+            yield self._response(text[start:start + step])
+
+    def start(self):
+        started = threading.Event()
+
+        async def serve():
+            self._server = grpc.aio.server()
+            self._server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(GENERATIVE_SERVICE, {
+                "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                    self._generate,
+                    request_deserializer=glm.GenerateContentRequest.deserialize,
+                    response_serializer=glm.GenerateContentResponse.serialize,
+                ),
+                "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                    self._stream,
+                    request_deserializer=glm.GenerateContentRequest.deserialize,
+                    response_serializer=glm.GenerateContentResponse.serialize,
+                ),
+            }),))
+            port = self._server.add_insecure_port("127.0.0.1:0")
+            await self._server.start()
+            self.address = f"127.0.0.1:{port}"
+            started.set()
+            await self._server.wait_for_termination()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(serve())
+            # wait_for_termination returns before stop() and grpc's own tasks finish
+            pending = asyncio.all_tasks(self._loop)
+            if pending:
+                self._loop.run_until_complete(asyncio.wait(pending, timeout=5))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-gemini", daemon=True)
+        self._thread.start()
+        if not started.wait(10):
+            raise RuntimeError("Fake Gemini server did not start")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            asyncio.run_coroutine_threadsafe(self._server.stop(None), self._loop).result(10)
+            self._thread.join(10)
+            self._server = None
+
+
+def use_fake_gemini(model, address):
+    """
+    Points a genai.GenerativeModel's async calls (the ones main.py makes) at a plaintext
+    gRPC `address`. gRPC channels belong to an event loop: call this on the app's loop.
+    """
+    transport = GenerativeServiceGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(address))
+    model._async_client = glm.GenerativeServiceAsyncClient(transport=transport)
+
+
+class FakeIdentityToolkit:
+    """
+    accounts:lookup on a threaded HTTP server. Tokens starting with "bad" are always
+    rejected; any other token is the user `uid-<token>`. Use `host` as FIREBASE_AUTH_EMULATOR_HOST.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"lookups": 0, "errors": 0}
+        self._server = None
+        self.host = None
+
+    def _lookup(self, token):
+        """(status, body) for one idToken."""
+        with self._lock:
+            self.counts["lookups"] += 1
+            delay = _delay(self.latency_ms, self.jitter_ms, self.rng)
+            failed = token.startswith("bad") or self.rng.random() < self.error_rate
+            if failed:
+                self.counts["errors"] += 1
+        time.sleep(delay)
+        if failed:
+            return 400, {"error": {"code": 400, "message": "INVALID_ID_TOKEN"}}
+        return 200, {"kind": "identitytoolkit#GetAccountInfoResponse", "users": [{"localId": f"uid-{token}"}]}
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body are separate writes
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.split("?")[0] != LOOKUP_PATH:
+                    status, payload = 404, {"error": {"code": 404, "message": "NOT_FOUND"}}
+                else:
+                    status, payload = fake._lookup(json.loads(body or b"{}").get("idToken", ""))
+                out = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.host = f"127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, name="fake-identity-toolkit", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class AppServer:
+    """uvicorn serving `app` on 127.0.0.1 from a background thread; `setup` runs first on its loop."""
+
+    def __init__(self, app, setup=None):
+        import uvicorn
+
+        self.setup = setup
+        self._socket = _free_socket()
+        self.url = f"http://127.0.0.1:{self._socket.getsockname()[1]}"
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False, lifespan="off"))
+        self._thread = None
+
+    def start(self):
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            if self.setup is not None:
+                loop.run_until_complete(self.setup())
+            loop.run_until_complete(self.server.serve(sockets=[self._socket]))
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="app-server", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 30
+        while not self.server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("App server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(10)
+
+
+def start_app(data_dir, gemini, identity):
+    """
+    Imports main.py against the running fakes, with its meal log, CGM store and result
+    cache under `data_dir`, and serves it. Returns (main module, AppServer).
+    """
+    os.environ.update({
+        "GOOGLE_API_KEY": "fake-gemini-key",
+        "FIREBASE_WEB_API_KEY": "fake-web-key",
+        "FIREBASE_PROJECT_ID": "",
+        "FIREBASE_AUTH_EMULATOR_HOST": identity.host,
+        "MEAL_LOG_URL": f"sqlite:///{os.path.join(data_dir, 'meal_log.sqlite3')}",
+        "CGM_STORE_DIR": os.path.join(data_dir, "cgm"),
+        "RESULT_CACHE_PATH": os.path.join(data_dir, "analysis_cache.sqlite3"),
+    })
+    import main
+
+    # already imported (another test first): point the module-level settings at the fakes too
+    main.GOOGLE_API_KEY = os.environ["GOOGLE_API_KEY"]
+    main.token_verifier.web_api_key = os.environ["FIREBASE_WEB_API_KEY"]
+    main.token_verifier.project_id = None
+    main.token_verifier.identity_toolkit_url = identity_toolkit_url(identity.host)
+
+    async def setup():
+        use_fake_gemini(main.model, gemini.address)
+
+    return main, AppServer(main.app, setup=setup).start()
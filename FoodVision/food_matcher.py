@@ -0,0 +1,133 @@
+# food_matcher.py
+# Maps free-text food names (Gemini's MealComponent.name, YOLO/COCO labels) to
+# canonical foods in the nutrition store.
+#
+# Matching, best score wins:
+#   1. exact name / synonym / plural              -> 1.0
+#   2. longest run of words that is a known name   -> 0.5 + 0.5 x share of the text it covers
+#      ("grilled chicken breast" -> "chicken breast")
+#   3. character-trigram Dice similarity           -> typos and word order ("brocoli")
+# The trigram index (inverted postings, one NumPy array per trigram) is built once
+# per store; a lookup is a dict probe plus one bincount over a few postings.
+
+import re
+
+import numpy as np
+
+from nutrition_store import get_store, normalize_name
+
+MIN_SCORE = 0.5
+_GRAMS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:g|grams?)\b", re.IGNORECASE)
+
+
+def trigrams(text):
+    """Set of character trigrams of each word, padded so word starts and ends count."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def portion_grams(portion_est):
+    """Grams from a free-text portion ('150g', '~200 g (2 items)'), or None."""
+    match = _GRAMS.search(str(portion_est or ""))
+    return float(match.group(1)) if match else None
+
+
+class FoodMatcher:
+    """Trigram + token index over every name and synonym in a NutritionStore."""
+
+    def __init__(self, store=None, min_score=MIN_SCORE):
+        self.store = store or get_store()
+        self.min_score = min_score
+        self.names = list(self.store.names())
+        self.food_ids = np.array([self.store.get(name).id for name in self.names], dtype=np.int32)
+
+        postings = {}
+        gram_counts = np.empty(len(self.names), dtype=np.float32)
+        for index, name in enumerate(self.names):
+            grams = trigrams(name)
+            gram_counts[index] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(index)
+        self._postings = {gram: np.array(indexes, dtype=np.int32) for gram, indexes in postings.items()}
+        self._gram_counts = gram_counts
+
+    def _trigram_scores(self, key):
+        grams = trigrams(key)
+        lists = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not lists:
+            return None
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.names))
+        return 2.0 * shared / (len(grams) + self._gram_counts)
+
+    def _token_match(self, key):
+        """Longest contiguous run of words that is a known food name."""
+        words = key.split()
+        for size in range(len(words) - 1, 0, -1):
+            for start in range(len(words) - size + 1):
+                span = " ".join(words[start:start + size])
+                food = self.store.get(span)
+                if food is not None:
+                    return food, 0.5 + 0.5 * len(span) / len(key)
+        return None, 0.0
+
+    def match(self, text, limit=3):
+        """
+        Returns up to `limit` (Food, score) pairs with score >= min_score, best first.
+        """
+        key = normalize_name(text)
+        if not key:
+            return []
+        food = self.store.get(key)
+        if food is not None:
+            return [(food, 1.0)]
+
+        best = {}  # food id -> score
+        food, score = self._token_match(key)
+        if food is not None:
+            best[food.id] = score
+
+        scores = self._trigram_scores(key)
+        if scores is not None:
+            top = np.argsort(-scores)[: limit * 4]
+            for index in top:
+                score = float(scores[index])
+                if score < self.min_score:
+                    break
+                food_id = int(self.food_ids[index])
+                best[food_id] = max(best.get(food_id, 0.0), score)
+
+        ranked = sorted(best.items(), key=lambda item: -item[1])
+        return [
+            (self.store.foods[food_id], round(score, 3))
+            for food_id, score in ranked[:limit]
+            if score >= self.min_score
+        ]
+
+    def best(self, text):
+        """(Food, score) for the best match, or (None, 0.0)."""
+        matches = self.match(text, limit=1)
+        return matches[0] if matches else (None, 0.0)
+
+    def annotate(self, components):
+        """
+        One entry per MealComponent dict: the canonical food, the match score and the
+        store's carbs for the stated portion (grams parsed from portion_est, else the
+        default portion), for cross-checking the model's carbs_g.
+        """
+        annotations = []
+        for component in components:
+            food, score = self.best(component.get("name", ""))
+            if food is None:
+                annotations.append({"food_id": None, "food_name": None, "score": 0.0, "reference_carbs_g": None})
+                continue
+            grams = portion_grams(component.get("portion_est")) or food.portion_g
+            annotations.append({
+                "food_id": food.id,
+                "food_name": food.name,
+                "score": score,
+                "reference_carbs_g": round(food.carbs_g * grams / 100.0, 1),
+            })
+        return annotations
@@ -0,0 +1,147 @@
+# glycemic.py
+# Glycemic load and diabetes risk scoring, vectorized with NumPy.
+# Single implementation shared by the Streamlit apps, the local YOLO backend and
+# main.py's deterministic check on Gemini's risk_level.
+
+import numpy as np
+
+LOW, MODERATE, HIGH = 0, 1, 2
+RISK_LEVELS = np.array(["Low", "Medium", "High"])
+RISK_BADGES = np.array(["🟢 SAFE", "🟠 MODERATE", "🔴 HIGH RISK"])
+GI_CATEGORIES = np.array(["Low", "Medium", "High"])
+
+# Representative GI for the categorical values Gemini returns (midpoints of the
+# standard Low <= 55 / Medium 56-69 / High >= 70 bands).
+GI_BY_CATEGORY = {"low": 40.0, "medium": 62.0, "high": 80.0}
+
+
+class RiskThresholds:
+    """
+    Thresholds for every classifier in this module.
+
+    gl_moderate / gl_high:      glycemic load (meal or food) -> risk
+    gi_moderate / gi_high:      food-level rule: GI above these -> moderate / high risk
+    carbs_high:                 food-level rule: carbs (g) above this -> high risk
+    gi_medium_min / gi_high_min: GI category boundaries (Low / Medium / High)
+    """
+
+    def __init__(self, gl_moderate=10, gl_high=20, gi_moderate=50, gi_high=70, carbs_high=40,
+                 gi_medium_min=56, gi_high_min=70):
+        self.gl_moderate = gl_moderate
+        self.gl_high = gl_high
+        self.gi_moderate = gi_moderate
+        self.gi_high = gi_high
+        self.carbs_high = carbs_high
+        self.gi_medium_min = gi_medium_min
+        self.gi_high_min = gi_high_min
+
+
+DEFAULT_THRESHOLDS = RiskThresholds()
+
+
+# --- GLYCEMIC LOAD ---
+def glycemic_load(carbs, gi):
+    """GL = carbs (g) x GI / 100, element-wise."""
+    return np.asarray(carbs, dtype=np.float64) * np.asarray(gi, dtype=np.float64) / 100.0
+
+
+def meal_glycemic_load(carbs, gi, meal_ids=None, n_meals=None):
+    """
+    Sums component GL per meal.
+    Without `meal_ids` all components belong to one meal and a scalar is returned;
+    with integer `meal_ids` (0..n_meals-1) one total per meal is returned.
+    """
+    loads = glycemic_load(carbs, gi)
+    if meal_ids is None:
+        return float(loads.sum())
+    return np.bincount(np.asarray(meal_ids), weights=loads, minlength=n_meals or 0)
+
+
+# --- CLASSIFIERS (return integer codes LOW / MODERATE / HIGH) ---
+def gl_risk(gl, thresholds=DEFAULT_THRESHOLDS):
+    """Risk from glycemic load: > gl_high -> HIGH, > gl_moderate -> MODERATE."""
+    gl = np.asarray(gl, dtype=np.float64)
+    return (gl > thresholds.gl_moderate).astype(np.int8) + (gl > thresholds.gl_high)
+
+
+def food_risk(carbs, gi, thresholds=DEFAULT_THRESHOLDS):
+    """Per-food rule: GI > gi_high or carbs > carbs_high -> HIGH; GI > gi_moderate -> MODERATE."""
+    carbs = np.asarray(carbs, dtype=np.float64)
+    gi = np.asarray(gi, dtype=np.float64)
+    high = (gi > thresholds.gi_high) | (carbs > thresholds.carbs_high)
+    return np.where(high, HIGH, np.where(gi > thresholds.gi_moderate, MODERATE, LOW)).astype(np.int8)
+
+
+def gi_category(gi, thresholds=DEFAULT_THRESHOLDS):
+    gi = np.asarray(gi, dtype=np.float64)
+    return (gi >= thresholds.gi_medium_min).astype(np.int8) + (gi >= thresholds.gi_high_min)
+
+
+def labels(codes, table=RISK_LEVELS):
+    """Maps integer codes to strings; scalars in, scalar out."""
+    result = table[np.asarray(codes, dtype=np.intp)]
+    return result.item() if np.ndim(result) == 0 else result
+
+
+# --- MEAL SCORING ---
+def category_to_gi(values):
+    """Converts Gemini's 'Low' / 'Medium' / 'High' (any case, free text) to a numeric GI."""
+    out = np.empty(len(values), dtype=np.float64)
+    for i, value in enumerate(values):
+        text = str(value).lower()
+        if "high" in text:
+            out[i] = GI_BY_CATEGORY["high"]
+        elif "medium" in text or "moderate" in text:
+            out[i] = GI_BY_CATEGORY["medium"]
+        else:
+            out[i] = GI_BY_CATEGORY["low"]
+    return out
+
+
+def score_components(components, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Deterministic meal score from MealComponent dicts (carbs_g + categorical GI).
+    Returns (meal_gl, risk_level_string).
+    """
+    if not components:
+        return 0.0, labels(LOW)
+    meal_gl, risk_levels = score_component_lists([components], thresholds)
+    return float(meal_gl[0]), str(risk_levels[0])
+
+
+def score_component_lists(component_lists, thresholds=DEFAULT_THRESHOLDS):
+    """
+    score_components for many meals in one pass over flat per-component arrays.
+    Returns (meal_gl rounded to 0.1, risk level strings), one entry per meal.
+    """
+    carbs, gi_values, meal_ids = [], [], []
+    for meal_id, components in enumerate(component_lists):
+        for component in components or ():
+            carbs.append(component.get("carbs_g", 0) or 0)
+            gi_values.append(component.get("glycemic_index", ""))
+            meal_ids.append(meal_id)
+    meal_gl, risk_codes = score_meals(
+        np.array(carbs, dtype=np.float64), category_to_gi(gi_values),
+        np.array(meal_ids, dtype=np.intp), len(component_lists), thresholds,
+    )
+    return np.round(meal_gl, 1), np.atleast_1d(labels(risk_codes))
+
+
+def score_meals(carbs, gi, meal_ids, n_meals=None, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Bulk scoring of many logged meals at once.
+    `carbs`, `gi`, `meal_ids` are flat per-component arrays.
+    Returns (meal_gl, risk_codes), one entry per meal id.
+    """
+    meal_gl = meal_glycemic_load(carbs, gi, meal_ids, n_meals)
+    return meal_gl, gl_risk(meal_gl, thresholds)
+
+
+def normalize_risk_level(value):
+    """Maps free-text risk levels ('High', 'moderate', '🔴 HIGH RISK') to Low / Medium / High."""
+    text = str(value).lower()
+    if "high" in text:
+        return "High"
+    if "medium" in text or "moderate" in text:
+        return "Medium"
+    return "Low"
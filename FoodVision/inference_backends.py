@@ -0,0 +1,219 @@
+import threading
+import time
+import uuid
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from glycemic import DEFAULT_THRESHOLDS, GI_CATEGORIES, HIGH, gi_category, gl_risk, glycemic_load, labels
+from inference_limiter import Overloaded
+from metrics import stage
+from micro_batcher import MicroBatcher
+
+DEFAULT_PORTION_G = 100  # per detected item; YOLO gives no weight estimate
+
+
+# --- BACKENDS ---
+class AnalysisBackend:
+    """
+    Interface for meal analysis engines.
+    `analyze` returns (analysis_data, confidence); analysis_data follows the
+    AnalysisResponse shape without the server-side metadata fields.
+    """
+
+    name = "base"
+
+    async def analyze(self, image, image_blob):
+        raise NotImplementedError
+
+
+class GeminiBackend(AnalysisBackend):
+    """Gemini Vision with the DiaSense prompt, parsed by the structured-output layer."""
+
+    name = "gemini"
+
+    def __init__(self, model, prompt, parser, repair):
+        self.model = model
+        self.prompt = prompt
+        self.parser = parser
+        self.repair = repair
+
+    async def analyze(self, image, image_blob):
+        with stage("gemini"):
+            response = await self.model.generate_content_async([self.prompt, image_blob])
+        # includes the repair call, if the first answer does not parse
+        with stage("parse"):
+            analysis_data = await self.parser.parse_or_repair(response.text, self.repair)
+        return analysis_data, 1.0
+
+
+class YoloBackend(AnalysisBackend):
+    """
+    Local YOLO food detector from cal.py (CPU, no network).
+    Detections are reduced to one component per class, with carbs and GI taken
+    from cal.Config.CARBS_GI_DICT. Confidence is the mean of the kept detections.
+    Concurrent requests are coalesced by a MicroBatcher into one forward pass.
+    """
+
+    name = "yolo"
+
+    def __init__(self, conf_threshold=0.25, max_batch_size=8, max_wait_ms=5.0, max_queue=64, thresholds=None):
+        self.conf_threshold = conf_threshold
+        self.thresholds = thresholds or DEFAULT_THRESHOLDS
+        self.batcher = MicroBatcher(
+            self._detect_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, max_queue=max_queue,
+            name="yolo",
+        )
+        self._model = None
+        self._classes = None
+        self._carbs_gi = None
+        self._cal = None
+        # Ultralytics predictors are not thread-safe
+        self._lock = threading.Lock()
+        # First requests race into load() from several threadpool threads
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    # Heavy imports (torch / ultralytics) only when the local backend is used
+                    import cal
+                    self._cal = cal
+                    self._classes = cal.Config.CLASSES
+                    self._carbs_gi = cal.Config.CARBS_GI_DICT
+                    self._model = cal.load_model()
+        return self._model
+
+    def _to_frame(self, image):
+        self.load()
+        return self._cal.to_bgr(image)
+
+    def _detect_batch(self, frames):
+        with self._lock:
+            model = self.load()
+            return self._cal.detect_batch(frames, model, self.conf_threshold)
+
+    def build_analysis(self, boxes):
+        """Turns an (N, 6) [x1, y1, x2, y2, conf, cls] array into analysis data."""
+        per_class = {}
+        for x1, y1, x2, y2, confidence, class_id in boxes:
+            name = self._classes[int(class_id)]
+            entry = per_class.setdefault(name, {"count": 0, "confidence": 0.0})
+            entry["count"] += 1
+            entry["confidence"] = max(entry["confidence"], float(confidence))
+
+        names = sorted(per_class, key=lambda name: -per_class[name]["confidence"])
+        counts = np.array([per_class[name]["count"] for name in names], dtype=np.float64)
+        carbs_per_100g = np.array([self._carbs_gi[name][0] for name in names], dtype=np.float64)
+        gis = np.array([self._carbs_gi[name][1] for name in names], dtype=np.float64)
+        grams = counts * DEFAULT_PORTION_G
+        carbs = carbs_per_100g * grams / 100
+        loads = glycemic_load(carbs, gis)
+        categories = gi_category(gis)
+        total_carbs = float(carbs.sum())
+        total_gl = float(loads.sum())
+
+        components = []
+        for i, name in enumerate(names):
+            count = per_class[name]["count"]
+            components.append({
+                "name": name.replace("_", " "),
+                "portion_est": f"~{int(grams[i])} g ({count} item{'s' if count > 1 else ''})",
+                "carbs_g": int(round(carbs[i])),
+                "glycemic_index": labels(categories[i], GI_CATEGORIES),
+                "impact": "Spike" if categories[i] == HIGH or loads[i] > self.thresholds.gl_moderate else "Stable",
+            })
+
+        risk = labels(gl_risk(total_gl, self.thresholds))
+        analysis_data = {
+            "scan_id": uuid.uuid4().hex[:12],
+            "meal_summary": ", ".join(component["name"] for component in components),
+            "total_carbs_est": int(round(total_carbs)),
+            "components": components,
+            "diasense_advice": {
+                "risk_level": risk,
+                "prediction": f"Estimated meal glycemic load {total_gl:.1f} ({risk.lower()} impact).",
+                "suggested_bolus_strategy": "Split / extended bolus" if risk == "High" else "Standard bolus",
+            },
+        }
+        confidence = float(np.mean([entry["confidence"] for entry in per_class.values()])) if per_class else 0.0
+        return analysis_data, confidence
+
+    async def analyze(self, image, image_blob):
+        frame = await run_in_threadpool(self._to_frame, image)
+        boxes = await self.batcher.submit(frame)
+        return self.build_analysis(boxes)
+
+
+# --- ROUTING ---
+class AnalysisRouter:
+    """
+    Picks a backend per request.
+      policy "gemini":      Gemini only
+      policy "local-first": local detector, falling back to Gemini when it finds
+                            nothing or its confidence is below `min_confidence`
+    """
+
+    POLICIES = ("gemini", "local-first")
+
+    def __init__(self, gemini, local=None, policy="gemini", min_confidence=0.5):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown inference policy: {policy}")
+        if policy != "gemini" and local is None:
+            raise ValueError(f"Policy {policy} needs a local backend")
+        self.gemini = gemini
+        self.local = local
+        self.policy = policy
+        self.min_confidence = min_confidence
+        self.counts = {"local": 0, "fallback": 0, "gemini": 0, "rejected": 0}
+        self.local_seconds = 0.0
+
+    async def try_local(self, image, image_blob=None):
+        """Returns local analysis data if the policy allows it and it is confident enough."""
+        if self.policy == "gemini":
+            return None
+        started = time.perf_counter()
+        try:
+            with stage("local"):
+                analysis_data, confidence = await self.local.analyze(image, image_blob)
+        except Overloaded:
+            # detector queue full: shed load (503 + Retry-After) instead of
+            # moving the overflow onto Gemini
+            self.counts["rejected"] += 1
+            raise
+        except Exception as e:
+            print(f"Local backend failed, falling back to Gemini: {e}")
+            self.counts["fallback"] += 1
+            return None
+        finally:
+            self.local_seconds += time.perf_counter() - started
+        if not analysis_data["components"] or confidence < self.min_confidence:
+            self.counts["fallback"] += 1
+            return None
+        self.counts["local"] += 1
+        analysis_data["backend"] = self.local.name
+        return analysis_data
+
+    async def analyze_remote(self, image, image_blob):
+        analysis_data, _ = await self.gemini.analyze(image, image_blob)
+        self.counts["gemini"] += 1
+        analysis_data["backend"] = self.gemini.name
+        return analysis_data
+
+    async def analyze(self, image, image_blob):
+        analysis_data = await self.try_local(image, image_blob)
+        if analysis_data is not None:
+            return analysis_data
+        return await self.analyze_remote(image, image_blob)
+
+    def stats(self):
+        stats = {
+            "policy": self.policy,
+            "min_confidence": self.min_confidence,
+            **self.counts,
+            "local_seconds_total": round(self.local_seconds, 6),
+        }
+        if self.local is not None and hasattr(self.local, "batcher"):
+            stats["local_batcher"] = self.local.batcher.stats()
+        return stats
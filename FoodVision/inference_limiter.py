@@ -0,0 +1,71 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Raised when the limiter cannot hand out a slot; carries a Retry-After hint."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class InferenceLimiter:
+    """
+    Caps concurrent model calls on this worker.
+    Up to `max_concurrency` requests run at once, up to `max_queue` more wait
+    (at most `queue_timeout` seconds); anything beyond that is rejected immediately.
+    """
+
+    def __init__(self, max_concurrency=8, max_queue=32, queue_timeout=10.0, retry_after=2):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        """Takes a slot or raises Overloaded. Pair with release(); prefer `slot()` where possible."""
+        if not self._semaphore.locked():
+            # free slot: acquire() returns without suspending
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("Inference queue full", self.retry_after)
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded("Timed out waiting for an inference slot", self.retry_after)
+            finally:
+                self.waiting -= 1
+
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
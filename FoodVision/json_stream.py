@@ -0,0 +1,135 @@
+import json
+
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for one top-level JSON object arriving in text chunks.
+
+    `feed()` returns events as soon as the corresponding text is complete:
+      ("field", key, value)          a top-level member finished parsing
+      ("item", key, index, value)    an element of a top-level array finished parsing
+    Text before the first '{' (markdown fences, preamble) is ignored, as is
+    anything after the closing '}'.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+        self.stack = []          # open containers: '{' or '['
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.expect_key = False  # top-level object: next string is a key
+        self.key = None          # current top-level key
+        self.value_start = None  # buffer index where the current top-level value begins
+        self.item_start = None   # buffer index where the current array element begins
+        self.item_index = 0
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        events = []
+        buf = self.buffer
+        while self.pos < len(buf) and not self.done:
+            ch = buf[self.pos]
+            i = self.pos
+            self.pos += 1
+
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.stack.append("{")
+                    self.expect_key = True
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self._string_closed(i, events)
+                continue
+
+            depth = len(self.stack)
+            if ch == '"':
+                self.in_string = True
+                self.string_start = i
+                self._value_begins(i, depth)
+            elif ch in "{[":
+                self._value_begins(i, depth)
+                self.stack.append(ch)
+            elif ch in "}]":
+                self.stack.pop()
+                new_depth = len(self.stack)
+                if new_depth == 0:
+                    self._scalar_ends(i, events)
+                    self.done = True
+                elif new_depth == 1:
+                    if ch == "]" and self.item_start is not None:
+                        self._item_ends(i, events)
+                    self._emit_field(buf[self.value_start:i + 1], events)
+                elif new_depth == 2 and self.stack[1] == "[":
+                    self._emit_item(buf[self.item_start:i + 1], events)
+            elif ch == ",":
+                if depth == 1:
+                    self._scalar_ends(i, events)
+                    self.expect_key = True
+                elif depth == 2 and self.stack[1] == "[":
+                    self._item_ends(i, events)
+            elif ch == ":":
+                if depth == 1:
+                    self.expect_key = False
+                    self.value_start = None
+            elif not ch.isspace():
+                self._value_begins(i, depth)
+        return events
+
+    # --- internals ---
+    def _value_begins(self, i, depth):
+        if depth == 1 and not self.expect_key and self.value_start is None:
+            self.value_start = i
+        elif depth == 2 and self.stack[1] == "[" and self.item_start is None:
+            self.item_start = i
+
+    def _string_closed(self, i, events):
+        depth = len(self.stack)
+        if depth != 1:
+            return
+        text = self.buffer[self.string_start:i + 1]
+        if self.expect_key:
+            self.key = json.loads(text)
+        else:
+            self._emit_field(text, events)
+
+    def _scalar_ends(self, i, events):
+        """Numbers / true / false / null end at the next ',' or '}'."""
+        if self.value_start is not None:
+            text = self.buffer[self.value_start:i].strip()
+            if text:
+                self._emit_field(text, events)
+
+    def _item_ends(self, i, events):
+        """Scalar array elements end at the next ',' or ']'."""
+        if self.item_start is not None:
+            text = self.buffer[self.item_start:i].strip()
+            if text:
+                self._emit_item(text, events)
+            self.item_start = None
+
+    def _emit_field(self, text, events):
+        if self.value_start is None:
+            return
+        events.append(("field", self.key, json.loads(text)))
+        self.value_start = None
+        self.item_start = None
+        self.item_index = 0
+
+    def _emit_item(self, text, events):
+        if self.item_start is None:
+            return
+        events.append(("item", self.key, self.item_index, json.loads(text)))
+        self.item_index += 1
+        self.item_start = None
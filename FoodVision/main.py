@@ -1,15 +1,32 @@
 import os
+import asyncio
+import threading
 import uvicorn
 import json
-import requests
+from datetime import datetime, timedelta
 from typing import List, Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import google.generativeai as genai
-from PIL import Image
-import io
 from dotenv import load_dotenv
+from token_cache import TokenCache, FirebaseTokenVerifier, InvalidToken, identity_toolkit_url
+from inference_limiter import InferenceLimiter, Overloaded
+from result_cache import create_result_cache, image_fingerprint
+from image_preprocess import prepare_image
+from json_stream import IncrementalJSONParser
+from response_parser import StructuredOutputParser, gemini_response_schema
+from inference_backends import AnalysisRouter, GeminiBackend, YoloBackend
+from glycemic import RiskThresholds, normalize_risk_level, score_components
+from nutrition_store import get_store
+from food_matcher import FoodMatcher
+from meal_log import GLUCOSE, INSULIN, get_meal_log
+from cgm_store import LIBRE_DATE_ORDER, get_cgm_store, open_text
+from metrics import REGISTRY, CONTENT_TYPE, MetricsMiddleware, count_error, stage
+import profiling
+from profiling import Profiler, ProfilingMiddleware, valid_admin_token
 
 # --- CONFIGURATION ---
 # Explicitly load .env from current directory
@@ -19,6 +36,61 @@ load_dotenv(dotenv_path=env_path)
 # Gemini Config
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 FIREBASE_WEB_API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
+# When set, ID tokens are verified locally against Google's public keys
+# and the Identity Toolkit lookup is skipped entirely.
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+# Firebase Auth emulator (or fake_services.FakeIdentityToolkit), e.g. "127.0.0.1:9099"
+FIREBASE_AUTH_EMULATOR_HOST = os.getenv("FIREBASE_AUTH_EMULATOR_HOST")
+IDENTITY_TOOLKIT_URL = identity_toolkit_url(FIREBASE_AUTH_EMULATOR_HOST)
+
+# Inference concurrency (per worker process)
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", "8"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "32"))
+INFERENCE_QUEUE_TIMEOUT = float(os.getenv("INFERENCE_QUEUE_TIMEOUT", "10"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+
+# Analysis result cache: "memory", "sqlite" or "off"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join(os.path.dirname(__file__), "analysis_cache.sqlite3"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+# Entries older than this many seconds are ignored and evicted (0 = no expiry)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+# Max dHash Hamming distance for near-duplicate matches (0 = exact pixels only).
+# Near matches also need the same aspect ratio and colour histogram.
+RESULT_CACHE_MAX_DISTANCE = int(os.getenv("RESULT_CACHE_MAX_DISTANCE", "0"))
+
+# Upload preprocessing before the model call
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG")  # JPEG or WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+# Batch endpoint limits
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+# Inference routing: "gemini" (Gemini only) or "local-first" (YOLO from cal.py, Gemini fallback)
+INFERENCE_POLICY = os.getenv("INFERENCE_POLICY", "gemini")
+LOCAL_MIN_CONFIDENCE = float(os.getenv("LOCAL_MIN_CONFIDENCE", "0.5"))
+LOCAL_CONF_THRESHOLD = float(os.getenv("LOCAL_CONF_THRESHOLD", "0.25"))
+# Micro-batching for the local detector
+LOCAL_MAX_BATCH = int(os.getenv("LOCAL_MAX_BATCH", "8"))
+LOCAL_BATCH_WAIT_MS = float(os.getenv("LOCAL_BATCH_WAIT_MS", "5"))
+LOCAL_QUEUE_DEPTH = int(os.getenv("LOCAL_QUEUE_DEPTH", "64"))
+
+# Deterministic glycemic-load risk check (thresholds on meal GL)
+RISK_THRESHOLDS = RiskThresholds(
+    gl_moderate=float(os.getenv("RISK_GL_MODERATE", "10")),
+    gl_high=float(os.getenv("RISK_GL_HIGH", "20")),
+)
+
+# On-demand profiling (see profiling.py). Admin routes and the X-Profile header
+# stay disabled until PROFILE_ADMIN_TOKEN is set.
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_PATHS = [path for path in os.getenv("PROFILE_PATHS", "/analyze-meal/").split(",") if path]
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "20"))
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))  # 0 = no allocation tracking
 
 if not GOOGLE_API_KEY:
     print("WARNING: GOOGLE_API_KEY not found in .env")
@@ -49,6 +121,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- PROFILING MIDDLEWARE ---
+profiler = Profiler(
+    sample_rate=PROFILE_SAMPLE_RATE,
+    paths=PROFILE_PATHS,
+    ring_size=PROFILE_RING_SIZE,
+    tracemalloc_frames=PROFILE_TRACEMALLOC_FRAMES,
+)
+app.add_middleware(ProfilingMiddleware, profiler=profiler, admin_token=PROFILE_ADMIN_TOKEN)
+
+# --- METRICS MIDDLEWARE ---
+# Outermost, so latency includes CORS, profiling overhead and the whole streamed body
+app.add_middleware(MetricsMiddleware)
+
 # --- PYDANTIC MODELS ---
 class MealComponent(BaseModel):
     name: str
@@ -62,6 +147,22 @@ class DiaSenseAdvice(BaseModel):
     prediction: str
     suggested_bolus_strategy: str
 
+class RiskCheck(BaseModel):
+    glycemic_load: float
+    risk_level: str
+    agrees: bool
+
+class ReadingIn(BaseModel):
+    kind: str  # "glucose" (mg/dL) or "insulin" (U)
+    value: float
+    ts: Optional[datetime] = None
+
+class FoodMatch(BaseModel):
+    food_id: Optional[int] = None
+    food_name: Optional[str] = None
+    score: float
+    reference_carbs_g: Optional[float] = None
+
 class AnalysisResponse(BaseModel):
     scan_id: str
     meal_summary: str
@@ -70,9 +171,23 @@ class AnalysisResponse(BaseModel):
     diasense_advice: DiaSenseAdvice
     filename: Optional[str] = None
     status: str
+    cache_hit: bool = False
+    backend: Optional[str] = None
+    risk_check: Optional[RiskCheck] = None
+    food_matches: Optional[List[FoodMatch]] = None
 
 # Config modèle Gemini
-model = genai.GenerativeModel('gemini-2.5-flash') # Updated to 2.5 per user request
+# JSON response mode with a schema derived from AnalysisResponse (server-side fields excluded)
+ANALYSIS_RESPONSE_SCHEMA = gemini_response_schema(
+    AnalysisResponse, exclude=("filename", "status", "cache_hit", "backend", "risk_check", "food_matches")
+)
+model = genai.GenerativeModel(
+    'gemini-2.5-flash', # Updated to 2.5 per user request
+    generation_config={
+        "response_mime_type": "application/json",
+        "response_schema": ANALYSIS_RESPONSE_SCHEMA,
+    },
+)
 
 # --- PROMPT SYSTÈME ---
 DIASENSE_SYSTEM_PROMPT = """
@@ -107,8 +222,64 @@ RESPONSE FORMAT (JSON ONLY):
 }
 """
 
+# --- AUTH CACHE ---
+token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE)
+# also used by the dashboard (FirebaseTokenVerifier.from_env)
+token_verifier = FirebaseTokenVerifier(
+    token_cache,
+    project_id=FIREBASE_PROJECT_ID,
+    web_api_key=FIREBASE_WEB_API_KEY,
+    identity_toolkit_url=IDENTITY_TOOLKIT_URL,
+)
+
+# --- INFERENCE LIMITER ---
+inference_limiter = InferenceLimiter(
+    max_concurrency=INFERENCE_MAX_CONCURRENCY,
+    max_queue=INFERENCE_MAX_QUEUE,
+    queue_timeout=INFERENCE_QUEUE_TIMEOUT,
+    retry_after=INFERENCE_RETRY_AFTER,
+)
+
+# --- NUTRITION STORE ---
+# Loaded at import so pre-forked workers share it
+nutrition_store = get_store()
+# Free-text component names -> canonical foods (one entry per component)
+food_matcher = FoodMatcher(nutrition_store)
+
+# --- RESULT CACHE ---
+# Created on first use, not at import: model_server.py imports this module before
+# forking, and a SQLite connection must not be shared between processes. Each
+# worker has its own cache; with the memory backend, workers do not see each
+# other's entries.
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """This process's analysis result cache, or None when RESULT_CACHE_BACKEND is off."""
+    global _result_cache
+    if _result_cache is None and RESULT_CACHE_BACKEND.lower() != "off":
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = create_result_cache(
+                    RESULT_CACHE_BACKEND,
+                    path=RESULT_CACHE_PATH,
+                    max_size=RESULT_CACHE_SIZE,
+                    max_distance=RESULT_CACHE_MAX_DISTANCE,
+                    ttl=RESULT_CACHE_TTL or None,
+                )
+    return _result_cache
+
 # --- DEPENDENCIES ---
 async def get_current_user(authorization: str = Header(None)):
+    """Firebase uid of the caller; timed as the `auth` stage, failures counted by type."""
+    with stage("auth"):
+        try:
+            return await verify_firebase_token(authorization)
+        except HTTPException as he:
+            count_error("auth", he)
+            raise
+
+async def verify_firebase_token(authorization):
     """
     Verifies Firebase ID Token passed in Authorization header.
     Format: Bearer <token>
@@ -123,43 +294,35 @@ async def get_current_user(authorization: str = Header(None)):
         )
 
     token = authorization.split(" ")[1]
-    
-    if not FIREBASE_WEB_API_KEY:
-        print("WARNING: FIREBASE_WEB_API_KEY missing. Verifying token blindly (INSECURE - DEV ONLY).")
-        # In strict prod, we'd fail here. 
+
+    if not token_verifier.configured:
+        # In strict prod, we'd fail here.
         # But this allows at least 'some' token presence check.
-        return "dev-user-uid"
+        return token_verifier.verify(token)
+
+    cached_uid = token_verifier.cached(token)
+    if cached_uid:
+        return cached_uid
 
+    # signature check against Google's keys, or an Identity Toolkit lookup
     try:
-        # verify via Google Identity Toolkit REST API
-        url = f"https://identitytoolkit.googleapis.com/v1/accounts:lookup?key={FIREBASE_WEB_API_KEY}"
-        response = requests.post(url, json={"idToken": token})
-        
-        if response.status_code != 200:
-            print(f"Token verification failed: {response.text}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials (API check failed)",
-            )
-            
-        data = response.json()
-        if not data.get("users"):
-             raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token: user not found",
-            )
-            
-        uid = data["users"][0]["localId"]
-        return uid
+        return await run_in_threadpool(profiling.call, token_verifier.verify_uncached, token)
+    except InvalidToken as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        print(f"Token verification error: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authentication server error",
+# --- HELPERS ---
+def prepare_upload(contents):
+    """
+    Decode, orient, downscale and re-encode an upload, then fingerprint it for the result cache.
+    CPU-bound: run off the event loop.
+    """
+    with stage("decode"):
+        image, encoded, mime_type, prep_stats = prepare_image(
+            contents, max_edge=IMAGE_MAX_EDGE, fmt=IMAGE_FORMAT, quality=IMAGE_QUALITY
         )
+    with stage("fingerprint"):
+        fingerprint = image_fingerprint(image) if get_result_cache() else None
+    return image, {"data": encoded, "mime_type": mime_type}, prep_stats, fingerprint
 
 # --- ROUTES API ---
 
@@ -167,8 +330,335 @@ async def get_current_user(authorization: str = Header(None)):
 def read_root():
     return {"status": "DiaBLife AI Backend Running"}
 
+@app.get("/auth/cache-stats")
+def auth_cache_stats():
+    """Token cache hit/miss counters."""
+    return token_cache.stats()
+
+@app.get("/cache/stats")
+def result_cache_stats():
+    """Analysis result cache counters."""
+    result_cache = get_result_cache()
+    return result_cache.stats() if result_cache else {"backend": "off"}
+
+@app.get("/parse/stats")
+def parse_stats():
+    """Structured-output parse outcomes, failure rate and time spent."""
+    return output_parser.stats()
+
+@app.get("/inference/stats")
+def inference_stats():
+    """Concurrency limiter gauges and backend routing counters."""
+    return {**inference_limiter.stats(), "routing": analysis_router.stats()}
+
+@REGISTRY.collector
+def component_metrics():
+    """Counters behind the existing stats routes, read at scrape time (nothing extra per request)."""
+    token = token_cache.stats()
+    lookups = [
+        ({"cache": "token", "outcome": "hit"}, token["hits"]),
+        ({"cache": "token", "outcome": "miss"}, token["misses"]),
+    ]
+    evictions = [({"cache": "token"}, token["evictions"])]
+    sizes = [({"cache": "token"}, token["size"])]
+    result_cache = get_result_cache()
+    if result_cache:
+        results = result_cache.stats()
+        lookups += [
+            ({"cache": "result", "outcome": "hit"}, results["hits"]),
+            ({"cache": "result", "outcome": "near_hit"}, results["near_hits"]),
+            ({"cache": "result", "outcome": "miss"}, results["misses"]),
+        ]
+        evictions.append(({"cache": "result"}, results["evictions"]))
+        sizes.append(({"cache": "result"}, results["size"]))
+    yield "diablife_cache_lookups_total", "counter", "Token and analysis result cache lookups by outcome.", lookups
+    yield "diablife_cache_evictions_total", "counter", "Cache evictions (size bound or TTL).", evictions
+    yield "diablife_cache_entries", "gauge", "Entries currently cached.", sizes
+
+    limiter = inference_limiter.stats()
+    yield "diablife_inference_in_flight", "gauge", "Requests holding or waiting for an inference slot.", [
+        ({"state": "active"}, limiter["active"]), ({"state": "waiting"}, limiter["waiting"]),
+    ]
+    yield "diablife_inference_rejected_total", "counter", "Requests shed with 503 by the inference limiter.", [
+        ({}, limiter["rejected"]),
+    ]
+    routing = analysis_router.stats()
+    yield "diablife_inference_backend_total", "counter", "Analyses by routing outcome.", [
+        ({"outcome": outcome}, routing[outcome]) for outcome in ("local", "fallback", "gemini", "rejected")
+    ]
+    parse = output_parser.stats()
+    yield "diablife_parse_outcomes_total", "counter", "Structured-output parse outcomes.", [
+        ({"outcome": outcome}, parse[outcome]) for outcome in ("parsed", "extracted", "repaired", "failed")
+    ]
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of this worker's counters, histograms and gauges."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# --- PROFILING ADMIN ---
+def require_admin(x_admin_token: str = Header(None)):
+    if not PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling admin is disabled (set PROFILE_ADMIN_TOKEN).")
+    if not valid_admin_token(PROFILE_ADMIN_TOKEN, x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+@app.get("/admin/profiling", dependencies=[Depends(require_admin)])
+def profiling_status():
+    """Sampling settings of this worker and its buffered profiles, newest first."""
+    return profiler.stats()
+
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)])
+def configure_profiling(sample_rate: Optional[float] = None, paths: Optional[str] = None):
+    """Changes the sample rate (0 = off) and/or the comma-separated profiled paths on this worker."""
+    try:
+        profiler.configure(
+            sample_rate=sample_rate, paths=[path for path in paths.split(",") if path] if paths is not None else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return profiler.stats()
+
+@app.delete("/admin/profiling", dependencies=[Depends(require_admin)])
+def clear_profiles():
+    profiler.clear()
+    return {"status": "ok"}
+
+def buffered_profile(profile_id):
+    entry = profiler.get(profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown profile (evicted from the ring buffer?).")
+    return entry
+
+@app.get("/admin/profiling/{profile_id}", dependencies=[Depends(require_admin)])
+def get_profile(profile_id: str):
+    """Stage timeline, tracemalloc summary and the top functions by cumulative time."""
+    record, _ = buffered_profile(profile_id)
+    return record
+
+@app.get("/admin/profiling/{profile_id}/pstats", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """The merged cProfile data; open with `python -m pstats` or snakeviz."""
+    _, raw_stats = buffered_profile(profile_id)
+    if raw_stats is None:
+        raise HTTPException(status_code=404, detail="No cProfile data in this profile.")
+    return Response(
+        raw_stats,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.prof"'},
+    )
+
+@app.get("/nutrition/search")
+def nutrition_search(q: str, limit: int = 10):
+    """Prefix search over food names and synonyms (values per 100 g)."""
+    return [food._asdict() for food in nutrition_store.prefix(q, limit=min(limit, 50))]
+
+# --- MEAL LOG ---
+def require_meal_log():
+    meal_log = get_meal_log()
+    if meal_log is None:
+        raise HTTPException(status_code=404, detail="Meal log is disabled.")
+    return meal_log
+
+@app.get("/meals/recent")
+def recent_meals(limit: int = 10, current_user_uid: str = Depends(get_current_user)):
+    """The user's latest logged meals, newest first."""
+    return require_meal_log().recent_meals(current_user_uid, limit=min(limit, 100))
+
+@app.get("/meals/daily")
+def daily_meals(days: int = 7, current_user_uid: str = Depends(get_current_user)):
+    """Daily rollups (carbs, glycemic load, insulin, glucose) for the last `days` days."""
+    return require_meal_log().last_days(current_user_uid, days=max(1, min(days, 366)))
+
+@app.get("/meals/summary")
+def meal_summary(current_user_uid: str = Depends(get_current_user)):
+    """Dashboard metric cards (last 7 days vs the 7 before) from precomputed rollups."""
+    summary = require_meal_log().dashboard(current_user_uid)
+    summary["metrics"] = [metric._asdict() for metric in summary["metrics"]]
+    return summary
+
+@app.post("/meals/readings", status_code=201)
+def add_reading(reading: ReadingIn, current_user_uid: str = Depends(get_current_user)):
+    """Logs an insulin dose or a glucose value; counted in that day's rollup."""
+    if reading.kind not in (GLUCOSE, INSULIN):
+        raise HTTPException(status_code=400, detail=f"kind must be '{GLUCOSE}' or '{INSULIN}'.")
+    require_meal_log().log_reading(current_user_uid, reading.kind, reading.value, ts=reading.ts)
+    return {"status": "ok"}
+
+@app.post("/cgm/import")
+def import_cgm(
+    file: UploadFile = File(...),
+    date_order: Optional[str] = None,
+    current_user_uid: str = Depends(get_current_user),
+):
+    """
+    Imports a Dexcom Clarity or LibreView CSV export. Streamed in chunks; readings
+    already stored are skipped, so re-uploading an overlapping export is safe.
+    `date_order` (MDY / DMY) is needed for LibreView files whose dates read both ways.
+    """
+    try:
+        result = get_cgm_store().import_csv(
+            current_user_uid, open_text(file.file), meal_log=get_meal_log(),
+            date_order=date_order.upper() if date_order else LIBRE_DATE_ORDER,
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid CGM export: {e}")
+    print(f"CGM import for {current_user_uid}: {result.imported} readings ({result.duplicates} duplicates)")
+    return result._asdict()
+
+@app.get("/cgm/chart")
+def cgm_chart(days: int = 7, max_points: int = 500, current_user_uid: str = Depends(get_current_user)):
+    """
+    Glucose for the last `days` days, decimated to at most `max_points` points
+    (LTTB) plus a min/max band; epoch seconds of the device's local time.
+    """
+    start = datetime.now() - timedelta(days=max(1, min(days, 3660)))
+    chart = get_cgm_store().chart(current_user_uid, start=start, max_points=max(10, min(max_points, 5000)))
+    band = chart["band"]
+    return {
+        "resolution": chart["resolution"],
+        "ts": chart["ts"].tolist(),
+        "mg_dl": [round(value, 1) for value in chart["mg_dl"].tolist()],
+        "band": None if band is None else {
+            "ts": band["ts"].tolist(), "min": band["min"].tolist(), "max": band["max"].tolist(),
+        },
+    }
+
+@app.get("/reports/meals")
+def meal_report(days: int = 90, current_user_uid: str = Depends(get_current_user)):
+    """
+    Clinical PDF for the last `days` days, streamed page by page while it is
+    generated (report_generator.stream_report), so long histories use flat memory.
+    """
+    from report_generator import stream_report
+
+    end = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    start = end - timedelta(days=max(1, min(days, 366)))
+    return StreamingResponse(
+        stream_report(require_meal_log(), current_user_uid, start, end, cgm_store=get_cgm_store()),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="diasense_report_{start:%Y%m%d}_{end:%Y%m%d}.pdf"'},
+    )
+
+async def preprocess_upload(contents, filename):
+    """Returns (image, image_blob, prep_stats, fingerprint); 400 if the bytes are not an image."""
+    try:
+        image, image_blob, prep_stats, fingerprint = await run_in_threadpool(profiling.call, prepare_upload, contents)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+    print(
+        f"Preprocessed {filename}: {prep_stats['original_size']} -> {prep_stats['final_size']}, "
+        f"{prep_stats['original_bytes']} -> {prep_stats['encoded_bytes']} bytes"
+    )
+    return image, image_blob, prep_stats, fingerprint
+
+async def lookup_cached_analysis(uid, fingerprint, filename):
+    """Same (or near-identical) plate already analysed for this user? Returns the stored payload or None."""
+    result_cache = get_result_cache()
+    if not result_cache:
+        return None
+    with stage("cache_lookup"):
+        cached = await run_in_threadpool(result_cache.get, uid, fingerprint)
+    if cached:
+        return {**cached, "filename": filename, "cache_hit": True}
+    return None
+
+def validate_model_output(data):
+    AnalysisResponse(**{**data, "status": data.get("status", "success")})
+
+output_parser = StructuredOutputParser(validate=validate_model_output)
+
+async def repair_model_output(prompt):
+    """One cheap text-only call asking the model to fix its own JSON."""
+    response = await model.generate_content_async(prompt)
+    return response.text
+
+# --- INFERENCE BACKENDS ---
+analysis_router = AnalysisRouter(
+    GeminiBackend(model, DIASENSE_SYSTEM_PROMPT, output_parser, repair_model_output),
+    local=YoloBackend(
+        conf_threshold=LOCAL_CONF_THRESHOLD,
+        max_batch_size=LOCAL_MAX_BATCH,
+        max_wait_ms=LOCAL_BATCH_WAIT_MS,
+        max_queue=LOCAL_QUEUE_DEPTH,
+        thresholds=RISK_THRESHOLDS,
+    ) if INFERENCE_POLICY != "gemini" else None,
+    policy=INFERENCE_POLICY,
+    min_confidence=LOCAL_MIN_CONFIDENCE,
+)
+
+async def finalize_analysis(analysis_data, filename, uid, fingerprint):
+    """Adds metadata, maps components to canonical foods, cross-checks the risk level and caches the result."""
+    with stage("finalize"):
+        return await _finalize_analysis(analysis_data, filename, uid, fingerprint)
+
+async def _finalize_analysis(analysis_data, filename, uid, fingerprint):
+    analysis_data["filename"] = filename
+    analysis_data["status"] = "success"
+
+    analysis_data["food_matches"] = food_matcher.annotate(analysis_data.get("components", []))
+
+    # Deterministic glycemic-load score vs the model's risk_level
+    meal_gl, computed_risk = score_components(analysis_data.get("components", []), RISK_THRESHOLDS)
+    model_risk = normalize_risk_level(analysis_data.get("diasense_advice", {}).get("risk_level", ""))
+    analysis_data["risk_check"] = {
+        "glycemic_load": meal_gl,
+        "risk_level": computed_risk,
+        "agrees": computed_risk == model_risk,
+    }
+
+    result_cache = get_result_cache()
+    if result_cache:
+        await run_in_threadpool(result_cache.put, uid, fingerprint, analysis_data)
+    return analysis_data
+
+def _log_meal(uid, analysis_data):
+    meal_log = get_meal_log()
+    if meal_log is not None:
+        meal_log.log_meal(uid, analysis_data)
+
+async def record_meal(uid, analysis_data):
+    """Appends the analysis to the user's meal log; a failed write never fails the request."""
+    try:
+        with stage("meal_log"):
+            await run_in_threadpool(_log_meal, uid, analysis_data)
+    except Exception as e:
+        print(f"Meal log write failed: {e}")
+
+async def run_analysis(contents, filename, uid):
+    """
+    Shared analysis pipeline: preprocess -> result cache -> backend (local / Gemini) -> parse.
+    Returns (analysis_data, prep_stats). Raises HTTPException / Overloaded.
+    """
+    image, image_blob, prep_stats, fingerprint = await preprocess_upload(contents, filename)
+
+    # A cache hit is a re-upload of a meal that is already in the log (and its rollups)
+    cached = await lookup_cached_analysis(uid, fingerprint, filename)
+    if cached:
+        return cached, prep_stats
+
+    # Run the model (bounded; rejects fast when the worker is saturated)
+    with stage("queue_wait"):
+        await inference_limiter.acquire()
+    try:
+        analysis_data = await analysis_router.analyze(image, image_blob)
+    finally:
+        inference_limiter.release()
+
+    analysis_data = await finalize_analysis(analysis_data, filename, uid, fingerprint)
+    await record_meal(uid, analysis_data)
+    return analysis_data, prep_stats
+
+def overloaded_exception(e):
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"Server busy: {e.reason}",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
 @app.post("/analyze-meal/", response_model=AnalysisResponse)
 async def analyze_meal(
+    http_response: Response,
     file: UploadFile = File(...), 
     current_user_uid: str = Depends(get_current_user)
 ):
@@ -183,30 +673,211 @@ async def analyze_meal(
          raise HTTPException(status_code=500, detail="Server misconfigured: Missing Gemini API Key.")
 
     try:
-        # 1. Read image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-
-        # 2. Call Gemini
-        response = model.generate_content([DIASENSE_SYSTEM_PROMPT, image])
-        
-        # 3. Parse Response
-        raw_text = response.text
-        # Cleanup markdown code blocks if present
-        if "```json" in raw_text:
-            raw_text = raw_text.replace("```json", "").replace("```", "")
-        
-        analysis_data = json.loads(raw_text.strip())
-
-        # Add metadata
-        analysis_data["filename"] = file.filename
-        analysis_data["status"] = "success"
-
+        with stage("upload_read"):
+            contents = await file.read()
+        analysis_data, prep_stats = await run_analysis(contents, file.filename, current_user_uid)
+        http_response.headers["X-Image-Bytes-Saved"] = str(prep_stats["bytes_saved"])
         return analysis_data 
 
+    except HTTPException as he:
+        count_error("analyze_meal", he)
+        raise
+    except Overloaded as e:
+        count_error("analyze_meal", e)
+        raise overloaded_exception(e)
     except Exception as e:
         print(f"Error processing image: {e}")
+        count_error("analyze_meal", e)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@app.post("/analyze-meals/")
+async def analyze_meals(
+    files: List[UploadFile] = File(...),
+    current_user_uid: str = Depends(get_current_user)
+):
+    """
+    Batch upload -> one NDJSON line per image, streamed in completion order.
+    Each line: {"index", "filename", "ok", "result" | "error", "status_code"}.
+    A failing image does not fail the batch.
+    Requires Firebase Auth Token.
+    """
+    if not GOOGLE_API_KEY or GOOGLE_API_KEY == "YOUR_GEMINI_API_KEY_HERE":
+         raise HTTPException(status_code=500, detail="Server misconfigured: Missing Gemini API Key.")
+
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files (max {BATCH_MAX_FILES}).")
+
+    # Read everything up front: upload files are closed once the endpoint returns.
+    uploads = []
+    for index, upload in enumerate(files):
+        with stage("upload_read"):
+            contents = await upload.read()
+        uploads.append((index, upload.filename, upload.content_type or "", contents))
+
+    # Per-request cap, on top of the worker-wide inference limiter.
+    batch_semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def analyze_one(index, filename, content_type, contents):
+        line = {"index": index, "filename": filename}
+        try:
+            if not content_type.startswith("image/"):
+                raise HTTPException(status_code=400, detail="File must be an image.")
+            async with batch_semaphore:
+                analysis_data, _ = await run_analysis(contents, filename, current_user_uid)
+            line.update(ok=True, status_code=200, result=AnalysisResponse(**analysis_data).model_dump())
+        except HTTPException as he:
+            count_error("analyze_meals", he)
+            line.update(ok=False, status_code=he.status_code, error=he.detail)
+        except Overloaded as e:
+            count_error("analyze_meals", e)
+            line.update(ok=False, status_code=503, error=f"Server busy: {e.reason}", retry_after=e.retry_after)
+        except Exception as e:
+            print(f"Error processing image {filename}: {e}")
+            count_error("analyze_meals", e)
+            line.update(ok=False, status_code=500, error=f"Analysis failed: {str(e)}")
+        return line
+
+    async def ndjson_lines():
+        tasks = [asyncio.create_task(analyze_one(*upload)) for upload in uploads]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                line = await finished
+                yield json.dumps(line) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Top-level fields streamed as their own SSE events; components go out one by one.
+STREAMED_FIELDS = ("meal_summary", "total_carbs_est", "diasense_advice")
+
+class SlotStreamingResponse(StreamingResponse):
+    """StreamingResponse that calls `on_close` when sending ends, even if the body never started."""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+@app.post("/analyze-meal/stream")
+async def analyze_meal_stream(
+    file: UploadFile = File(...),
+    current_user_uid: str = Depends(get_current_user)
+):
+    """
+    Upload image -> Server-Sent Events as Gemini streams its answer:
+    `meal_summary`, `total_carbs_est`, one `component` per MealComponent,
+    `diasense_advice`, then `result` (the full AnalysisResponse) or `error`.
+    A saturated worker answers 503 + Retry-After before the stream opens.
+    Requires Firebase Auth Token.
+    """
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image.")
+
+    if not GOOGLE_API_KEY or GOOGLE_API_KEY == "YOUR_GEMINI_API_KEY_HERE":
+         raise HTTPException(status_code=500, detail="Server misconfigured: Missing Gemini API Key.")
+
+    with stage("upload_read"):
+        contents = await file.read()
+    filename = file.filename
+    image, image_blob, prep_stats, fingerprint = await preprocess_upload(contents, filename)
+    headers = {"Cache-Control": "no-cache", "X-Image-Bytes-Saved": str(prep_stats["bytes_saved"])}
+
+    def partial_events(analysis_data):
+        for key in ("meal_summary", "total_carbs_est"):
+            if key in analysis_data:
+                yield sse_event(key, analysis_data[key])
+        for component in analysis_data.get("components", []):
+            yield sse_event("component", component)
+        if "diasense_advice" in analysis_data:
+            yield sse_event("diasense_advice", analysis_data["diasense_advice"])
+
+    async def replay(analysis_data):
+        # cached / local results are complete already; replay them as events
+        for event in partial_events(analysis_data):
+            yield event
+        yield sse_event("result", AnalysisResponse(**analysis_data).model_dump())
+
+    cached = await lookup_cached_analysis(current_user_uid, fingerprint, filename)
+    if cached:
+        # already logged with the original upload
+        return StreamingResponse(replay(cached), media_type="text/event-stream", headers=headers)
+
+    # Take the inference slot (and run the local detector) before the 200 goes out,
+    # so overload is a real 503 + Retry-After rather than an error event.
+    try:
+        with stage("queue_wait"):
+            await inference_limiter.acquire()
+    except Overloaded as e:
+        count_error("analyze_meal_stream", e)
+        raise overloaded_exception(e)
+
+    released = False
+    def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            inference_limiter.release()
+
+    try:
+        local_data = await analysis_router.try_local(image, image_blob)
+    except Overloaded as e:
+        release_slot()
+        raise overloaded_exception(e)
+    except Exception:
+        release_slot()
+        raise
+    if local_data is not None:
+        release_slot()
+        analysis_data = await finalize_analysis(local_data, filename, current_user_uid, fingerprint)
+        await record_meal(current_user_uid, analysis_data)
+        return StreamingResponse(replay(analysis_data), media_type="text/event-stream", headers=headers)
+
+    async def event_stream():
+        try:
+            parser = IncrementalJSONParser()
+            raw_chunks = []
+            try:
+                # includes time the client takes to accept each event
+                with stage("gemini"):
+                    response = await model.generate_content_async(
+                        [DIASENSE_SYSTEM_PROMPT, image_blob], stream=True
+                    )
+                    async for chunk in response:
+                        raw_chunks.append(chunk.text)
+                        for event in parser.feed(chunk.text):
+                            if event[0] == "field" and event[1] in STREAMED_FIELDS:
+                                yield sse_event(event[1], event[2])
+                            elif event[0] == "item" and event[1] == "components":
+                                yield sse_event("component", event[3])
+
+                with stage("parse"):
+                    analysis_data = await output_parser.parse_or_repair("".join(raw_chunks), repair_model_output)
+                analysis_data["backend"] = "gemini"
+            finally:
+                release_slot()
+            analysis_data = await finalize_analysis(analysis_data, filename, current_user_uid, fingerprint)
+            await record_meal(current_user_uid, analysis_data)
+            yield sse_event("result", AnalysisResponse(**analysis_data).model_dump())
+
+        except Exception as e:
+            print(f"Error streaming analysis: {e}")
+            count_error("analyze_meal_stream", e)
+            yield sse_event("error", {"status_code": 500, "detail": f"Analysis failed: {str(e)}"})
+
+    # on_close is the backstop for a client that disconnects before the body starts
+    return SlotStreamingResponse(
+        event_stream(), release_slot, media_type="text/event-stream", headers=headers
+    )
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,410 @@
+# meal_log.py
+# Persistent per-user meal log (SQLAlchemy, SQLite by default) behind the dashboard.
+#
+#   meals          one row per analysed meal (uid, ts, carbs, glycemic load, payload)
+#   readings       insulin doses and glucose values not tied to a meal
+#   daily_rollups  per (uid, day) running sums (rollups.FIELDS)
+#   weekly_rollups per (uid, ISO week) running sums
+#   user_totals    per uid all-time running sums
+#
+# CGM readings live in cgm_store.py; imports add their per-day sums via add_rollups().
+#
+# The three rollup rows are upserted in the same transaction as each insert, so a
+# year of history is 365 / 53 / 1 rows instead of every meal, and the dashboard
+# metrics (rollups.dashboard_metrics) read a fixed 14 rows however long the history.
+# Every query is a range scan on a (uid, ts) / (uid, day) index.
+# Days are local calendar days of the server (the dashboard uses datetime.now()).
+
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import (
+    Column, Date, DateTime, Float, Index, Integer, MetaData, String, Table, Text,
+    and_, bindparam, create_engine, event, inspect, or_, select, text,
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import rollups
+from glycemic import score_component_lists, score_components
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_URL = f"sqlite:///{os.path.join(BASE_DIR, 'meal_log.sqlite3')}"
+
+GLUCOSE = "glucose"
+INSULIN = "insulin"
+
+metadata = MetaData()
+
+meals = Table(
+    "meals", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("uid", String(128), nullable=False),
+    Column("ts", DateTime, nullable=False),
+    Column("scan_id", String(64)),
+    Column("meal_summary", Text),
+    Column("total_carbs", Float, nullable=False, default=0.0),
+    Column("glycemic_load", Float),
+    Column("risk_level", String(16)),
+    Column("backend", String(16)),
+    Column("insulin_units", Float),
+    Column("glucose_mg_dl", Float),
+    Column("payload", Text, nullable=False),
+    Index("idx_meals_uid_ts", "uid", "ts"),
+)
+
+readings = Table(
+    "readings", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("uid", String(128), nullable=False),
+    Column("ts", DateTime, nullable=False),
+    Column("kind", String(16), nullable=False),  # GLUCOSE (mg/dL) or INSULIN (U)
+    Column("value", Float, nullable=False),
+    Index("idx_readings_uid_ts", "uid", "ts"),
+)
+
+
+
+def _rollup_columns():
+    return [
+        Column("meal_count", Integer, nullable=False, default=0),
+        Column("carbs_total", Float, nullable=False, default=0.0),
+        Column("glycemic_load_total", Float, nullable=False, default=0.0),
+        Column("insulin_total", Float, nullable=False, default=0.0),
+        Column("glucose_sum", Float, nullable=False, default=0.0),
+        Column("glucose_count", Integer, nullable=False, default=0),
+        Column("glucose_in_range", Integer, nullable=False, default=0),
+    ]
+
+
+daily_rollups = Table(
+    "daily_rollups", metadata,
+    Column("uid", String(128), primary_key=True),
+    Column("day", Date, primary_key=True),
+    *_rollup_columns(),
+)
+
+weekly_rollups = Table(
+    "weekly_rollups", metadata,
+    Column("uid", String(128), primary_key=True),
+    Column("week", Date, primary_key=True),  # Monday
+    *_rollup_columns(),
+)
+
+user_totals = Table(
+    "user_totals", metadata,
+    Column("uid", String(128), primary_key=True),
+    *_rollup_columns(),
+)
+
+
+class MealLog:
+    def __init__(self, url=DEFAULT_URL):
+        self.engine = create_engine(url, future=True)
+        self._upserts = {}  # table name -> compiled-once upsert statement
+        if self.engine.dialect.name == "sqlite":
+            @event.listens_for(self.engine, "connect")
+            def _sqlite_pragmas(connection, _):
+                cursor = connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+                cursor.close()
+        self._create_schema()
+
+    def _create_schema(self):
+        """
+        Creates missing tables. A log from before the weekly/total rollups (or
+        glucose_in_range) gets the new column and has its rollups rebuilt once.
+        """
+        inspector = inspect(self.engine)
+        existing = set(inspector.get_table_names())
+        migrate = "meals" in existing and not {"weekly_rollups", "user_totals"} <= existing
+        with self.engine.begin() as conn:
+            if "daily_rollups" in existing:
+                columns = {column["name"] for column in inspector.get_columns("daily_rollups")}
+                if "glucose_in_range" not in columns:
+                    conn.execute(text(
+                        "ALTER TABLE daily_rollups ADD COLUMN glucose_in_range INTEGER NOT NULL DEFAULT 0"
+                    ))
+                    migrate = "meals" in existing
+        metadata.create_all(self.engine)
+        if migrate:
+            with self.engine.connect() as conn:
+                uids = {uid for uid, in conn.execute(select(meals.c.uid).distinct())}
+                uids |= {uid for uid, in conn.execute(select(readings.c.uid).distinct())}
+            for uid in uids:
+                self.rebuild_rollups(uid)
+            print(f"Meal log: rebuilt rollups for {len(uids)} users")
+
+    # --- WRITES ---
+    def _upsert_add(self, conn, table, rows):
+        """Adds each row's rollups.FIELDS to the existing row with the same key (executemany)."""
+        statements = self._upserts
+        if table.name not in statements:
+            upsert = postgresql_insert if self.engine.dialect.name == "postgresql" else sqlite_insert
+            stmt = upsert(table)
+            statements[table.name] = stmt.on_conflict_do_update(
+                index_elements=[column.name for column in table.primary_key],
+                set_={field: getattr(table.c, field) + stmt.excluded[field] for field in rollups.FIELDS},
+            )
+        conn.execute(statements[table.name], rows)
+
+    def _bump_rollups(self, conn, uid, day_deltas):
+        """Adds {day: delta} to the day, week and all-time rows, pre-aggregated per week."""
+        weeks, total = {}, rollups.empty()
+        for day, delta in day_deltas.items():
+            rollups.add(weeks.setdefault(rollups.week_start(day), rollups.empty()), delta)
+            rollups.add(total, delta)
+        self._upsert_add(conn, daily_rollups, [{"uid": uid, "day": day, **delta} for day, delta in day_deltas.items()])
+        self._upsert_add(conn, weekly_rollups, [{"uid": uid, "week": week, **delta} for week, delta in weeks.items()])
+        self._upsert_add(conn, user_totals, [{"uid": uid, **total}])
+
+    def _bump_rollup(self, conn, uid, day, delta):
+        self._bump_rollups(conn, uid, {day: delta})
+
+    def log_meal(self, uid, analysis, ts=None, insulin_units=None, glucose_mg_dl=None):
+        """Stores one AnalysisResponse dict and updates that day's rollup. Returns the meal id."""
+        ts = ts or datetime.now()
+        risk_check = analysis.get("risk_check") or {}
+        carbs = float(analysis.get("total_carbs_est") or 0)
+        glycemic_load = risk_check.get("glycemic_load")
+        if glycemic_load is None and analysis.get("components"):
+            # analysis without main.py's risk check: score it here so the rollups count its GL
+            glycemic_load = score_components(analysis["components"])[0]
+        with self.engine.begin() as conn:
+            meal_id = conn.execute(
+                meals.insert().values(
+                    uid=uid,
+                    ts=ts,
+                    scan_id=analysis.get("scan_id"),
+                    meal_summary=analysis.get("meal_summary"),
+                    total_carbs=carbs,
+                    glycemic_load=glycemic_load,
+                    risk_level=risk_check.get("risk_level") or (analysis.get("diasense_advice") or {}).get("risk_level"),
+                    backend=analysis.get("backend"),
+                    insulin_units=insulin_units,
+                    glucose_mg_dl=glucose_mg_dl,
+                    payload=json.dumps(analysis),
+                )
+            ).inserted_primary_key[0]
+            self._bump_rollup(conn, uid, ts.date(), rollups.delta(
+                meal_count=1, carbs=carbs, glycemic_load=glycemic_load, insulin=insulin_units, glucose=glucose_mg_dl,
+            ))
+        return meal_id
+
+    def log_reading(self, uid, kind, value, ts=None):
+        """Records an insulin dose (U) or a glucose value (mg/dL)."""
+        if kind not in (GLUCOSE, INSULIN):
+            raise ValueError(f"Unknown reading kind: {kind}")
+        ts = ts or datetime.now()
+        with self.engine.begin() as conn:
+            conn.execute(readings.insert().values(uid=uid, ts=ts, kind=kind, value=float(value)))
+            if kind == GLUCOSE:
+                delta = rollups.delta(glucose=float(value))
+            else:
+                delta = rollups.delta(insulin=float(value))
+            self._bump_rollup(conn, uid, ts.date(), delta)
+
+    def add_rollups(self, uid, day_deltas):
+        """Adds precomputed {day: delta} sums (e.g. a CGM import) in one transaction."""
+        if not day_deltas:
+            return
+        with self.engine.begin() as conn:
+            self._bump_rollups(conn, uid, day_deltas)
+
+    def _backfill_glycemic_load(self, conn, uid):
+        """
+        Scores the user's meals stored without a glycemic load (older rows) from their
+        payload components, in one vectorized pass, and saves the scores.
+        """
+        rows = conn.execute(
+            select(meals.c.id, meals.c.payload).where(meals.c.uid == uid, meals.c.glycemic_load.is_(None))
+        ).all()
+        if not rows:
+            return
+        meal_gl, _ = score_component_lists([json.loads(payload).get("components") for _, payload in rows])
+        conn.execute(
+            meals.update().where(meals.c.id == bindparam("meal_id")).values(glycemic_load=bindparam("gl")),
+            [{"meal_id": meal_id, "gl": float(gl)} for (meal_id, _), gl in zip(rows, meal_gl)],
+        )
+
+    def rebuild_rollups(self, uid):
+        """Recomputes a user's rollups from the base tables and CGM readings (repair / backfill)."""
+        from cgm_store import get_cgm_store  # pandas only when needed
+
+        days = {}
+
+        def add(day, delta):
+            rollups.add(days.setdefault(day, rollups.empty()), delta)
+
+        with self.engine.begin() as conn:
+            self._backfill_glycemic_load(conn, uid)
+            for ts, carbs, glycemic_load, insulin, glucose in conn.execute(
+                select(meals.c.ts, meals.c.total_carbs, meals.c.glycemic_load, meals.c.insulin_units, meals.c.glucose_mg_dl)
+                .where(meals.c.uid == uid)
+            ):
+                add(ts.date(), rollups.delta(1, carbs, glycemic_load, insulin, glucose))
+            for ts, kind, value in conn.execute(
+                select(readings.c.ts, readings.c.kind, readings.c.value).where(readings.c.uid == uid)
+            ):
+                add(ts.date(), rollups.delta(glucose=value) if kind == GLUCOSE else rollups.delta(insulin=value))
+            for day, delta in get_cgm_store().daily_deltas(uid).items():
+                add(day, delta)
+
+            weeks, total = {}, rollups.empty()
+            for day, row in days.items():
+                rollups.add(weeks.setdefault(rollups.week_start(day), rollups.empty()), row)
+                rollups.add(total, row)
+
+            for table in (daily_rollups, weekly_rollups, user_totals):
+                conn.execute(table.delete().where(table.c.uid == uid))
+            if days:
+                conn.execute(daily_rollups.insert(), [{"uid": uid, "day": day, **row} for day, row in days.items()])
+                conn.execute(weekly_rollups.insert(), [{"uid": uid, "week": week, **row} for week, row in weeks.items()])
+                conn.execute(user_totals.insert(), [{"uid": uid, **total}])
+
+    # --- READS ---
+    def recent_meals(self, uid, limit=10, with_payload=False):
+        """Newest first (backward scan of idx_meals_uid_ts)."""
+        columns = [meals.c.id, meals.c.ts, meals.c.meal_summary, meals.c.total_carbs, meals.c.glycemic_load,
+                   meals.c.risk_level, meals.c.insulin_units]
+        if with_payload:
+            columns.append(meals.c.payload)
+        query = select(*columns).where(meals.c.uid == uid).order_by(meals.c.ts.desc()).limit(limit)
+        with self.engine.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(query)]
+        if with_payload:
+            for row in rows:
+                row["payload"] = json.loads(row["payload"])
+        return rows
+
+    def meals_between(self, uid, start, end, with_payload=False):
+        """Meals with start <= ts < end, oldest first."""
+        columns = [meals.c.id, meals.c.ts, meals.c.meal_summary, meals.c.total_carbs, meals.c.glycemic_load,
+                   meals.c.risk_level, meals.c.insulin_units, meals.c.glucose_mg_dl]
+        if with_payload:
+            columns.append(meals.c.payload)
+        query = (
+            select(*columns)
+            .where(meals.c.uid == uid, meals.c.ts >= start, meals.c.ts < end)
+            .order_by(meals.c.ts)
+        )
+        with self.engine.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(query)]
+        if with_payload:
+            for row in rows:
+                row["payload"] = json.loads(row["payload"])
+        return rows
+
+    def iter_meals(self, uid, start, end, batch_size=200):
+        """
+        Meals with start <= ts < end, oldest first, with payload, fetched in keyset-
+        paginated batches (ts, id) so a long history is never held in memory at once.
+        """
+        last_ts, last_id = None, None
+        while True:
+            query = select(
+                meals.c.id, meals.c.ts, meals.c.meal_summary, meals.c.total_carbs, meals.c.glycemic_load,
+                meals.c.risk_level, meals.c.insulin_units, meals.c.glucose_mg_dl, meals.c.payload,
+            ).where(meals.c.uid == uid, meals.c.ts < end)
+            if last_ts is None:
+                query = query.where(meals.c.ts >= start)
+            else:
+                query = query.where(or_(meals.c.ts > last_ts, and_(meals.c.ts == last_ts, meals.c.id > last_id)))
+            query = query.order_by(meals.c.ts, meals.c.id).limit(batch_size)
+            with self.engine.connect() as conn:
+                rows = [dict(row._mapping) for row in conn.execute(query)]
+            for row in rows:
+                row["payload"] = json.loads(row["payload"])
+                yield row
+            if len(rows) < batch_size:
+                return
+            last_ts, last_id = rows[-1]["ts"], rows[-1]["id"]
+
+    def daily(self, uid, start_day, end_day):
+        """
+        Rollup rows for start_day <= day <= end_day, oldest first, with glucose_avg
+        (None on days without readings). Days without activity are absent.
+        """
+        query = (
+            select(daily_rollups)
+            .where(daily_rollups.c.uid == uid, daily_rollups.c.day >= start_day, daily_rollups.c.day <= end_day)
+            .order_by(daily_rollups.c.day)
+        )
+        with self.engine.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(query)]
+        for row in rows:
+            row["glucose_avg"] = row["glucose_sum"] / row["glucose_count"] if row["glucose_count"] else None
+        return rows
+
+    def last_days(self, uid, days=7, today=None):
+        """Rollups for the `days` calendar days ending today, one row per day (zeros filled in)."""
+        today = today or date.today()
+        start_day = today - timedelta(days=days - 1)
+        by_day = {row["day"]: row for row in self.daily(uid, start_day, today)}
+        filled = []
+        for offset in range(days):
+            day = start_day + timedelta(days=offset)
+            row = by_day.get(day) or {"uid": uid, "day": day, **rollups.empty(), "glucose_avg": None}
+            filled.append(row)
+        return filled
+
+    def last_weeks(self, uid, weeks=13, today=None):
+        """Weekly rollups for the `weeks` ISO weeks ending with the current one, zeros filled in."""
+        this_week = rollups.week_start(today or date.today())
+        start_week = this_week - timedelta(weeks=weeks - 1)
+        query = (
+            select(weekly_rollups)
+            .where(weekly_rollups.c.uid == uid, weekly_rollups.c.week >= start_week, weekly_rollups.c.week <= this_week)
+            .order_by(weekly_rollups.c.week)
+        )
+        with self.engine.connect() as conn:
+            by_week = {row.week: dict(row._mapping) for row in conn.execute(query)}
+        filled = []
+        for offset in range(weeks):
+            week = start_week + timedelta(weeks=offset)
+            row = by_week.get(week) or {"uid": uid, "week": week, **rollups.empty()}
+            row["glucose_avg"] = row["glucose_sum"] / row["glucose_count"] if row["glucose_count"] else None
+            filled.append(row)
+        return filled
+
+    def totals(self, uid):
+        """All-time running sums for the user (one primary-key lookup)."""
+        with self.engine.connect() as conn:
+            row = conn.execute(select(user_totals).where(user_totals.c.uid == uid)).first()
+        return rollups.summarize([dict(row._mapping)] if row else [])
+
+    def meal_count(self, uid):
+        return self.totals(uid)["meal_count"]
+
+    def dashboard(self, uid, today=None):
+        """
+        Everything the dashboard cards need from 14 daily rows: the metric cards
+        (this 7-day window vs the previous one), plus today's and yesterday's rows.
+        """
+        days = self.last_days(uid, days=14, today=today)
+        return {
+            "metrics": rollups.dashboard_metrics(rollups.summarize(days[7:]), rollups.summarize(days[:7])),
+            "today": days[-1],
+            "yesterday": days[-2],
+            "has_data": any(row["meal_count"] or row["glucose_count"] or row["insulin_total"] for row in days),
+        }
+
+
+_meal_log = None
+
+
+def get_meal_log():
+    """
+    Process-wide MealLog at MEAL_LOG_URL (SQLAlchemy URL, default meal_log.sqlite3
+    next to this file), or None when MEAL_LOG_URL=off. Created on first use, so
+    pre-forked workers each open their own connections.
+    """
+    global _meal_log
+    url = os.getenv("MEAL_LOG_URL", DEFAULT_URL)
+    if url == "off":
+        return None
+    if _meal_log is None:
+        _meal_log = MealLog(url)
+    return _meal_log
@@ -0,0 +1,288 @@
+# metrics.py
+# In-process Prometheus metrics, rendered in the text exposition format (0.0.4) by
+# GET /metrics. No client library and no collector: each worker keeps its own
+# counters, so scrape every worker (or run one) to see them all.
+#
+#   Counter / Gauge / Histogram   labelled series, thread-safe (threadpool + event loop)
+#   Registry.collector            read-at-scrape callbacks for components that already
+#                                 count things themselves (caches, limiter, parser)
+#   MetricsMiddleware             requests, latency (until the last body byte) and in-flight
+#   stage()                       per-stage timer for the analysis pipeline (also feeds the
+#                                 timeline of a request being profiled, see profiling.py)
+#   BATCH_SIZE / BATCH_QUEUE_WAIT observed by micro_batcher.MicroBatcher per forward pass
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# seconds; from a cache hit (~ms) to a slow Gemini call with a repair round-trip
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(suffix, labels, value)] for every series."""
+        with self._lock:
+            series = dict(self._series)
+        return [("", tuple(zip(self.labelnames, key)), value) for key, value in sorted(series.items())]
+
+
+class Counter(_Metric):
+    """Monotonic count (requests, errors)."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down (requests in flight)."""
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """Cumulative buckets + sum + count per series (latencies, in seconds)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # first bucket whose upper bound >= value; len(buckets) is the +Inf bucket
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        samples = []
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", labels + (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class Registry:
+    """Owns the metrics of one process and renders them for /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, fn):
+        """
+        Registers fn() -> iterable of (name, kind, documentation, [(labels dict, value)]),
+        called on every scrape. Usable as a decorator.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, documentation, samples):
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+        for metric in self._metrics:
+            family(metric.name, metric.kind, metric.documentation, metric.samples())
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                # a broken component must not take the whole scrape down
+                print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                family(name, kind, documentation, [("", tuple(labels.items()), value) for labels, value in samples])
+        return "\n".join(lines) + "\n"
+
+
+# --- SERVICE METRICS ---
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "diablife_http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status")
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "diablife_http_request_duration_seconds",
+    "Time from request start to the last response byte (whole stream for NDJSON / SSE).",
+    ("method", "route"),
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("diablife_http_requests_in_flight", "HTTP requests currently being served.")
+STAGE_LATENCY = REGISTRY.histogram(
+    "diablife_stage_duration_seconds",
+    "Analysis pipeline stages: auth, upload_read, decode, fingerprint, cache_lookup, "
+    "queue_wait, local, gemini, parse, finalize, meal_log.",
+    ("stage",),
+)
+ERRORS = REGISTRY.counter("diablife_errors_total", "Failed requests / items by endpoint and error type.", ("endpoint", "type"))
+BATCH_SIZE = REGISTRY.histogram(
+    "diablife_batch_size", "Items per micro-batched forward pass.", ("batcher",), buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+BATCH_QUEUE_WAIT = REGISTRY.histogram(
+    "diablife_batch_queue_wait_seconds",
+    "Time an item waits in a micro-batcher queue before its forward pass starts.",
+    ("batcher",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+# A list while the current request is being profiled; stage() appends
+# (name, perf_counter start, seconds, thread name). Copied into threadpool calls.
+stage_timeline = ContextVar("stage_timeline", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Times a block into diablife_stage_duration_seconds{stage=name}; works around awaits."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.observe(elapsed, stage=name)
+        timeline = stage_timeline.get()
+        if timeline is not None:
+            timeline.append((name, started, elapsed, threading.current_thread().name))
+
+
+def error_type(e):
+    """Label for ERRORS: http_<status> for HTTP errors, else the exception class name."""
+    status_code = getattr(e, "status_code", None)
+    return f"http_{status_code}" if isinstance(status_code, int) else type(e).__name__
+
+
+def count_error(endpoint, e):
+    ERRORS.inc(endpoint=endpoint, type=error_type(e))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware buffering). Routes are labelled by
+    their template (/meals/daily, not the raw URL) so label cardinality stays fixed;
+    unknown paths share "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            status_code = 500
+            count_error("unhandled", e)
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # the router stores the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=status_code)
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=route)
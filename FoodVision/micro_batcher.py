@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from inference_limiter import Overloaded
+from metrics import BATCH_QUEUE_WAIT, BATCH_SIZE
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item requests into one batched call.
+
+    Callers `await submit(item)`. A single worker task takes the first queued item,
+    keeps collecting for up to `max_wait_ms` or until `max_batch_size` items are
+    waiting, then runs `run_batch(items)` (a blocking function returning one result
+    per item, executed in the thread pool) and resolves every caller's future.
+    Submissions beyond `max_queue` pending items are rejected with Overloaded.
+    Each batch's size and its items' queue waits go to /metrics under `name`.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, max_queue=64, retry_after=1, name="local"):
+        self.run_batch = run_batch
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._queue = None
+        self._worker = None
+        self.batch_sizes = {}  # batch size -> number of batches
+        self.items = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_worker()
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("Detector queue full", self.retry_after)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        # anything that arrived meanwhile rides along, up to the cap
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # callers that gave up (cancelled) are dropped before the forward pass
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            BATCH_SIZE.observe(len(batch), batcher=self.name)
+            for _, _, enqueued in batch:
+                BATCH_QUEUE_WAIT.observe(started - enqueued, batcher=self.name)
+            try:
+                results = await run_in_threadpool(self.run_batch, [item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            self.busy_seconds += time.perf_counter() - started
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+            self.items += len(batch)
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue": self.max_queue,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / batches, 3) if batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "rejected": self.rejected,
+            "busy_seconds_total": round(self.busy_seconds, 6),
+        }
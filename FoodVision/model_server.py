@@ -0,0 +1,209 @@
+# model_server.py
+# Pre-fork serving: load model weights once in the parent, warm them up, then fork
+# uvicorn workers that share the weights copy-on-write.
+#
+#   python model_server.py --workers 4 --port 8000 --preload foodvision
+#
+# Workers inherit the listening socket and the module-level registry below, so
+# cal.load_model() / diabetes_ai_pro.load_models() return the preloaded objects
+# instead of reading the weights again. The app module (main.py) and cal.py are
+# imported in the parent too, so their import cost and module state are shared.
+# Connections (result cache, meal log) are opened on first use, i.e. in each worker;
+# an in-memory result cache is per worker.
+
+import argparse
+import gc
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+
+import numpy as np
+
+_MODELS = {}
+
+
+def get_preloaded(name):
+    return _MODELS.get(name)
+
+
+def _limit_torch_threads():
+    """
+    torch's OpenMP / intra-op pools do not survive fork: a worker reusing pool
+    threads created in the parent can deadlock. Pin torch to one thread before
+    any warm-up so no pool exists at fork time (workers run one request per core).
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(int(os.getenv("MODEL_SERVER_TORCH_THREADS", "1")))
+
+
+# --- LOADERS ---
+def _load_foodvision():
+    import cal  # noqa: F401  (imported pre-fork so workers skip the cv2/streamlit import cost)
+    from ultralytics import YOLO
+    return YOLO("./best.pt")
+
+
+def _load_yolov8n():
+    from ultralytics import YOLO
+    return YOLO("yolov8n.pt")
+
+
+def _load_resnet50():
+    from torchvision import models
+    classifier = models.resnet50(pretrained=True)
+    classifier.eval()
+    return classifier
+
+
+def _warm_up_yolo(model):
+    model.predict(source=[np.zeros((640, 640, 3), dtype=np.uint8)], imgsz=640, verbose=False)
+
+
+def _warm_up_classifier(model):
+    import torch
+    with torch.no_grad():
+        model(torch.zeros((1, 3, 224, 224)))
+
+
+LOADERS = {
+    "foodvision": (_load_foodvision, _warm_up_yolo),
+    "yolov8n": (_load_yolov8n, _warm_up_yolo),
+    "resnet50": (_load_resnet50, _warm_up_classifier),
+}
+
+
+def preload(names):
+    """Loads and warms up each model into the registry."""
+    if names:
+        _limit_torch_threads()
+    for name in names:
+        if name == "foodvision" and os.getenv("FOODVISION_RUNTIME", "torch").lower() == "onnx":
+            # onnxruntime thread pools do not survive fork; each worker opens its own session
+            print("Skipping foodvision preload: ONNX runtime sessions are created per worker")
+            continue
+        load, warm_up = LOADERS[name]
+        started = time.perf_counter()
+        model = load()
+        warm_up(model)
+        _MODELS[name] = model
+        print(f"Preloaded {name} in {time.perf_counter() - started:.2f}s")
+
+
+def load_app(app):
+    """Imports "module:attribute" in the parent so workers inherit the loaded module."""
+    module_name, _, attribute = app.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "app")
+
+
+def check_shared(expected):
+    """
+    Run in a forked worker: confirms the registry seen by cal.py / the app is the
+    parent's (same objects), not an empty copy that would trigger a second load.
+    """
+    registry = sys.modules["model_server"]._MODELS
+    for name, object_id in expected.items():
+        model = registry.get(name)
+        if model is None or id(model) != object_id:
+            print(f"WARNING: worker {os.getpid()} does not see preloaded {name}; it will load its own copy")
+        else:
+            print(f"Worker {os.getpid()} shares preloaded {name}")
+
+
+# --- PRE-FORK SERVER ---
+def _run_worker(app, sock, log_level, expected):
+    import uvicorn
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    check_shared(expected)
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(app="main:app", host="0.0.0.0", port=8000, workers=2, preload_names=(), log_level="info"):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    preload(preload_names)
+    expected = {name: id(model) for name, model in _MODELS.items()}
+    # Import the app and cal.py before forking, after the models, so anything
+    # loaded at import time finds them in the registry and is shared too.
+    app = load_app(app) if isinstance(app, str) else app
+    if "foodvision" in preload_names:
+        importlib.import_module("cal")
+    # Objects that exist now are never scanned by the collector again; otherwise
+    # each worker's first GC pass would write to (and copy) every shared page.
+    gc.collect()
+    gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, log_level, expected)
+            finally:
+                os._exit(0)
+        children.add(pid)
+        print(f"Started worker {pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting")
+            spawn()
+    sock.close()
+
+
+if __name__ == "__main__":
+    # Run as a script this module is __main__; alias it so `from model_server import
+    # get_preloaded` in cal.py / diabetes_ai_pro.py sees this registry instead of
+    # importing a second, empty copy of the module.
+    sys.modules.setdefault("model_server", sys.modules[__name__])
+
+    parser = argparse.ArgumentParser(description="DiaBLife pre-fork model server")
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    parser.add_argument(
+        "--preload",
+        default=os.getenv("MODEL_SERVER_PRELOAD", "foodvision"),
+        help="comma-separated models to load before forking: " + ", ".join(LOADERS),
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.preload.split(",") if name.strip()]
+    serve(args.app, args.host, args.port, args.workers, names, args.log_level)
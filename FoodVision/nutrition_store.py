@@ -0,0 +1,231 @@
+# nutrition_store.py
+# Shared nutrition database: one indexed store behind cal.py, the Streamlit apps
+# and main.py instead of a hard-coded dict per file.
+#
+# The source of truth is nutrition_data.csv (USDA-style values per 100 g; more CSVs
+# with the same columns can be merged in). It is compiled into SQLite
+# (nutrition.sqlite3) with a unique normalized-name index and a synonym table, and
+# loaded into memory at startup:
+#   get(name)     exact / synonym lookup, O(1) (dict on the normalized name)
+#   prefix(text)  autocomplete over every name and synonym, O(log n) (bisect)
+#
+#   python nutrition_store.py                      # rebuild from nutrition_data.csv
+#   python nutrition_store.py --csv usda_full.csv  # merge extra CSVs into the store
+
+import argparse
+import bisect
+import csv
+import os
+import re
+import sqlite3
+import tempfile
+from collections import namedtuple
+from itertools import islice
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CSV = os.path.join(BASE_DIR, "nutrition_data.csv")
+DEFAULT_DB = os.path.join(BASE_DIR, "nutrition.sqlite3")
+
+# Values per 100 g; gi is None for foods without meaningful carbohydrate (meat, oils).
+Food = namedtuple("Food", "id name category carbs_g gi kcal portion_g")
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_name(text):
+    """'Green_Apples', ' green-apples ' -> 'green apples'."""
+    return _NON_ALNUM.sub(" ", str(text).lower()).strip()
+
+
+def _singular_forms(name):
+    """Candidate singulars tried after an exact miss: cherries -> cherry, potatoes -> potato, grapes -> grape."""
+    if name.endswith("ies"):
+        yield name[:-3] + "y"
+    if name.endswith("es"):
+        yield name[:-2]
+    if name.endswith("s") and not name.endswith("ss"):
+        yield name[:-1]
+
+
+def portion_carbs(food, grams=None):
+    """Carbs (g) in `grams` of the food, default portion when omitted."""
+    return food.carbs_g * (food.portion_g if grams is None else grams) / 100.0
+
+
+# --- BUILD ---
+def _float_or_none(value):
+    value = (value or "").strip()
+    return float(value) if value else None
+
+
+def read_csv_rows(paths):
+    """Yields (name, category, carbs_g, gi, kcal, portion_g, synonyms) from one or more CSVs."""
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                synonyms = [s for s in (row.get("synonyms") or "").split(";") if s.strip()]
+                yield (
+                    row["name"].strip(),
+                    (row.get("category") or "").strip(),
+                    float(row["carbs_g"]),
+                    _float_or_none(row.get("gi")),
+                    float(row["kcal"]),
+                    _float_or_none(row.get("portion_g")) or 100.0,
+                    synonyms,
+                )
+
+
+def build_store(csv_paths=(DEFAULT_CSV,), db_path=DEFAULT_DB):
+    """
+    Compiles the CSVs into SQLite. Later files override earlier ones for the same
+    normalized name. Written to a temp file and renamed, so concurrent workers
+    never see a half-built database.
+    """
+    foods = {}     # norm_name -> row
+    synonyms = {}  # norm synonym -> norm_name
+    for name, category, carbs_g, gi, kcal, portion_g, names in read_csv_rows(csv_paths):
+        key = normalize_name(name)
+        foods[key] = (name, category, carbs_g, gi, kcal, portion_g)
+        for synonym in names:
+            synonyms[normalize_name(synonym)] = key
+    # a real entry beats a synonym of another entry (e.g. a merged USDA "rice" row)
+    synonyms = {synonym: key for synonym, key in synonyms.items() if synonym not in foods}
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(db_path)), suffix=".tmp")
+    os.close(fd)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE foods (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                norm_name TEXT NOT NULL UNIQUE,
+                category TEXT NOT NULL,
+                carbs_g REAL NOT NULL,
+                gi REAL,
+                kcal REAL NOT NULL,
+                portion_g REAL NOT NULL
+            );
+            CREATE TABLE synonyms (
+                norm_name TEXT PRIMARY KEY,
+                food_id INTEGER NOT NULL REFERENCES foods (id)
+            ) WITHOUT ROWID;
+            CREATE INDEX idx_foods_category ON foods (category);
+            """
+        )
+        ids = {}
+        for food_id, (key, row) in enumerate(sorted(foods.items()), start=1):
+            ids[key] = food_id
+            conn.execute(
+                "INSERT INTO foods (id, name, norm_name, category, carbs_g, gi, kcal, portion_g) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (food_id, row[0], key, *row[1:]),
+            )
+        conn.executemany(
+            "INSERT INTO synonyms (norm_name, food_id) VALUES (?, ?)",
+            [(synonym, ids[key]) for synonym, key in synonyms.items()],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    return len(foods), len(synonyms)
+
+
+def _is_stale(db_path, csv_paths):
+    if not os.path.exists(db_path):
+        return True
+    built_at = os.path.getmtime(db_path)
+    return any(os.path.getmtime(path) > built_at for path in csv_paths)
+
+
+# --- STORE ---
+class NutritionStore:
+    """Read-only, in-memory view of the compiled store. Safe to share across threads and forked workers."""
+
+    def __init__(self, db_path=DEFAULT_DB):
+        self.db_path = db_path
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT id, name, category, carbs_g, gi, kcal, portion_g, norm_name FROM foods ORDER BY id"
+            ).fetchall()
+            synonym_rows = conn.execute("SELECT norm_name, food_id FROM synonyms").fetchall()
+        finally:
+            conn.close()
+
+        self.foods = {row[0]: Food(*row[:7]) for row in rows}
+        self._by_name = {row[7]: self.foods[row[0]] for row in rows}
+        for synonym, food_id in synonym_rows:
+            self._by_name[synonym] = self.foods[food_id]
+        self._sorted_names = sorted(self._by_name)
+
+    def __len__(self):
+        return len(self.foods)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def names(self):
+        """Every normalized name and synonym, sorted."""
+        return self._sorted_names
+
+    def get(self, name):
+        """Food for a label (any casing / separators / simple plural), or None."""
+        key = normalize_name(name)
+        food = self._by_name.get(key)
+        if food is None:
+            for candidate in _singular_forms(key):
+                food = self._by_name.get(candidate)
+                if food is not None:
+                    break
+        return food
+
+    def __getitem__(self, name):
+        food = self.get(name)
+        if food is None:
+            raise KeyError(name)
+        return food
+
+    def prefix(self, text, limit=10):
+        """Foods whose name or synonym starts with `text`, in name order, de-duplicated."""
+        key = normalize_name(text)
+        start = bisect.bisect_left(self._sorted_names, key)
+        results, seen = [], set()
+        for name in islice(self._sorted_names, start, None):
+            if not name.startswith(key) or len(results) >= limit:
+                break
+            food = self._by_name[name]
+            if food.id not in seen:
+                seen.add(food.id)
+                results.append(food)
+        return results
+
+
+_store = None
+
+
+def get_store():
+    """
+    Process-wide store. Rebuilds nutrition.sqlite3 when it is missing or older
+    than the CSVs in NUTRITION_DATA_CSV (os.pathsep-separated, default nutrition_data.csv).
+    """
+    global _store
+    if _store is None:
+        csv_paths = os.getenv("NUTRITION_DATA_CSV", DEFAULT_CSV).split(os.pathsep)
+        db_path = os.getenv("NUTRITION_DB_PATH", DEFAULT_DB)
+        if _is_stale(db_path, csv_paths):
+            build_store(csv_paths, db_path)
+        _store = NutritionStore(db_path)
+    return _store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the DiaBLife nutrition store")
+    parser.add_argument("--csv", action="append", default=[], help="extra CSV merged after nutrition_data.csv")
+    parser.add_argument("--db", default=os.getenv("NUTRITION_DB_PATH", DEFAULT_DB))
+    args = parser.parse_args()
+
+    food_count, synonym_count = build_store([DEFAULT_CSV, *args.csv], args.db)
+    print(f"Built {args.db}: {food_count} foods, {synonym_count} synonyms")
@@ -0,0 +1,136 @@
+# onnx_detector.py
+# Lightweight YOLOv8 runtime on ONNX Runtime (no torch / ultralytics / Streamlit import).
+# preprocess / postprocess are plain NumPy + OpenCV, testable without a model.
+
+import cv2
+import numpy as np
+
+from detection import CLASSES, predict_image as _predict_image, predict_images as _predict_images
+
+IMGSZ = 640
+PAD_VALUE = 114
+IOU_THRESHOLD = 0.7   # Ultralytics predict() default
+MAX_DETECTIONS = 300
+MAX_WH = 7680         # class offset for batched NMS
+
+
+def letterbox(frame, size=IMGSZ):
+    """Resize keeping aspect ratio and pad to size x size (centred), as Ultralytics does."""
+    h, w = frame.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    if (new_w, new_h) != (w, h):
+        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    frame = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+    return frame, ratio, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy NMS over xyxy boxes; returns kept indices, highest score first."""
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        rest = order[1:]
+        xx1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def preprocess(frames):
+    """BGR frames -> (float32 NCHW RGB batch in [0, 1], [(ratio, pad, original shape)])."""
+    batch = np.empty((len(frames), 3, IMGSZ, IMGSZ), dtype=np.float32)
+    meta = []
+    for i, frame in enumerate(frames):
+        padded, ratio, pad = letterbox(frame)
+        # BGR HWC uint8 -> RGB CHW float [0, 1]
+        batch[i] = padded[:, :, ::-1].transpose(2, 0, 1) * (1.0 / 255.0)
+        meta.append((ratio, pad, frame.shape[:2]))
+    return batch, meta
+
+
+def postprocess(output, conf_threshold, ratio, pad, shape, iou_threshold=IOU_THRESHOLD):
+    """
+    One image's raw YOLOv8 output (4 + nc, anchors) -> (N, 6) [x1, y1, x2, y2, conf, cls]
+    in original image coordinates: confidence filter, class-aware NMS, undo letterbox.
+    """
+    # output: (4 + nc, anchors) -> (anchors, 4 + nc)
+    predictions = output.T
+    scores_all = predictions[:, 4:]
+    class_ids = scores_all.argmax(axis=1)
+    scores = scores_all[np.arange(len(class_ids)), class_ids]
+    mask = scores > conf_threshold
+    if not mask.any():
+        return np.zeros((0, 6), dtype=np.float32)
+    predictions, class_ids, scores = predictions[mask], class_ids[mask], scores[mask]
+
+    cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    keep = nms(boxes + class_ids[:, None] * MAX_WH, scores, iou_threshold)[:MAX_DETECTIONS]
+    boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+
+    # undo letterbox
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+    return np.concatenate([boxes, scores[:, None], class_ids[:, None]], axis=1).astype(np.float32)
+
+
+class OnnxDetector:
+    """
+    Drop-in replacement for the Ultralytics model in cal.py.
+    `detect` returns one (N, 6) [x1, y1, x2, y2, conf, cls] array per frame, in
+    original image coordinates, so detection.detect_batch / predict_images work unchanged.
+    """
+
+    def __init__(self, path="./best.onnx", num_threads=0, providers=None, iou_threshold=IOU_THRESHOLD):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        if providers is None:
+            # onnxruntime-openvino exposes OpenVINO as an execution provider
+            available = ort.get_available_providers()
+            providers = [p for p in ("OpenVINOExecutionProvider", "CPUExecutionProvider") if p in available]
+        self.session = ort.InferenceSession(path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        self.dynamic_batch = not isinstance(batch_dim, int)
+        self.iou_threshold = iou_threshold
+        self.names = CLASSES
+
+    def detect(self, frames, conf_threshold=0.03):
+        batch, meta = preprocess(frames)
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: batch})[0]
+        else:
+            outputs = np.concatenate(
+                [self.session.run(None, {self.input_name: batch[i:i + 1]})[0] for i in range(len(frames))]
+            )
+        return [
+            postprocess(outputs[i], conf_threshold, *meta[i], self.iou_threshold)
+            for i in range(len(frames))
+        ]
+
+    # Same contract as cal.predict_image / cal.predict_images (detection.py)
+    def predict_image(self, image_path, conf_threshold=0.03):
+        return _predict_image(image_path, self, conf_threshold)
+
+    def predict_images(self, sources, conf_threshold=0.03, draw=True):
+        return _predict_images(sources, self, conf_threshold, draw)
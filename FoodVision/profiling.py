@@ -0,0 +1,310 @@
+# profiling.py
+# On-demand request profiling, switched on at runtime (no redeploy):
+#
+#   sampling   POST /admin/profiling?sample_rate=0.05 profiles ~5% of PROFILE_PATHS requests
+#   forced     `X-Profile: 1` together with a valid X-Admin-Token profiles that one request
+#
+# A profile holds
+#   functions  cProfile of the event-loop thread for the whole request (dependencies such
+#              as get_current_user, the endpoint, the streamed body), merged with cProfiles
+#              of its threadpool work run through call() (token verification, PIL decode)
+#   memory     tracemalloc: peak traced bytes and the allocations still held at the end
+#   timeline   every metrics.stage() the request went through, with offsets and threads
+#
+# The last PROFILE_RING_SIZE profiles stay in memory; GET /admin/profiling/{id}/pstats
+# downloads one for `python -m pstats` / snakeviz.
+#
+# One request per process is profiled at a time: the loop-thread profiler and tracemalloc
+# are process-wide, so they also see whatever else ran meanwhile (`concurrent` in the record).
+
+import cProfile
+import hmac
+import io
+import linecache
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import HTTP_IN_FLIGHT, stage_timeline
+
+_current = ContextVar("request_profile", default=None)
+
+# tracemalloc's own bookkeeping and import machinery are noise in a request diff
+_MEMORY_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def valid_admin_token(expected, given):
+    """Constant-time check; always False while no admin token is configured."""
+    return bool(expected) and bool(given) and hmac.compare_digest(expected.encode(), given.encode())
+
+
+def call(fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs) for run_in_threadpool: under its own cProfile (merged into the
+    request's profile) when the calling request is being profiled, plain otherwise.
+    """
+    profile = _current.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    thread_profile = cProfile.Profile()
+    try:
+        thread_profile.enable()
+    except ValueError:
+        # another profiler already owns this interpreter (sys.monitoring on 3.12+)
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        thread_profile.disable()
+        profile.add_thread_profile(thread_profile)
+
+
+class RequestProfile:
+    """Raw data collected for one request; Profiler.finish turns it into a record."""
+
+    def __init__(self, profile_id, method, path, trigger, tracemalloc_frames):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.tracemalloc_frames = tracemalloc_frames
+        self.started_at = datetime.now(timezone.utc)
+        self.concurrent = 0
+        self.loop_profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.timeline = []
+        self.started = self.elapsed = 0.0
+        self.peak_bytes = None
+        self._snapshots = None
+        self._owns_tracemalloc = False
+        self._loop_profiling = False
+
+    def add_thread_profile(self, profile):
+        # list.append is atomic; several threadpool calls may finish at once
+        self.thread_profiles.append(profile)
+
+    def begin(self):
+        self.concurrent = max(0, HTTP_IN_FLIGHT.value() - 1)
+        if self.tracemalloc_frames:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.tracemalloc_frames)
+                self._owns_tracemalloc = True
+            tracemalloc.reset_peak()
+            self._snapshots = [tracemalloc.take_snapshot()]
+        try:
+            self.loop_profile.enable()
+            self._loop_profiling = True
+        except ValueError:
+            print(f"Profile {self.id}: another profiler is active, recording timeline and memory only")
+        self.started = time.perf_counter()
+
+    def end(self):
+        self.elapsed = time.perf_counter() - self.started
+        if self._loop_profiling:
+            self.loop_profile.disable()
+        if self._snapshots is not None:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            self._snapshots.append(tracemalloc.take_snapshot())
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+
+    def build(self, status_code, top_n):
+        """(record dict, marshalled pstats or None). Slow-ish: run off the event loop."""
+        stats = None
+        if self._loop_profiling:
+            stats = pstats.Stats(self.loop_profile, stream=io.StringIO())
+        for thread_profile in self.thread_profiles:
+            if stats is None:
+                stats = pstats.Stats(thread_profile, stream=io.StringIO())
+            else:
+                stats.add(thread_profile)
+
+        functions = None
+        if stats is not None:
+            stats.stream = io.StringIO()
+            stats.sort_stats("cumulative").print_stats(top_n)
+            functions = stats.stream.getvalue()
+
+        memory = None
+        if self._snapshots is not None:
+            before, after = (snapshot.filter_traces(_MEMORY_FILTERS) for snapshot in self._snapshots)
+            memory = {
+                "peak_bytes": self.peak_bytes,
+                "retained": [
+                    {"where": str(diff.traceback[0]), "size_diff": diff.size_diff, "count_diff": diff.count_diff}
+                    for diff in after.compare_to(before, "lineno")[:top_n]
+                    if diff.size_diff > 0
+                ],
+            }
+
+        record = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "trigger": self.trigger,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.elapsed * 1000, 3),
+            "concurrent": self.concurrent,
+            "timeline": [
+                {
+                    "stage": name,
+                    "start_ms": round((started - self.started) * 1000, 3),
+                    "duration_ms": round(seconds * 1000, 3),
+                    "thread": thread,
+                }
+                for name, started, seconds, thread in sorted(self.timeline, key=lambda entry: entry[1])
+            ],
+            "memory": memory,
+            "functions": functions,
+        }
+        return record, marshal.dumps(stats.stats) if stats is not None else None
+
+
+class Profiler:
+    """Sampling decision, the one-at-a-time guard and the ring buffer of finished profiles."""
+
+    def __init__(self, sample_rate=0.0, paths=("/analyze-meal/",), ring_size=20, tracemalloc_frames=1, top_n=40):
+        self.sample_rate = sample_rate
+        self.paths = frozenset(paths)
+        self.tracemalloc_frames = tracemalloc_frames
+        self.top_n = top_n
+        self._ring = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+        self._busy = False
+        self._sequence = 0
+        self.profiled = 0
+        self.skipped_busy = 0
+
+    def configure(self, sample_rate=None, paths=None):
+        if sample_rate is not None:
+            if not 0.0 <= sample_rate <= 1.0:
+                raise ValueError("sample_rate must be between 0 and 1")
+            self.sample_rate = sample_rate
+        if paths is not None:
+            self.paths = frozenset(paths)
+
+    def trigger(self, path, forced):
+        """'header' / 'sample' when this request should be profiled, else None."""
+        if forced:
+            return "header"
+        if self.sample_rate > 0 and path in self.paths and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def start(self, method, path, trigger):
+        """A RequestProfile, or None while another request is being profiled."""
+        with self._lock:
+            if self._busy:
+                self.skipped_busy += 1
+                return None
+            self._busy = True
+            self._sequence += 1
+            profile_id = f"{os.getpid()}-{self._sequence}"
+        return RequestProfile(profile_id, method, path, trigger, self.tracemalloc_frames)
+
+    async def finish(self, profile, status_code):
+        try:
+            record, raw_stats = await run_in_threadpool(profile.build, status_code, self.top_n)
+        except Exception as e:
+            print(f"Profile {profile.id} could not be built: {e}")
+            return
+        finally:
+            with self._lock:
+                self._busy = False
+        with self._lock:
+            self.profiled += 1
+            self._ring.append((record, raw_stats))
+        print(f"Profile {profile.id}: {record['method']} {record['path']} {record['duration_ms']} ms ({record['trigger']})")
+
+    def get(self, profile_id):
+        """(record, marshalled pstats) or None."""
+        with self._lock:
+            for record, raw_stats in self._ring:
+                if record["id"] == profile_id:
+                    return record, raw_stats
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._ring.clear()
+
+    def stats(self):
+        with self._lock:
+            summaries = [
+                {key: record[key] for key in ("id", "method", "path", "status", "trigger", "started_at", "duration_ms")}
+                for record, _ in reversed(self._ring)
+            ]
+        return {
+            "sample_rate": self.sample_rate,
+            "paths": sorted(self.paths),
+            "ring_size": self._ring.maxlen,
+            "tracemalloc_frames": self.tracemalloc_frames,
+            "profiled": self.profiled,
+            "skipped_busy": self.skipped_busy,
+            "profiles": summaries,
+        }
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware that profiles the requests the Profiler picks and answers
+    them with an X-Profile-Id header. Costs a dict lookup per request while idle.
+    """
+
+    def __init__(self, app, profiler, admin_token=None):
+        self.app = app
+        self.profiler = profiler
+        self.admin_token = admin_token
+
+    def _forced(self, scope):
+        if not self.admin_token:
+            return False
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile", b"").lower() not in (b"1", b"true", b"yes"):
+            return False
+        return valid_admin_token(self.admin_token, headers.get(b"x-admin-token", b"").decode("latin-1"))
+
+    async def __call__(self, scope, receive, send):
+        trigger = None
+        if scope["type"] == "http":
+            trigger = self.profiler.trigger(scope["path"], self._forced(scope))
+        profile = self.profiler.start(scope["method"], scope["path"], trigger) if trigger else None
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        profile_token = _current.set(profile)
+        timeline_token = stage_timeline.set(profile.timeline)
+        profile.begin()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.end()
+            stage_timeline.reset(timeline_token)
+            _current.reset(profile_token)
+            await self.profiler.finish(profile, status_code)
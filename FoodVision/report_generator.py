@@ -1,5 +1,21 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby
+
 from fpdf import FPDF
-from datetime import datetime
+
+PATIENT_ID = "DS-8291-X"
+# Part of the cache key: bump when the layout changes so cached PDFs are not reused
+REPORT_VERSION = 2
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", 32))
+CHART_CACHE_SIZE = int(os.getenv("REPORT_CHART_CACHE_SIZE", 64))
 
 class DiaSenseReport(FPDF):
     def header(self):
@@ -15,6 +31,12 @@ class DiaSenseReport(FPDF):
         self.set_text_color(128, 128, 128)
         self.cell(0, 10, f'Page {self.page_no()}', align='C')
 
+    def normalize_text(self, text):
+        # Core fonts are latin-1 only; model output may contain other characters
+        if not self.is_ttf_font:
+            text = text.encode('latin-1', 'replace').decode('latin-1')
+        return super().normalize_text(text)
+
     def chapter_title(self, title):
         self.set_font('Helvetica', 'B', 12)
         self.set_fill_color(240, 248, 255) # Light Blue
@@ -27,47 +49,39 @@ class DiaSenseReport(FPDF):
         self.multi_cell(0, 5, body)
         self.ln()
 
-def generate_pdf(data, filename="report.pdf"):
-    pdf = DiaSenseReport()
-    pdf.add_page()
-    
-    # 1. Patient Info
-    pdf.set_font('Helvetica', '', 10)
-    pdf.cell(0, 5, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", new_x="LMARGIN", new_y="NEXT")
-    pdf.cell(0, 5, "Patient ID: DS-8291-X", new_x="LMARGIN", new_y="NEXT")
-    pdf.ln(10)
-    
+    def key_value(self, key, value):
+        self.set_font('Helvetica', 'B', 10)
+        self.cell(40, 7, key, border=1)
+        self.set_font('Helvetica', '', 10)
+        self.cell(0, 7, str(value), border=1, new_x="LMARGIN", new_y="NEXT")
+
+    def patient_info(self, patient_id, period=None):
+        self.set_font('Helvetica', '', 10)
+        self.cell(0, 5, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", new_x="LMARGIN", new_y="NEXT")
+        self.cell(0, 5, f"Patient ID: {patient_id}", new_x="LMARGIN", new_y="NEXT")
+        if period:
+            self.cell(0, 5, f"Period: {period}", new_x="LMARGIN", new_y="NEXT")
+        self.ln(10)
+
+# --- SECTIONS ---
+def meal_sections(pdf, data, title="Meal Analysis Summary"):
+    """Summary, metrics, components table and prediction for one analysis dict."""
     # 2. Meal Summary
-    pdf.chapter_title("Meal Analysis Summary")
-    pdf.chapter_body(data.get('meal_summary', 'No summary provided.'))
-    
+    pdf.chapter_title(title)
+    pdf.chapter_body(data.get('meal_summary') or 'No summary provided.')
+
     # 3. Metrics
     pdf.chapter_title("Key Metabolic Metrics")
-    carbs = data.get('total_carbs_est', 'N/A')
-    advice = data.get('diasense_advice', {})
-    risk = advice.get('risk_level', 'N/A')
-    bolus = advice.get('suggested_bolus_strategy', 'N/A')
-    
-    pdf.set_font('Helvetica', 'B', 10)
-    pdf.cell(40, 7, "Total Carbs:", border=1)
-    pdf.set_font('Helvetica', '', 10)
-    pdf.cell(0, 7, f"{carbs} g", border=1, new_x="LMARGIN", new_y="NEXT")
-    
-    pdf.set_font('Helvetica', 'B', 10)
-    pdf.cell(40, 7, "Risk Level:", border=1)
-    pdf.set_font('Helvetica', '', 10)
-    pdf.cell(0, 7, f"{risk}", border=1, new_x="LMARGIN", new_y="NEXT")
-    
-    pdf.set_font('Helvetica', 'B', 10)
-    pdf.cell(40, 7, "Strategy:", border=1)
-    pdf.set_font('Helvetica', '', 10)
-    pdf.cell(0, 7, f"{bolus}", border=1, new_x="LMARGIN", new_y="NEXT")
+    advice = data.get('diasense_advice') or {}
+    pdf.key_value("Total Carbs:", f"{data.get('total_carbs_est', 'N/A')} g")
+    pdf.key_value("Risk Level:", advice.get('risk_level', 'N/A'))
+    pdf.key_value("Strategy:", advice.get('suggested_bolus_strategy', 'N/A'))
     pdf.ln(5)
-    
+
     # 4. Components Table
     pdf.chapter_title("Food Components Breakdown")
     components = data.get('components', [])
-    
+
     if components:
         # Table Header
         pdf.set_font('Helvetica', 'B', 9)
@@ -75,29 +89,367 @@ def generate_pdf(data, filename="report.pdf"):
         pdf.cell(40, 7, "Portion", border=1)
         pdf.cell(20, 7, "Carbs", border=1)
         pdf.cell(30, 7, "Glycemic Index", border=1, new_x="LMARGIN", new_y="NEXT")
-        
+
         # Table Rows
         pdf.set_font('Helvetica', '', 9)
         for c in components:
-            name = c.get('name', '')[:25] # Truncate for simplicity
-            portion = c.get('portion_est', '')[:20]
+            name = str(c.get('name', ''))[:25] # Truncate for simplicity
+            portion = str(c.get('portion_est', ''))[:20]
             carbs_g = str(c.get('carbs_g', ''))
-            gi = c.get('glycemic_index', '')
-            
+            gi = str(c.get('glycemic_index', ''))
+
             pdf.cell(60, 7, name, border=1)
             pdf.cell(40, 7, portion, border=1)
             pdf.cell(20, 7, carbs_g, border=1)
             pdf.cell(30, 7, gi, border=1, new_x="LMARGIN", new_y="NEXT")
     else:
         pdf.chapter_body("No detailed components detected.")
-        
+
     pdf.ln(5)
-    
+
     # 5. Clinical Prediction
     pdf.chapter_title("Clinical Prediction")
     pdf.chapter_body(advice.get('prediction', 'No prediction available.'))
-    
-    return pdf.output(dest='S').encode('latin-1') # Return bytes for Streamlit download
+
+def period_summary(pdf, meals):
+    """Totals and a one-line-per-meal log table for a date range."""
+    pdf.chapter_title("Period Summary")
+    total_carbs = sum(meal.get('total_carbs') or 0 for meal in meals)
+    risks = {}
+    for meal in meals:
+        risk = meal.get('risk_level') or 'N/A'
+        risks[risk] = risks.get(risk, 0) + 1
+    pdf.key_value("Meals:", len(meals))
+    pdf.key_value("Total Carbs:", f"{total_carbs:.0f} g")
+    pdf.key_value("Avg per Meal:", f"{total_carbs / len(meals):.0f} g" if meals else "N/A")
+    pdf.key_value("Risk Levels:", ", ".join(f"{risk}: {count}" for risk, count in sorted(risks.items())) or "N/A")
+    pdf.ln(5)
+
+    pdf.chapter_title("Meal Log")
+    pdf.set_font('Helvetica', 'B', 9)
+    pdf.cell(35, 7, "Time", border=1)
+    pdf.cell(95, 7, "Meal", border=1)
+    pdf.cell(20, 7, "Carbs", border=1)
+    pdf.cell(30, 7, "Risk", border=1, new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font('Helvetica', '', 9)
+    for meal in meals:
+        pdf.cell(35, 7, _timestamp(meal.get('ts')), border=1)
+        pdf.cell(95, 7, str(meal.get('meal_summary') or '')[:55], border=1)
+        pdf.cell(20, 7, f"{meal.get('total_carbs') or 0:.0f} g", border=1)
+        pdf.cell(30, 7, str(meal.get('risk_level') or ''), border=1, new_x="LMARGIN", new_y="NEXT")
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    return str(value or '')[:16].replace('T', ' ')
+
+# --- BUILDERS ---
+def build_meal_report(data, patient_id=PATIENT_ID):
+    pdf = DiaSenseReport()
+    pdf.add_page()
+    # 1. Patient Info
+    pdf.patient_info(patient_id)
+    meal_sections(pdf, data)
+    return pdf
+
+def build_range_report(meals, start, end, patient_id=PATIENT_ID):
+    """
+    Multi-page report for meal_log.meals_between(..., with_payload=True) rows:
+    period summary and meal log table, then one detail section per meal.
+    """
+    pdf = DiaSenseReport()
+    pdf.add_page()
+    pdf.patient_info(patient_id, period=f"{_timestamp(start)[:10]} to {_timestamp(end)[:10]}")
+    period_summary(pdf, meals)
+    for meal in meals:
+        pdf.add_page()
+        meal_sections(pdf, meal.get('payload') or meal, title=f"{_timestamp(meal.get('ts'))} - Meal Analysis")
+    return pdf
+
+def render(pdf):
+    return bytes(pdf.output())
+
+# --- CACHE ---
+# Reports are memoized by a hash of their input, so reruns and repeat downloads
+# of unchanged data reuse the bytes instead of re-rendering.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def report_key(kind, *parts):
+    payload = json.dumps([REPORT_VERSION, kind, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _cached(key, build):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    pdf_bytes = render(build())
+    with _cache_lock:
+        _cache[key] = pdf_bytes
+        while len(_cache) > REPORT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return pdf_bytes
+
+def generate_pdf(data, filename="report.pdf", patient_id=PATIENT_ID):
+    """Single-meal report bytes (memoized by content)."""
+    return _cached(report_key("meal", data, patient_id), lambda: build_meal_report(data, patient_id))
+
+def generate_range_pdf(meals, start, end, patient_id=PATIENT_ID):
+    """Date-range report bytes for meal log rows (memoized by content)."""
+    return _cached(
+        report_key("range", meals, start, end, patient_id),
+        lambda: build_range_report(meals, start, end, patient_id),
+    )
+
+def meal_log_report(meal_log, uid, start, end, patient_id=PATIENT_ID):
+    """Date-range report for a user straight from the meal log."""
+    meals = meal_log.meals_between(uid, start, end, with_payload=True)
+    return generate_range_pdf(meals, start, end, patient_id)
+
+# --- BULK EXPORT ---
+_worker_meal_log = None
+
+def _init_export_worker(meal_log_url):
+    # each process opens its own engine; connections must not cross a fork
+    global _worker_meal_log
+    from meal_log import MealLog
+    _worker_meal_log = MealLog(meal_log_url)
+
+def _export_one(job, out_dir):
+    uid, start, end = job
+    meals = _worker_meal_log.meals_between(uid, start, end, with_payload=True)
+    pdf = build_range_report(meals, start, end, patient_id=uid)
+    safe_uid = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in uid)
+    path = os.path.join(out_dir, f"{safe_uid}_{_timestamp(start)[:10]}_{_timestamp(end)[:10]}.pdf")
+    pdf.output(path)
+    return path, pdf.pages_count
+
+def export_reports(jobs, out_dir, meal_log_url, workers=None):
+    """
+    Writes one date-range PDF per (uid, start, end) job into out_dir, rendered in
+    a process pool (FPDF is pure Python, so threads would serialize on the GIL).
+    Returns [(path, pages)] in job order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_export_worker, initargs=(meal_log_url,)) as pool:
+        return list(pool.map(_export_one, jobs, [out_dir] * len(jobs), chunksize=max(1, len(jobs) // 32)))
+
+# --- STREAMING ---
+class StreamingReport(DiaSenseReport):
+    """
+    DiaSenseReport that writes every finished page to `out` (anything with write())
+    and drops its content, so memory is bounded by one page plus the font list, not
+    by the length of the document. fpdf2 still does all layout; this class only
+    replaces its buffered output() with incremental PDF objects and an xref at the
+    end. Supports what the reports use: core fonts and JPEG images, each image
+    object written once however many pages show it.
+    """
+
+    PAGES_ID, RESOURCES_ID = 1, 2  # reserved: written last, referenced by every page
+
+    def __init__(self, out):
+        super().__init__()
+        self.out = out
+        self.position = 0
+        self.offsets = {}
+        self.next_id = 3
+        self.page_ids = []
+        self.image_ids = {}
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def _object(self, body, obj_id=None, stream=None):
+        if obj_id is None:
+            obj_id, self.next_id = self.next_id, self.next_id + 1
+        self.offsets[obj_id] = self.position
+        self._write(f"{obj_id} 0 obj\n".encode() + body.encode("latin-1"))
+        if stream is not None:
+            self._write(b"\nstream\n" + stream + b"\nendstream")
+        self._write(b"\nendobj\n")
+        return obj_id
+
+    def _flush_images(self):
+        for info in self.image_cache.images.values():
+            if info["i"] in self.image_ids:
+                continue
+            if info["f"] != "DCTDecode":
+                raise ValueError("StreamingReport only embeds JPEG images")
+            data = bytes(info["data"])
+            self.image_ids[info["i"]] = self._object(
+                f"<< /Type /XObject /Subtype /Image /Width {info['w']} /Height {info['h']} "
+                f"/ColorSpace /{info['cs']} /BitsPerComponent {info['bpc']} /Filter /DCTDecode "
+                f"/Length {len(data)} >>",
+                stream=data,
+            )
+            info["data"] = b""  # reused placements only need the cached size
+
+    def _flush_page(self, page_no):
+        page = self.pages[page_no]
+        self._flush_images()
+        content = zlib.compress(bytes(page.contents))
+        content_id = self._object(f"<< /Filter /FlateDecode /Length {len(content)} >>", stream=content)
+        self.page_ids.append(self._object(
+            f"<< /Type /Page /Parent {self.PAGES_ID} 0 R /MediaBox [0 0 {self.w_pt:.2f} {self.h_pt:.2f}] "
+            f"/Resources {self.RESOURCES_ID} 0 R /Contents {content_id} 0 R >>"
+        ))
+        page.contents = bytearray()
+
+    def add_page(self, *args, **kwargs):
+        previous = self.page
+        super().add_page(*args, **kwargs)  # renders the previous page's footer first
+        if previous:
+            self._flush_page(previous)
+
+    def finish(self):
+        """Writes the last page, fonts, page tree, catalog and xref. Nothing can be added afterwards."""
+        if self.page == 0:
+            self.add_page()
+        self._render_footer()
+        self._flush_page(self.page)
+        fonts = " ".join(
+            f"/F{font.i} {self._object(f'<< /Type /Font /Subtype /Type1 /BaseFont /{font.name} /Encoding /WinAnsiEncoding >>')} 0 R"
+            for font in self.fonts.values()
+        )
+        images = " ".join(f"/I{index} {obj_id} 0 R" for index, obj_id in self.image_ids.items())
+        self._object(
+            f"<< /ProcSet [/PDF /Text /ImageB /ImageC /ImageI] /Font << {fonts} >> /XObject << {images} >> >>",
+            obj_id=self.RESOURCES_ID,
+        )
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._object(f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>", obj_id=self.PAGES_ID)
+        catalog_id = self._object(f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>")
+        info_id = self._object(f"<< /Producer (DiaSense) /CreationDate (D:{datetime.now():%Y%m%d%H%M%S}) >>")
+
+        xref_at = self.position
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, self.next_id)]
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root {catalog_id} 0 R /Info {info_id} 0 R >>\n")
+        lines.append(f"startxref\n{xref_at}\n%%EOF\n")
+        self._write("".join(lines).encode())
+
+class _Chunks:
+    """write() target that a generator drains between pages."""
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+# --- CHARTS ---
+# Rasterized once per distinct input (LRU) and embedded once per document.
+_charts = OrderedDict()
+
+def chart_jpeg(days, carbs, glucose, cgm=None):
+    """
+    JPEG of glucose (CGM line + min/max band when cgm is a cgm_store.chart() dict,
+    else daily averages) over daily carbs bars.
+    """
+    cgm_key = None if cgm is None else [cgm["ts"].tolist(), [round(v, 1) for v in cgm["mg_dl"].tolist()],
+                                         None if cgm["band"] is None else cgm["band"].tolist()]
+    key = report_key("chart", days, carbs, glucose, cgm_key)
+    with _cache_lock:
+        if key in _charts:
+            _charts.move_to_end(key)
+            return _charts[key]
+
+    import numpy as np
+    from matplotlib.figure import Figure
+    import rollups
+
+    fig = Figure(figsize=(7.5, 3.0), dpi=110)
+    top, bottom = fig.subplots(2, 1, sharex=True, gridspec_kw={"height_ratios": [2, 1]})
+    top.axhspan(rollups.TIR_LOW, rollups.TIR_HIGH, color="#10B981", alpha=0.08)
+    if cgm is not None:
+        if cgm["band"] is not None:
+            band = cgm["band"]
+            top.fill_between(band["ts"].astype("datetime64[s]"), band["min"], band["max"],
+                             step="post", color="#3B82F6", alpha=0.2, linewidth=0)
+        top.plot(np.asarray(cgm["ts"]).astype("datetime64[s]"), cgm["mg_dl"], color="#3B82F6", linewidth=0.8)
+    else:
+        top.plot(days, [np.nan if value is None else value for value in glucose], color="#3B82F6", marker="o")
+    top.set_ylabel("mg/dL")
+    bottom.bar(days, carbs, color="#10B981", width=0.8)
+    bottom.set_ylabel("Carbs (g)")
+    fig.autofmt_xdate()
+    fig.subplots_adjust(left=0.09, right=0.98, top=0.97, bottom=0.18, hspace=0.08)  # fixed: tight_layout doubles the cost
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="jpeg", pil_kwargs={"quality": 80})
+    jpeg = buffer.getvalue()
+
+    with _cache_lock:
+        _charts[key] = jpeg
+        while len(_charts) > CHART_CACHE_SIZE:
+            _charts.popitem(last=False)
+    return jpeg
+
+def _period_chart(pdf, meal_log, cgm_store, uid, start, end):
+    import numpy as np
+
+    first, last = start.date(), (end - timedelta(seconds=1)).date()
+    rows = {row["day"]: row for row in meal_log.daily(uid, first, last)}
+    days = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+    carbs = [rows[day]["carbs_total"] if day in rows else 0 for day in days]
+    glucose = [rows[day]["glucose_avg"] if day in rows else None for day in days]
+    cgm = cgm_store.chart(uid, start, end, max_points=600) if cgm_store is not None else None
+    if cgm is not None and not len(cgm["ts"]):
+        cgm = None
+    if cgm is None and not any(value is not None for value in glucose) and not any(carbs):
+        return
+    pdf.image(io.BytesIO(chart_jpeg(days, carbs, glucose, cgm)), w=pdf.epw)
+    pdf.ln(4)
+
+def stream_report(meal_log, uid, start, end, patient_id=None, cgm_store=None, batch_size=200):
+    """
+    Yields a long-history report as PDF byte chunks, one or more pages at a time:
+    period summary from the rollups, a glucose / carbs chart for the period and
+    each week, then every meal (meal_log.iter_meals pages through the log).
+    Memory stays flat however many meals the range holds.
+    """
+    import rollups
+
+    chunks = _Chunks()
+    pdf = StreamingReport(chunks)
+    pdf.add_page()
+    pdf.patient_info(patient_id or uid, period=f"{_timestamp(start)[:10]} to {_timestamp(end)[:10]}")
+
+    summary = rollups.summarize(meal_log.daily(uid, start.date(), (end - timedelta(seconds=1)).date()))
+    pdf.chapter_title("Period Summary")
+    pdf.key_value("Meals:", summary["meal_count"])
+    pdf.key_value("Daily Carbs:", "N/A" if summary["carbs_per_day"] is None else f"{summary['carbs_per_day']:.0f} g")
+    pdf.key_value("Avg Glucose:", "N/A" if summary["glucose_avg"] is None else f"{summary['glucose_avg']:.0f} mg/dL")
+    pdf.key_value("Time in Range:", "N/A" if summary["time_in_range"] is None else f"{summary['time_in_range']:.0f}%")
+    pdf.key_value("Carb Ratio:", "N/A" if summary["carb_ratio"] is None else f"1:{summary['carb_ratio']:.0f}")
+    pdf.ln(5)
+    _period_chart(pdf, meal_log, cgm_store, uid, start, end)
+    yield chunks.drain()
+
+    meals = meal_log.iter_meals(uid, start, end, batch_size=batch_size)
+    for week, week_meals in groupby(meals, key=lambda meal: rollups.week_start(meal["ts"].date())):
+        week_start = datetime.combine(week, datetime.min.time())
+        pdf.add_page()
+        pdf.chapter_title(f"Week of {week:%Y-%m-%d}")
+        _period_chart(pdf, meal_log, cgm_store, uid, max(start, week_start), min(end, week_start + timedelta(days=7)))
+        for meal in week_meals:
+            meal_sections(pdf, meal["payload"], title=f"{_timestamp(meal['ts'])} - Meal Analysis")
+            yield chunks.drain()
+    pdf.finish()
+    yield chunks.drain()
+
+def write_report(f, meal_log, uid, start, end, **kwargs):
+    """stream_report into a binary file object; returns the bytes written."""
+    written = 0
+    for chunk in stream_report(meal_log, uid, start, end, **kwargs):
+        f.write(chunk)
+        written += len(chunk)
+    return written
 
 # Test block
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+
+# Keys Gemini's response_schema understands (OpenAPI subset); everything else
+# pydantic emits (title, default, additionalProperties, ...) is dropped.
+SCHEMA_KEYS = {"type", "properties", "items", "required", "enum", "format", "nullable", "description"}
+
+REPAIR_PROMPT = """
+The following text was supposed to be a single JSON object matching the DiaBLife
+meal analysis format, but it could not be parsed. Return ONLY the corrected JSON
+object, with no markdown and no commentary.
+
+TEXT:
+"""
+
+
+class ParseError(ValueError):
+    pass
+
+
+# --- SCHEMA ---
+def gemini_response_schema(model_cls, exclude=()):
+    """
+    Converts a pydantic model into the schema dict accepted by
+    GenerationConfig.response_schema: $refs are inlined, unsupported keys dropped,
+    and server-side fields listed in `exclude` are removed from the top level.
+    """
+    schema = model_cls.model_json_schema()
+    defs = schema.get("$defs", {})
+
+    def convert(node):
+        if "$ref" in node:
+            return convert(defs[node["$ref"].split("/")[-1]])
+        if "anyOf" in node:
+            # Optional[X] -> X, nullable
+            options = [option for option in node["anyOf"] if option.get("type") != "null"]
+            converted = convert(options[0])
+            converted["nullable"] = True
+            return converted
+        out = {}
+        for key, value in node.items():
+            if key not in SCHEMA_KEYS:
+                continue
+            if key == "properties":
+                out[key] = {name: convert(child) for name, child in value.items()}
+            elif key == "items":
+                out[key] = convert(value)
+            else:
+                out[key] = value
+        return out
+
+    result = convert(schema)
+    for name in exclude:
+        result.get("properties", {}).pop(name, None)
+    if "required" in result:
+        result["required"] = [name for name in result["required"] if name not in exclude]
+    return result
+
+
+# --- EXTRACTION ---
+def extract_json_object(text):
+    """
+    Returns the first balanced {...} block in `text`, ignoring braces inside strings.
+    Tolerates markdown fences, preamble and trailing prose.
+    """
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = False
+        escape = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    return text[start:i + 1]
+        start = text.find("{", start + 1)
+    return None
+
+
+# --- PARSER ---
+class StructuredOutputParser:
+    """
+    Parses model output into a validated dict.
+    1. json.loads on the raw text (the normal case in JSON response mode)
+    2. brace-matching extraction for fenced / chatty replies
+    3. a single repair call back to the model, only when 1 and 2 fail
+    """
+
+    def __init__(self, validate=None):
+        self.validate = validate
+        self._lock = threading.Lock()
+        self.counts = {"parsed": 0, "extracted": 0, "repaired": 0, "failed": 0}
+        self.seconds = 0.0
+
+    def _count(self, outcome, elapsed):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.seconds += elapsed
+
+    def _load(self, text):
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ParseError("Model output is not a JSON object")
+        if self.validate:
+            self.validate(data)
+        return data
+
+    def _parse_local(self, text):
+        """Returns (data, outcome) without calling the model; raises ParseError."""
+        try:
+            return self._load(text.strip()), "parsed"
+        except Exception:
+            pass
+        block = extract_json_object(text)
+        if block is not None:
+            try:
+                return self._load(block), "extracted"
+            except Exception as e:
+                raise ParseError(f"Invalid model output: {e}")
+        raise ParseError("No JSON object found in model output")
+
+    def parse(self, text):
+        started = time.perf_counter()
+        try:
+            data, outcome = self._parse_local(text)
+        except ParseError:
+            self._count("failed", time.perf_counter() - started)
+            raise
+        self._count(outcome, time.perf_counter() - started)
+        return data
+
+    async def parse_or_repair(self, text, repair):
+        """
+        `repair` is an async callable(prompt_text) -> str, used at most once.
+        Time spent waiting on the repair call is included in `seconds`.
+        """
+        started = time.perf_counter()
+        try:
+            data, outcome = self._parse_local(text)
+            self._count(outcome, time.perf_counter() - started)
+            return data
+        except ParseError as first_error:
+            print(f"Model output unparseable ({first_error}), attempting repair")
+
+        try:
+            repaired_text = await repair(REPAIR_PROMPT + text)
+            data, _ = self._parse_local(repaired_text)
+        except Exception as e:
+            self._count("failed", time.perf_counter() - started)
+            raise ParseError(f"Could not parse model output after repair: {e}")
+        self._count("repaired", time.perf_counter() - started)
+        return data
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                **self.counts,
+                "total": total,
+                "failure_rate": round(self.counts["failed"] / total, 4) if total else 0.0,
+                "seconds_total": round(self.seconds, 6),
+            }
@@ -0,0 +1,328 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from PIL import Image
+
+# --- FINGERPRINTING ---
+DHASH_BITS = 64
+BAND_BITS = 16  # dHash is split into 4 bands for the SQLite near-duplicate index
+HISTOGRAM_BINS = 4  # per RGB channel
+HISTOGRAM_SIZE = 32  # thumbnail edge the histogram is taken from
+
+# A near-duplicate (dHash within max_distance) is only accepted when the aspect
+# ratio and the coarse colour histogram agree too: dHash alone only sees
+# grayscale gradients, so a bowl of pasta and a bowl of rice can collide.
+MAX_ASPECT_DELTA = 0.02     # relative
+MAX_COLOUR_DISTANCE = 0.1   # normalized L1 between histograms, 0..1
+
+Fingerprint = namedtuple("Fingerprint", "sha256 dhash aspect histogram")
+
+
+def image_fingerprint(image):
+    """
+    Returns a Fingerprint (sha256_hex, dhash, aspect ratio, colour histogram) for a PIL image.
+    The SHA-256 is taken over the decoded RGB pixels, so the same picture re-encoded
+    or re-uploaded with different metadata still hits the exact-match key.
+    """
+    rgb = image.convert("RGB")
+    digest = hashlib.sha256()
+    digest.update(f"{rgb.width}x{rgb.height}".encode("ascii"))
+    digest.update(rgb.tobytes())
+    return Fingerprint(digest.hexdigest(), dhash(rgb), rgb.width / rgb.height, colour_histogram(rgb))
+
+
+def colour_histogram(image):
+    """HISTOGRAM_BINS bins per channel over a small thumbnail; each channel sums to HISTOGRAM_SIZE**2."""
+    counts = image.resize((HISTOGRAM_SIZE, HISTOGRAM_SIZE), Image.BILINEAR).histogram()
+    step = 256 // HISTOGRAM_BINS
+    return [
+        sum(counts[channel * 256 + b * step: channel * 256 + (b + 1) * step])
+        for channel in range(3)
+        for b in range(HISTOGRAM_BINS)
+    ]
+
+
+def similar(fingerprint, aspect, histogram):
+    """Second check for near-duplicate candidates: same shape and colour distribution."""
+    if abs(fingerprint.aspect - aspect) > MAX_ASPECT_DELTA * aspect:
+        return False
+    distance = sum(abs(a - b) for a, b in zip(fingerprint.histogram, histogram))
+    return distance / (2 * 3 * HISTOGRAM_SIZE ** 2) <= MAX_COLOUR_DISTANCE
+
+
+def dhash(image, hash_size=8):
+    """Difference hash: 64-bit gradient signature of a 9x8 grayscale thumbnail."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (i * BAND_BITS)) & mask for i in range(DHASH_BITS // BAND_BITS)]
+
+
+def _to_signed(value):
+    """SQLite INTEGER is signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+# --- BACKENDS ---
+# Entries are scoped per user: one user's upload never returns another user's analysis.
+class MemoryResultCache:
+    """In-process LRU of analysis payloads keyed by (uid, image SHA-256), with optional TTL."""
+
+    def __init__(self, max_size=512, max_distance=0, ttl=None):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (uid, sha256) -> (fingerprint, payload, created_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, uid, fingerprint):
+        now = time.time()
+        with self._lock:
+            key = (uid, fingerprint.sha256)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[2], now):
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if self.max_distance > 0:
+                best_key, best_distance = None, self.max_distance + 1
+                for other_key, (other, _, created_at) in self._entries.items():
+                    if other_key[0] != uid or self._expired(created_at, now):
+                        continue
+                    distance = hamming(fingerprint.dhash, other.dhash)
+                    if distance < best_distance and similar(fingerprint, other.aspect, other.histogram):
+                        best_key, best_distance = other_key, distance
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.near_hits += 1
+                    return self._entries[best_key][1]
+
+            self.misses += 1
+            return None
+
+    def put(self, uid, fingerprint, payload):
+        with self._lock:
+            key = (uid, fingerprint.sha256)
+            self._entries[key] = (fingerprint, payload, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteResultCache:
+    """
+    On-disk cache that survives restarts, bounded by `max_size` rows (least recently
+    used evicted first) and by `ttl` seconds since `created_at`.
+    Near-duplicates are found through four 16-bit dHash band indexes: two hashes within
+    Hamming distance <= 3 always share at least one band exactly (pigeonhole), so only
+    the rows matching a band are compared. Larger distances fall back to a per-user scan.
+    """
+
+    COLUMNS = (
+        "uid", "sha256", "dhash", "band0", "band1", "band2", "band3",
+        "aspect", "histogram", "payload", "created_at", "last_used",
+    )
+
+    def __init__(self, path="analysis_cache.sqlite3", max_distance=0, max_size=512, ttl=None):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        existing = [row[1] for row in self._conn.execute("PRAGMA table_info(analysis_cache)")]
+        if existing and tuple(existing) != self.COLUMNS:
+            # cache file from an older schema (no per-user scoping): start over
+            self._conn.execute("DROP TABLE analysis_cache")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                uid TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                dhash INTEGER NOT NULL,
+                band0 INTEGER NOT NULL,
+                band1 INTEGER NOT NULL,
+                band2 INTEGER NOT NULL,
+                band3 INTEGER NOT NULL,
+                aspect REAL NOT NULL,
+                histogram TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (uid, sha256)
+            )
+            """
+        )
+        for i in range(4):
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_analysis_cache_band{i} ON analysis_cache (uid, band{i})"
+            )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_created_at ON analysis_cache (created_at)")
+        self._conn.commit()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def _conn(self):
+        # SQLite connections must not cross fork(): a forked worker opens its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+        return self._db
+
+    def _min_created_at(self, now):
+        return now - self.ttl if self.ttl is not None else float("-inf")
+
+    def _touch(self, uid, sha256, now):
+        self._conn.execute(
+            "UPDATE analysis_cache SET last_used = ? WHERE uid = ? AND sha256 = ?", (now, uid, sha256)
+        )
+        self._conn.commit()
+
+    def get(self, uid, fingerprint):
+        now = time.time()
+        min_created_at = self._min_created_at(now)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM analysis_cache WHERE uid = ? AND sha256 = ? AND created_at >= ?",
+                (uid, fingerprint.sha256, min_created_at),
+            ).fetchone()
+            if row is not None:
+                self._touch(uid, fingerprint.sha256, now)
+                self.hits += 1
+                return json.loads(row[0])
+
+            if self.max_distance > 0:
+                columns = "sha256, dhash, aspect, histogram, payload"
+                if self.max_distance < DHASH_BITS // BAND_BITS:
+                    # one indexed lookup per band, merged by UNION
+                    query = " UNION ".join(
+                        f"SELECT {columns} FROM analysis_cache WHERE uid = ? AND band{i} = ? AND created_at >= ?"
+                        for i in range(4)
+                    )
+                    params = [value for band in _bands(fingerprint.dhash) for value in (uid, band, min_created_at)]
+                    rows = self._conn.execute(query, params).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        f"SELECT {columns} FROM analysis_cache WHERE uid = ? AND created_at >= ?",
+                        (uid, min_created_at),
+                    ).fetchall()
+
+                best, best_distance = None, self.max_distance + 1
+                for sha256, other_dhash, aspect, histogram, payload in rows:
+                    distance = hamming(fingerprint.dhash, _to_unsigned(other_dhash))
+                    if distance < best_distance and similar(fingerprint, aspect, json.loads(histogram)):
+                        best, best_distance = (sha256, payload), distance
+                if best is not None:
+                    self._touch(uid, best[0], now)
+                    self.near_hits += 1
+                    return json.loads(best[1])
+
+            self.misses += 1
+            return None
+
+    def _evict(self, now):
+        removed = self._conn.execute(
+            "DELETE FROM analysis_cache WHERE created_at < ?", (self._min_created_at(now),)
+        ).rowcount
+        excess = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0] - self.max_size
+        if excess > 0:
+            removed += self._conn.execute(
+                "DELETE FROM analysis_cache WHERE rowid IN "
+                "(SELECT rowid FROM analysis_cache ORDER BY last_used LIMIT ?)",
+                (excess,),
+            ).rowcount
+        self.evictions += removed
+
+    def put(self, uid, fingerprint, payload):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO analysis_cache ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [
+                    uid, fingerprint.sha256, _to_signed(fingerprint.dhash), *_bands(fingerprint.dhash),
+                    fingerprint.aspect, json.dumps(fingerprint.histogram), json.dumps(payload), now, now,
+                ],
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "size": size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def create_result_cache(backend, path=None, max_size=512, max_distance=0, ttl=None):
+    """Factory used by main.py. backend: 'memory', 'sqlite' or 'off'."""
+    backend = (backend or "off").lower()
+    if backend == "memory":
+        return MemoryResultCache(max_size=max_size, max_distance=max_distance, ttl=ttl)
+    if backend == "sqlite":
+        return SQLiteResultCache(
+            path=path or "analysis_cache.sqlite3", max_distance=max_distance, max_size=max_size, ttl=ttl
+        )
+    return None
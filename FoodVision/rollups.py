@@ -0,0 +1,107 @@
+# rollups.py
+# Incremental aggregates behind the dashboard metrics.
+#
+# Every meal / reading is turned into a delta of running sums (FIELDS) that the
+# meal log adds to three rows in the same transaction: the user's day, the user's
+# week and the user's all-time totals. Everything the dashboard shows is derived
+# from a fixed number of those rows (two 7-day windows = 14 daily rows), so a
+# refresh costs the same with a week of history or with five years.
+
+import os
+from collections import namedtuple
+from datetime import timedelta
+
+TIR_LOW = float(os.getenv("TIR_LOW", 70))    # mg/dL, time-in-range lower bound
+TIR_HIGH = float(os.getenv("TIR_HIGH", 180))  # mg/dL, upper bound
+
+FIELDS = (
+    "meal_count", "carbs_total", "glycemic_load_total", "insulin_total",
+    "glucose_sum", "glucose_count", "glucose_in_range",
+)
+
+Metric = namedtuple("Metric", "label value delta delta_type")
+
+
+def in_range(glucose):
+    return TIR_LOW <= glucose <= TIR_HIGH
+
+
+def delta(meal_count=0, carbs=0.0, glycemic_load=0.0, insulin=0.0, glucose=None):
+    """Running-sum increments for one meal or reading."""
+    return {
+        "meal_count": meal_count,
+        "carbs_total": carbs or 0.0,
+        "glycemic_load_total": glycemic_load or 0.0,
+        "insulin_total": insulin or 0.0,
+        "glucose_sum": glucose or 0.0,
+        "glucose_count": 0 if glucose is None else 1,
+        "glucose_in_range": 1 if glucose is not None and in_range(glucose) else 0,
+    }
+
+
+def empty():
+    return dict.fromkeys(FIELDS, 0)
+
+
+def add(total, row):
+    for field in FIELDS:
+        total[field] += row[field]
+    return total
+
+
+def week_start(day):
+    """Monday of the day's ISO week (the weekly_rollups key)."""
+    return day - timedelta(days=day.weekday())
+
+
+# --- DERIVED VALUES ---
+def summarize(rows):
+    """Sums rollup rows and derives the averages the dashboard shows (None when undefined)."""
+    total = empty()
+    days_logged = 0
+    for row in rows:
+        add(total, row)
+        days_logged += 1 if row["meal_count"] else 0
+    glucose_count = total["glucose_count"]
+    total["days_logged"] = days_logged
+    total["glucose_avg"] = total["glucose_sum"] / glucose_count if glucose_count else None
+    total["time_in_range"] = 100.0 * total["glucose_in_range"] / glucose_count if glucose_count else None
+    total["carbs_per_day"] = total["carbs_total"] / days_logged if days_logged else None
+    # grams of carbohydrate covered by one unit of insulin (the "1:12" ratio)
+    total["carb_ratio"] = total["carbs_total"] / total["insulin_total"] if total["insulin_total"] else None
+    return total
+
+
+def _change(current, previous, relative=True):
+    if current is None or previous is None:
+        return 0
+    if not relative:
+        return round(current - previous)
+    return round(100.0 * (current - previous) / previous) if previous else 0
+
+
+def _direction(change, lower_is_better):
+    if change == 0:
+        return "neutral"
+    return "good" if (change < 0) == lower_is_better else "bad"
+
+
+def dashboard_metrics(week, previous_week):
+    """The four metric cards from two summarize() results (this week vs the 7 days before)."""
+    tir = week["time_in_range"]
+    tir_change = _change(tir, previous_week["time_in_range"], relative=False)
+    glucose = week["glucose_avg"]
+    glucose_change = _change(glucose, previous_week["glucose_avg"])
+    carbs = week["carbs_per_day"]
+    carbs_change = _change(carbs, previous_week["carbs_per_day"])
+    ratio = week["carb_ratio"]
+    return [
+        Metric("Time in Range", "—" if tir is None else f"{tir:.0f}%", tir_change,
+               _direction(tir_change, lower_is_better=False)),
+        Metric("Avg Glucose", "—" if glucose is None else f"{glucose:.0f} mg/dL", glucose_change,
+               _direction(glucose_change, lower_is_better=True)),
+        Metric("Daily Carbs", "—" if carbs is None else f"{carbs:.0f}g", carbs_change,
+               _direction(carbs_change, lower_is_better=True)),
+        Metric("Insulin Sensitivity", "—" if ratio is None else f"1:{ratio:.0f}",
+               _change(ratio, previous_week["carb_ratio"]), "neutral"),
+    ]
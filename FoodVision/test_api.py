@@ -1,56 +1,124 @@
-import time
-import requests
-import subprocess
-import sys
+"""
+End-to-end check of the API over HTTP, offline: main.app under uvicorn with the fake
+Gemini and Identity Toolkit servers from fake_services.py (no API keys, no network).
+
+    python test_api.py
+"""
+import io
+import json
 import os
+import tempfile
+
+import requests
+from PIL import Image
+
+from fake_services import CANNED_ANALYSIS, FakeGemini, FakeIdentityToolkit, start_app
+from inference_limiter import InferenceLimiter
+
+AUTH = {"Authorization": "Bearer test-token"}
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploaded_image.jpg")
+
+
+def meal_image(seed):
+    """A small distinct JPEG per seed (distinct pixels, so no result cache hit across seeds)."""
+    image = Image.open(SAMPLE_IMAGE).convert("RGB")
+    image.putpixel((seed, seed), (seed % 256, 0, 255 - seed % 256))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def sse_events(text):
+    return [block.split("\n", 1)[0][len("event: "):] for block in text.strip().split("\n\n") if block]
+
 
 def test_api():
-    # Start the server using venv python
-    print("Starting server...")
-    venv_python = os.path.join(os.getcwd(), "venv", "bin", "python")
-    if not os.path.exists(venv_python):
-        print(f"Error: venv python not found at {venv_python}")
-        return
-
-    process = subprocess.Popen(
-        [venv_python, "-m", "uvicorn", "main:app", "--port", "8000"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    
-    try:
-        # Wait for server to start
-        time.sleep(5)
-        
-        url = "http://127.0.0.1:8000/analyze-meal/"
-        image_path = "uploaded_image.jpg"
-        
-        if not os.path.exists(image_path):
-            print(f"Error: {image_path} not found.")
-            return
-
-        print(f"Sending request to {url} with {image_path}...")
-        with open(image_path, "rb") as f:
-            files = {"file": ("test_image.jpg", f, "image/jpeg")}
-            response = requests.post(url, files=files)
-        
-        print(f"Status Code: {response.status_code}")
-        if response.status_code == 200:
-            print("Response JSON:")
-            print(response.json())
-            print("\nSUCCESS: API call was successful.")
-        else:
-            print("FAILURE: API call failed.")
-            print(response.text)
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        # Kill the server
-        print("Stopping server...")
-        process.terminate()
-        process.wait()
+    gemini = FakeGemini(latency_ms=20).start()
+    identity = FakeIdentityToolkit(latency_ms=5).start()
+    with tempfile.TemporaryDirectory() as data_dir:
+        main, server = start_app(data_dir, gemini, identity)
+        url = server.url
+        try:
+            image = meal_image(1)
+
+            print("Checking authentication...")
+            response = requests.post(f"{url}/analyze-meal/", files={"file": ("meal.jpg", image, "image/jpeg")})
+            assert response.status_code == 401, response.text
+            response = requests.post(
+                f"{url}/analyze-meal/", files={"file": ("meal.jpg", image, "image/jpeg")},
+                headers={"Authorization": "Bearer bad-token"},
+            )
+            assert response.status_code == 401, response.text
+
+            print("Checking /analyze-meal/ ...")
+            response = requests.post(f"{url}/analyze-meal/", files={"file": ("meal.jpg", image, "image/jpeg")}, headers=AUTH)
+            assert response.status_code == 200, response.text
+            result = response.json()
+            assert result["status"] == "success" and result["backend"] == "gemini" and not result["cache_hit"]
+            assert result["total_carbs_est"] == CANNED_ANALYSIS["total_carbs_est"]
+            assert len(result["food_matches"]) == len(CANNED_ANALYSIS["components"])
+            assert result["risk_check"]["risk_level"]
+
+            today = requests.get(f"{url}/meals/summary", headers=AUTH).json()["today"]
+            assert today["meal_count"] == 1, today
+
+            print("Checking cached re-uploads...")
+            response = requests.post(f"{url}/analyze-meal/", files={"file": ("again.jpg", image, "image/jpeg")}, headers=AUTH)
+            assert response.status_code == 200 and response.json()["cache_hit"], response.text
+            response = requests.post(f"{url}/analyze-meal/stream", files={"file": ("again.jpg", image, "image/jpeg")}, headers=AUTH)
+            assert response.status_code == 200 and sse_events(response.text)[-1] == "result", response.text
+            # the meal is already logged: a re-upload must not count it again
+            assert requests.get(f"{url}/meals/summary", headers=AUTH).json()["today"] == today
+
+            print("Checking /analyze-meal/stream ...")
+            response = requests.post(
+                f"{url}/analyze-meal/stream", files={"file": ("meal.jpg", meal_image(2), "image/jpeg")}, headers=AUTH
+            )
+            assert response.status_code == 200, response.text
+            events = sse_events(response.text)
+            assert events.count("component") == len(CANNED_ANALYSIS["components"]) and events[-1] == "result", events
+
+            print("Checking /analyze-meals/ ...")
+            files = [("files", (f"meal-{seed}.jpg", meal_image(seed), "image/jpeg")) for seed in (3, 4)]
+            files.append(("files", ("notes.txt", b"not an image", "text/plain")))
+            response = requests.post(f"{url}/analyze-meals/", files=files, headers=AUTH)
+            lines = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+            assert [line["ok"] for line in lines] == [True, True, False], lines
+
+            print("Checking Gemini failures and the repair path...")
+            gemini.error_rate = 1.0
+            response = requests.post(f"{url}/analyze-meal/", files={"file": ("meal.jpg", meal_image(5), "image/jpeg")}, headers=AUTH)
+            assert response.status_code == 500 and "Analysis failed" in response.text, response.text
+            gemini.error_rate, gemini.bad_json_rate = 0.0, 1.0
+            response = requests.post(f"{url}/analyze-meal/", files={"file": ("meal.jpg", meal_image(6), "image/jpeg")}, headers=AUTH)
+            assert response.status_code == 200 and gemini.counts["repair"] == 1, response.text
+            gemini.bad_json_rate = 0.0
+
+            print("Checking overload (503 + Retry-After)...")
+            limiter = main.inference_limiter
+            # no slots and no queue: every request that needs the model is rejected
+            main.inference_limiter = InferenceLimiter(max_concurrency=0, max_queue=0, retry_after=7)
+            try:
+                for path in ("/analyze-meal/", "/analyze-meal/stream"):
+                    response = requests.post(f"{url}{path}", files={"file": ("meal.jpg", meal_image(7), "image/jpeg")}, headers=AUTH)
+                    assert response.status_code == 503 and response.headers["Retry-After"] == "7", response.text
+            finally:
+                main.inference_limiter = limiter
+
+            print("Checking /meals/summary and /metrics ...")
+            response = requests.get(f"{url}/meals/summary", headers=AUTH)
+            assert response.status_code == 200 and response.json()["has_data"], response.text
+            metrics = requests.get(f"{url}/metrics").text
+            assert 'diablife_http_requests_total{method="POST",route="/analyze-meal/",status="200"}' in metrics
+            assert 'diablife_stage_duration_seconds_count{stage="gemini"}' in metrics
+
+            print(f"Fake Gemini calls: {gemini.counts}, Identity Toolkit lookups: {identity.counts}")
+            print("\nSUCCESS: API checks passed.")
+        finally:
+            server.stop()
+            gemini.stop()
+            identity.stop()
+
 
 if __name__ == "__main__":
     test_api()
@@ -0,0 +1,124 @@
+"""
+CGM export parsing and import (cgm_store.py): LibreView date formats and the
+day-order check, Dexcom parsing and deduplication across and within imports.
+
+    python -m pytest test_cgm_store.py
+"""
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from cgm_store import CGMStore, iter_readings
+from meal_log import MealLog
+
+LIBRE_HEADER = (
+    "Glucose Data,Generated on,03-21-2024 10:00 AM UTC,Generated by,Test\n"
+    "Device,Serial Number,Device Timestamp,Record Type,Historic Glucose mg/dL,Scan Glucose mg/dL\n"
+)
+
+
+def libre_export(start, count, time_format, step=timedelta(minutes=15)):
+    """LibreView CSV with `count` 15-minute history readings from `start`."""
+    rows = [
+        f"FreeStyle LibreLink,ABC,{(start + i * step).strftime(time_format)},0,{100 + i % 50},"
+        for i in range(count)
+    ]
+    return io.StringIO(LIBRE_HEADER + "\n".join(rows) + "\n")
+
+
+@pytest.mark.parametrize("chunk_rows", [50_000, 100])
+def test_eu_day_first_export(tmp_path, chunk_rows):
+    # 10-19 March in DD-MM-YYYY: the first days also read as October-December
+    store = CGMStore(str(tmp_path))
+    result = store.import_csv("u1", libre_export(datetime(2024, 3, 10), 960, "%d-%m-%Y %H:%M"), chunk_rows=chunk_rows)
+    assert (result.rows, result.imported, result.invalid) == (960, 960, 0)
+    assert (result.first, result.last) == ("2024-03-10T00:00:00", "2024-03-19T23:45:00")
+
+
+def test_us_export_with_am_pm():
+    readings = list(iter_readings(libre_export(datetime(2024, 3, 10), 960, "%m-%d-%Y %I:%M %p"), chunk_rows=100))
+    ts = [t for _, chunk_ts, _, _, _ in readings for t in chunk_ts]
+    assert len(ts) == 960 and sum(invalid for *_, invalid in readings) == 0
+    assert str(min(ts).astype("datetime64[s]")) == "2024-03-10T00:00:00"
+
+
+def test_ambiguous_day_order_is_rejected(tmp_path):
+    # 1-10 March: every date reads both ways
+    store = CGMStore(str(tmp_path))
+    with pytest.raises(ValueError, match="Ambiguous"):
+        store.import_csv("u1", libre_export(datetime(2024, 3, 1), 960, "%d-%m-%Y %H:%M"), chunk_rows=100)
+    assert store.count("u1") == 0
+
+
+def test_explicit_date_order(tmp_path):
+    store = CGMStore(str(tmp_path))
+    export = libre_export(datetime(2024, 3, 1), 960, "%d-%m-%Y %H:%M")
+    result = store.import_csv("u1", export, date_order="DMY")
+    assert result.imported == 960 and result.first == "2024-03-01T00:00:00"
+
+
+def test_format_change_within_file():
+    export = libre_export(datetime(2024, 3, 13), 200, "%m-%d-%Y %H:%M").getvalue()
+    export += "\n".join(
+        f"FreeStyle LibreLink,ABC,{(datetime(2024, 3, 20) + timedelta(minutes=15 * i)).strftime('%d-%m-%Y %H:%M')},0,120,"
+        for i in range(200)
+    ) + "\n"
+    with pytest.raises(ValueError, match="change format"):
+        list(iter_readings(io.StringIO(export), chunk_rows=100))
+
+
+def dexcom_export(start, count, step=timedelta(minutes=5)):
+    """Dexcom Clarity CSV: device metadata rows, then `count` EGV rows from `start`."""
+    lines = [
+        "Index,Timestamp (YYYY-MM-DDThh:mm:ss),Event Type,Event Subtype,Patient Info,Glucose Value (mg/dL)",
+        "1,,FirstName,,Test,",
+        "2,,Device,,G6,",
+    ]
+    lines += [f"{3 + i},{(start + i * step).isoformat()},EGV,,,{100 + i % 80}" for i in range(count)]
+    return io.StringIO("\n".join(lines) + "\n")
+
+
+def test_reimport_is_deduplicated(tmp_path):
+    store = CGMStore(str(tmp_path))
+    first = store.import_csv("u1", dexcom_export(datetime(2024, 3, 10), 288))
+    again = store.import_csv("u1", dexcom_export(datetime(2024, 3, 10), 288))
+    assert (first.format, first.imported, first.duplicates) == ("dexcom", 288, 0)
+    assert (again.imported, again.duplicates, again.first) == (0, 288, None)
+    assert store.count("u1") == 288
+
+
+def test_reimport_adds_rollups_once(tmp_path):
+    store = CGMStore(str(tmp_path / "cgm"))
+    log = MealLog(f"sqlite:///{tmp_path / 'meal_log.sqlite3'}")
+    for _ in range(2):
+        store.import_csv("u1", dexcom_export(datetime(2024, 3, 10), 288), meal_log=log)
+    assert log.totals("u1")["glucose_count"] == 288
+
+
+def test_overlapping_and_earlier_imports_merge_in_order(tmp_path):
+    store = CGMStore(str(tmp_path))
+    store.import_csv("u1", dexcom_export(datetime(2024, 3, 10, 12), 144))
+    # 12:00 the day before .. 12:00 plus 12 h: half new (earlier), half overlapping
+    result = store.import_csv("u1", dexcom_export(datetime(2024, 3, 9, 12), 432))
+    assert (result.imported, result.duplicates) == (288, 144)
+    assert (result.first, result.last) == ("2024-03-09T12:00:00", "2024-03-10T11:55:00")
+    ts, _ = store.series("u1")
+    assert len(ts) == 432 and (ts[1:] > ts[:-1]).all()
+
+
+def test_same_second_within_a_file_is_kept_once(tmp_path):
+    export = dexcom_export(datetime(2024, 3, 10), 10).getvalue() + "99,2024-03-10T00:00:00,EGV,,,180\n"
+    store = CGMStore(str(tmp_path))
+    result = store.import_csv("u1", io.StringIO(export))
+    assert (result.imported, result.duplicates) == (10, 1) and store.count("u1") == 10
+
+
+def test_dexcom_out_of_range_text_and_invalid_rows(tmp_path):
+    export = dexcom_export(datetime(2024, 3, 10), 3).getvalue()
+    export += "10,2024-03-10T01:00:00,EGV,,,Low\n11,2024-03-10T01:05:00,EGV,,,High\n"
+    export += "12,2024-03-10T01:10:00,EGV,,,\n13,not a time,EGV,,,120\n14,2024-03-10T01:20:00,Calibration,,,130\n"
+    store = CGMStore(str(tmp_path))
+    result = store.import_csv("u1", io.StringIO(export))
+    assert (result.imported, result.invalid) == (5, 2)
+    assert list(store.series("u1")[1][-2:]) == [40, 400]
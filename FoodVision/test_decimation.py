@@ -0,0 +1,65 @@
+"""
+CGM chart decimation (decimation.py): LTTB point selection, tiles and the bounded
+chart_series output.
+
+    python -m pytest test_decimation.py
+"""
+import numpy as np
+import pytest
+
+from decimation import TILE_WIDTHS, build_tiles, chart_series, lttb, merge_tiles
+
+
+def day_of_readings(days=1, step=300, seed=0):
+    ts = np.arange(0, days * 86400, step, dtype=np.int64) + 1_700_000_000 // 86400 * 86400
+    rng = np.random.default_rng(seed)
+    mg_dl = (140 + 40 * np.sin(np.arange(len(ts)) / 30) + rng.normal(0, 5, len(ts))).astype(np.int16)
+    return ts.astype(np.uint32), mg_dl
+
+
+@pytest.mark.parametrize("n_out", [3, 10, 100])
+def test_lttb_keeps_endpoints_and_order(n_out):
+    ts, mg_dl = day_of_readings()
+    keep = lttb(ts, mg_dl, n_out)
+    assert len(keep) == n_out
+    assert keep[0] == 0 and keep[-1] == len(ts) - 1
+    assert (np.diff(keep) > 0).all()
+
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(1000)
+    y = np.full(1000, 100.0)
+    y[537] = 350.0
+    assert 537 in lttb(x, y, 20)
+
+
+def test_lttb_returns_everything_when_small():
+    assert list(lttb(np.arange(5), np.arange(5), 10)) == [0, 1, 2, 3, 4]
+
+
+def test_tiles_summarise_each_bucket():
+    ts = np.array([0, 600, 3600, 4000, 7300], dtype=np.uint32)
+    mg_dl = np.array([100, 200, 90, 110, 300], dtype=np.int16)
+    tiles = build_tiles(ts, mg_dl, 3600)
+    assert tiles["ts"].tolist() == [0, 3600, 7200]
+    assert tiles["min"].tolist() == [100, 90, 300] and tiles["max"].tolist() == [200, 110, 300]
+    assert tiles["sum"].tolist() == [300, 200, 300] and tiles["count"].tolist() == [2, 2, 1]
+
+    merged = merge_tiles(tiles, 2)
+    assert merged["min"].tolist() == [90, 300] and merged["count"].tolist() == [4, 1]
+
+
+def test_chart_series_is_bounded_for_long_histories():
+    ts, mg_dl = day_of_readings(days=90)
+    levels = {width: build_tiles(ts, mg_dl, width) for width in TILE_WIDTHS}
+    chart = chart_series(ts, mg_dl, levels, max_points=200)
+    assert len(chart["ts"]) == 200 and len(chart["band"]) <= 200
+    assert chart["resolution"] > 0
+    # the envelope still holds the extremes of the whole range
+    assert chart["band"]["min"].min() == mg_dl.min() and chart["band"]["max"].max() == mg_dl.max()
+
+
+def test_chart_series_passes_short_ranges_through():
+    ts, mg_dl = day_of_readings()
+    chart = chart_series(ts, mg_dl, {}, max_points=1000)
+    assert len(chart["ts"]) == len(ts) and chart["band"] is None and chart["resolution"] == 0
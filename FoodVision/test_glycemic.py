@@ -0,0 +1,67 @@
+"""
+Bulk meal scoring (glycemic.score_meals / score_component_lists) against a plain
+per-meal scalar computation.
+
+    python -m pytest test_glycemic.py
+"""
+import random
+
+import numpy as np
+
+from glycemic import (
+    DEFAULT_THRESHOLDS, GI_BY_CATEGORY, RiskThresholds, score_component_lists, score_components, score_meals,
+)
+
+
+def scalar_score(components, thresholds=DEFAULT_THRESHOLDS):
+    """One meal, one component at a time: GL = sum(carbs x GI / 100)."""
+    gl = 0.0
+    for component in components:
+        gi = GI_BY_CATEGORY[component["glycemic_index"].lower()]
+        gl += (component["carbs_g"] or 0) * gi / 100
+    if gl > thresholds.gl_high:
+        return gl, "High"
+    if gl > thresholds.gl_moderate:
+        return gl, "Medium"
+    return gl, "Low"
+
+
+def random_meals(n_meals, seed=0):
+    rng = random.Random(seed)
+    return [
+        [
+            {"carbs_g": rng.choice([0, None, rng.randint(1, 90)]), "glycemic_index": rng.choice(["Low", "Medium", "High"])}
+            for _ in range(rng.randint(0, 6))
+        ]
+        for _ in range(n_meals)
+    ]
+
+
+def test_score_meals_matches_per_meal_scalar():
+    meals = random_meals(500)
+    carbs = np.array([c["carbs_g"] or 0 for meal in meals for c in meal], dtype=np.float64)
+    gi = np.array([GI_BY_CATEGORY[c["glycemic_index"].lower()] for meal in meals for c in meal])
+    meal_ids = np.array([i for i, meal in enumerate(meals) for _ in meal])
+    meal_gl, risk_codes = score_meals(carbs, gi, meal_ids, len(meals))
+    assert meal_gl.shape == risk_codes.shape == (len(meals),)
+    for i, meal in enumerate(meals):
+        gl, risk = scalar_score(meal)
+        assert abs(meal_gl[i] - gl) < 1e-9
+        assert ["Low", "Medium", "High"][risk_codes[i]] == risk
+
+
+def test_component_lists_match_score_components():
+    meals = random_meals(300, seed=1)
+    thresholds = RiskThresholds(gl_moderate=15, gl_high=30)
+    meal_gl, risk_levels = score_component_lists(meals, thresholds)
+    for i, meal in enumerate(meals):
+        gl, risk = scalar_score(meal, thresholds)
+        assert meal_gl[i] == round(gl, 1)
+        assert risk_levels[i] == risk
+        assert score_components(meal, thresholds) == (round(gl, 1), risk)
+
+
+def test_empty_inputs():
+    meal_gl, risk_levels = score_component_lists([])
+    assert len(meal_gl) == len(risk_levels) == 0
+    assert score_components([]) == (0.0, "Low")
@@ -0,0 +1,54 @@
+"""
+InferenceLimiter (inference_limiter.py): concurrency cap, bounded queue, queue timeout
+and the Retry-After hint main.py turns into a 503.
+
+    python -m pytest test_inference_limiter.py
+"""
+import asyncio
+
+import pytest
+
+from inference_limiter import InferenceLimiter, Overloaded
+
+
+def test_waiters_beyond_the_queue_are_rejected():
+    async def scenario():
+        limiter = InferenceLimiter(max_concurrency=1, max_queue=1, queue_timeout=5, retry_after=3)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats()["waiting"] == 1
+
+        with pytest.raises(Overloaded) as excinfo:
+            await limiter.acquire()
+        assert excinfo.value.retry_after == 3 and "queue full" in excinfo.value.reason
+
+        limiter.release()
+        await waiter  # the queued request gets the freed slot
+        assert (limiter.active, limiter.waiting, limiter.rejected) == (1, 0, 1)
+        limiter.release()
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_is_overloaded():
+    async def scenario():
+        limiter = InferenceLimiter(max_concurrency=1, max_queue=4, queue_timeout=0.01)
+        async with limiter.slot():
+            with pytest.raises(Overloaded, match="Timed out"):
+                await limiter.acquire()
+        assert limiter.stats() == {"max_concurrency": 1, "max_queue": 4, "active": 0, "waiting": 0, "rejected": 1}
+
+    asyncio.run(scenario())
+
+
+def test_slot_is_released_on_error():
+    async def scenario():
+        limiter = InferenceLimiter(max_concurrency=1, max_queue=0)
+        with pytest.raises(RuntimeError):
+            async with limiter.slot():
+                raise RuntimeError("model failed")
+        async with limiter.slot():
+            assert limiter.active == 1
+
+    asyncio.run(scenario())
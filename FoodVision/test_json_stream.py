@@ -0,0 +1,67 @@
+"""
+IncrementalJSONParser (json_stream.py): events come out as soon as their text is
+complete, whatever the chunk boundaries.
+
+    python -m pytest test_json_stream.py
+"""
+import json
+
+import pytest
+
+from fake_services import CANNED_ANALYSIS
+from json_stream import IncrementalJSONParser
+
+TEXT = json.dumps(CANNED_ANALYSIS)
+
+
+def expected_events(analysis):
+    """Fields in document order; each array's items come just before the array itself."""
+    events = []
+    for key, value in analysis.items():
+        if isinstance(value, list):
+            events.extend(("item", key, index, item) for index, item in enumerate(value))
+        events.append(("field", key, value))
+    return events
+
+
+def feed_all(parser, chunks):
+    return [event for chunk in chunks for event in parser.feed(chunk)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, len(TEXT)])
+def test_any_chunking_gives_the_same_events(size):
+    parser = IncrementalJSONParser()
+    events = feed_all(parser, [TEXT[i:i + size] for i in range(0, len(TEXT), size)])
+    assert events == expected_events(CANNED_ANALYSIS)
+    assert parser.done
+
+
+def test_items_are_emitted_before_the_array_closes():
+    text = '{"components": [{"name": "rice", "carbs_g": 45}, {"name": "salad"'
+    events = IncrementalJSONParser().feed(text)
+    assert events == [("item", "components", 0, {"name": "rice", "carbs_g": 45})]
+
+
+def test_scalars_end_at_the_next_delimiter():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"total_carbs_est": 5') == []  # could still be 50
+    assert parser.feed('0, "flag": true, "note": null') == [("field", "total_carbs_est", 50), ("field", "flag", True)]
+    assert parser.feed("}") == [("field", "note", None)]
+
+
+def test_escaped_quotes_and_braces_inside_strings():
+    text = r'{"meal_summary": "a \"big\" {plate}, [rice]", "scores": [1, 2.5, "x,y"]}'
+    events = feed_all(IncrementalJSONParser(), text)
+    assert events == [
+        ("field", "meal_summary", 'a "big" {plate}, [rice]'),
+        ("item", "scores", 0, 1),
+        ("item", "scores", 1, 2.5),
+        ("item", "scores", 2, "x,y"),
+        ("field", "scores", [1, 2.5, "x,y"]),
+    ]
+
+
+def test_markdown_fences_and_trailing_text_are_ignored():
+    parser = IncrementalJSONParser()
+    events = feed_all(parser, ["```json\n", '{"risk": "Low"}', "\n```\nHope this helps!"])
+    assert events == [("field", "risk", "Low")] and parser.done
@@ -0,0 +1,75 @@
+"""
+MicroBatcher (micro_batcher.py): coalescing, queue bound and its /metrics histograms.
+
+    python -m pytest test_micro_batcher.py
+"""
+import asyncio
+import time
+
+import pytest
+
+from inference_limiter import Overloaded
+from metrics import BATCH_QUEUE_WAIT, BATCH_SIZE
+from micro_batcher import MicroBatcher
+
+
+def histogram(metric, batcher):
+    """{suffix or le: value} for one series."""
+    out = {}
+    for suffix, labels, value in metric.samples():
+        labels = dict(labels)
+        if labels.get("batcher") == batcher:
+            out[labels.get("le", suffix)] = value
+    return out
+
+
+def test_concurrent_submits_share_a_batch():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=50, name="test-coalesce")
+        return await asyncio.gather(*(batcher.submit(i) for i in range(6))), batcher
+
+    results, batcher = asyncio.run(main())
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert batcher.stats()["batch_size_histogram"] == {2: 1, 4: 1}
+
+    sizes = histogram(BATCH_SIZE, "test-coalesce")
+    assert sizes["_count"] == 2 and sizes["_sum"] == 6
+    assert (sizes["1"], sizes["2"], sizes["4"]) == (0, 1, 2)  # cumulative buckets
+    waits = histogram(BATCH_QUEUE_WAIT, "test-coalesce")
+    assert waits["_count"] == 6 and waits["_sum"] > 0
+
+
+def test_queue_wait_covers_the_previous_batch():
+    def run_batch(items):
+        time.sleep(0.05)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, max_batch_size=1, max_wait_ms=0, name="test-wait")
+        await asyncio.gather(batcher.submit(1), batcher.submit(2))
+
+    asyncio.run(main())
+    waits = histogram(BATCH_QUEUE_WAIT, "test-wait")
+    # the second item waited for the first forward pass
+    assert waits["_count"] == 2 and waits["_sum"] >= 0.05 and waits["0.025"] == 1
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        batcher = MicroBatcher(lambda items: items, max_batch_size=1, max_wait_ms=0, max_queue=1, retry_after=3)
+        batcher._ensure_worker()
+        # fill the queue before the worker task gets to run
+        await batcher._queue.put((0, asyncio.get_running_loop().create_future(), time.perf_counter()))
+        with pytest.raises(Overloaded) as info:
+            await batcher.submit(1)
+        return info.value, batcher
+
+    error, batcher = asyncio.run(main())
+    assert error.retry_after == 3 and batcher.rejected == 1
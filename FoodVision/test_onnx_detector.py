@@ -0,0 +1,83 @@
+"""
+ONNX detector pre/post-processing (onnx_detector.py) on synthetic model outputs,
+so it runs without best.pt / best.onnx (see test_onnx_parity.py for the real model).
+
+    python -m pytest test_onnx_detector.py
+"""
+import numpy as np
+
+from onnx_detector import IMGSZ, PAD_VALUE, OnnxDetector, letterbox, postprocess, preprocess
+
+NUM_CLASSES = 3
+
+
+def raw_output(rows, anchors=16):
+    """YOLOv8-style (4 + nc, anchors) output from [(cx, cy, w, h, class_id, score)] in letterbox pixels."""
+    output = np.zeros((4 + NUM_CLASSES, anchors), dtype=np.float32)
+    for i, (cx, cy, w, h, class_id, score) in enumerate(rows):
+        output[:4, i] = cx, cy, w, h
+        output[4 + class_id, i] = score
+    return output
+
+
+def test_letterbox_keeps_aspect_ratio():
+    frame = np.zeros((960, 1280, 3), dtype=np.uint8)
+    padded, ratio, pad = letterbox(frame)
+    assert padded.shape == (IMGSZ, IMGSZ, 3)
+    assert ratio == 0.5 and pad == (0, 80)
+    assert (padded[:80] == PAD_VALUE).all() and (padded[80:560] == 0).all() and (padded[560:] == PAD_VALUE).all()
+
+
+def test_preprocess_is_rgb_chw():
+    frame = np.zeros((320, 320, 3), dtype=np.uint8)
+    frame[..., 0] = 255  # BGR blue
+    batch, meta = preprocess([frame])
+    assert batch.shape == (1, 3, IMGSZ, IMGSZ) and batch.dtype == np.float32
+    assert batch[0, 2, 320, 320] == 1.0 and batch[0, 0, 320, 320] == 0.0
+    assert meta == [(2.0, (0, 0), (320, 320))]
+
+
+def test_postprocess_filters_nms_and_maps_back():
+    # original 960 x 1280 frame: ratio 0.5, 80 px of padding above and below
+    output = raw_output([
+        (320, 320, 100, 60, 0, 0.90),   # kept
+        (322, 321, 100, 60, 0, 0.80),   # same class, overlaps the first -> suppressed
+        (320, 320, 100, 60, 1, 0.70),   # same box, other class -> kept (class-aware NMS)
+        (500, 300, 50, 50, 2, 0.02),    # below the confidence threshold
+        (10, 100, 40, 40, 2, 0.50),     # reaches into the padding -> clipped to the image
+    ])
+    boxes = postprocess(output, 0.03, 0.5, (0, 80), (960, 1280))
+    np.testing.assert_allclose(boxes, [
+        [540, 420, 740, 540, 0.9, 0],
+        [540, 420, 740, 540, 0.7, 1],
+        [0, 0, 60, 80, 0.5, 2],
+    ], atol=1e-4)
+
+
+def test_postprocess_without_detections():
+    boxes = postprocess(raw_output([(320, 320, 10, 10, 0, 0.01)]), 0.03, 1.0, (0, 0), (640, 640))
+    assert boxes.shape == (0, 6)
+
+
+class FakeSession:
+    """Stands in for an onnxruntime.InferenceSession with a dynamic batch axis."""
+
+    def __init__(self, output):
+        self.output = output
+        self.batches = []
+
+    def run(self, _, feeds):
+        batch = next(iter(feeds.values()))
+        self.batches.append(batch.shape)
+        return [np.repeat(self.output[None], len(batch), axis=0)]
+
+
+def test_detector_contract():
+    detector = OnnxDetector.__new__(OnnxDetector)
+    detector.session = FakeSession(raw_output([(320, 320, 100, 60, 1, 0.9)]))
+    detector.input_name, detector.dynamic_batch, detector.iou_threshold = "images", True, 0.7
+    frames = [np.zeros((640, 640, 3), dtype=np.uint8)] * 2
+    results = detector.predict_images(frames, draw=False)
+    assert detector.session.batches == [(2, 3, IMGSZ, IMGSZ)]  # one forward pass
+    assert [[d["class"] for d in details] for _, details in results] == [["avocados"], ["avocados"]]
+    assert results[0][1][0]["bbox"] == (270.0, 290.0, 370.0, 350.0)
@@ -0,0 +1,80 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+
+def box_iou(a, b):
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    xx1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    yy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    xx2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    yy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def compare_boxes(reference, candidate, conf_threshold=0.25, iou_threshold=0.9, conf_tolerance=0.05):
+    """Every confident PyTorch detection must have a same-class ONNX match."""
+    reference = reference[reference[:, 4] >= conf_threshold]
+    candidate = candidate[candidate[:, 4] >= conf_threshold - conf_tolerance]
+    if len(reference) == 0:
+        return True, "no confident detections"
+    if len(candidate) == 0:
+        return False, f"{len(reference)} reference detections, none from ONNX"
+    iou = box_iou(reference[:, :4], candidate[:, :4])
+    same_class = reference[:, None, 5] == candidate[None, :, 5]
+    iou = np.where(same_class, iou, 0)
+    best = iou.argmax(axis=1)
+    matched_iou = iou[np.arange(len(reference)), best]
+    conf_diff = np.abs(reference[:, 4] - candidate[best, 4])
+    ok = bool((matched_iou >= iou_threshold).all() and (conf_diff <= conf_tolerance).all())
+    return ok, f"min IoU {matched_iou.min():.3f}, max conf diff {conf_diff.max():.3f}"
+
+
+def time_detector(detect, frames, runs):
+    detect(frames)  # warm-up
+    started = time.perf_counter()
+    for _ in range(runs):
+        detect(frames)
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def test_onnx_parity(image_path="uploaded_image.jpg", onnx_paths=("best.onnx", "best.int8.onnx"), runs=10, threads=0):
+    for required in ("best.pt", image_path, onnx_paths[0]):
+        if not os.path.exists(required):
+            pytest.skip(f"{required} not found (run export_onnx.py for the .onnx files)")
+    pytest.importorskip("ultralytics")
+    pytest.importorskip("onnxruntime")
+    import cal
+    from ultralytics import YOLO
+    from onnx_detector import OnnxDetector
+
+    frames = [cal.to_bgr(image_path)]
+    torch_model = YOLO("best.pt")
+    reference = cal.detect_batch(frames, torch_model, 0.03)[0]
+    torch_ms = time_detector(lambda f: cal.detect_batch(f, torch_model, 0.03), frames, runs)
+    print(f"PyTorch: {len(reference)} detections, {torch_ms:.1f} ms/image")
+
+    for path in onnx_paths:
+        if not os.path.exists(path):
+            print(f"{path}: not found (run export_onnx.py)")
+            continue
+        detector = OnnxDetector(path, num_threads=threads)
+        boxes = detector.detect(frames, 0.03)[0]
+        ok, detail = compare_boxes(reference, boxes)
+        onnx_ms = time_detector(lambda f: detector.detect(f, 0.03), frames, runs)
+        print(f"{path}: {'PARITY OK' if ok else 'PARITY MISMATCH'} ({detail}), "
+              f"{onnx_ms:.1f} ms/image, {torch_ms / onnx_ms:.2f}x vs PyTorch")
+        if path == onnx_paths[0]:
+            assert ok, f"ONNX output diverges from PyTorch: {detail}"
+
+
+if __name__ == "__main__":
+    try:
+        test_onnx_parity(threads=int(os.getenv("FOODVISION_ONNX_THREADS", "0")))
+    except pytest.skip.Exception as e:
+        print(f"Skipping: {e}")
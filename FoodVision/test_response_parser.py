@@ -0,0 +1,86 @@
+"""
+StructuredOutputParser (response_parser.py): direct parse, extraction from chatty
+output, and the single repair call when both fail.
+
+    python -m pytest test_response_parser.py
+"""
+import asyncio
+import json
+
+import pytest
+
+from response_parser import REPAIR_PROMPT, ParseError, StructuredOutputParser, extract_json_object
+
+GOOD = {"meal_summary": "Rice", "total_carbs_est": 45}
+
+
+class Repair:
+    """Async repair callable answering `reply`; records the prompts it was sent."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+
+    async def __call__(self, prompt):
+        self.prompts.append(prompt)
+        return self.reply
+
+
+def require_carbs(data):
+    if "total_carbs_est" not in data:
+        raise ValueError("total_carbs_est missing")
+
+
+def test_valid_json_needs_no_repair():
+    parser = StructuredOutputParser()
+    repair = Repair(json.dumps(GOOD))
+    assert asyncio.run(parser.parse_or_repair(json.dumps(GOOD), repair)) == GOOD
+    assert repair.prompts == [] and parser.stats()["parsed"] == 1
+
+
+def test_fenced_json_is_extracted_without_repair():
+    parser = StructuredOutputParser()
+    repair = Repair("")
+    text = 'Here you go:\n```json\n{"meal_summary": "a {curly} name", "total_carbs_est": 45}\n```'
+    assert asyncio.run(parser.parse_or_repair(text, repair))["meal_summary"] == "a {curly} name"
+    assert repair.prompts == [] and parser.stats()["extracted"] == 1
+
+
+def test_prose_falls_back_to_one_repair_call():
+    parser = StructuredOutputParser()
+    repair = Repair(json.dumps(GOOD))
+    text = "Roughly forty-five grams of carbohydrate."
+    assert asyncio.run(parser.parse_or_repair(text, repair)) == GOOD
+    assert repair.prompts == [REPAIR_PROMPT + text]
+    assert parser.stats()["repaired"] == 1
+
+
+def test_output_failing_validation_is_repaired():
+    parser = StructuredOutputParser(validate=require_carbs)
+    repair = Repair(json.dumps(GOOD))
+    assert asyncio.run(parser.parse_or_repair('{"meal_summary": "Rice"}', repair)) == GOOD
+    assert len(repair.prompts) == 1
+
+
+def test_failed_repair_raises_parse_error():
+    parser = StructuredOutputParser()
+    repair = Repair("still not JSON")
+    with pytest.raises(ParseError, match="after repair"):
+        asyncio.run(parser.parse_or_repair("no JSON here", repair))
+    assert len(repair.prompts) == 1
+    stats = parser.stats()
+    assert (stats["failed"], stats["failure_rate"]) == (1, 1.0)
+
+
+def test_repair_call_error_raises_parse_error():
+    async def broken(prompt):
+        raise ConnectionError("model unavailable")
+
+    with pytest.raises(ParseError, match="model unavailable"):
+        asyncio.run(StructuredOutputParser().parse_or_repair("no JSON here", broken))
+
+
+def test_extract_json_object_skips_unbalanced_prefix():
+    assert extract_json_object('{ not closed ... {"a": "}"}') == '{"a": "}"}'
+    assert extract_json_object('{ never closed') is None
+    assert extract_json_object('noise {"a": {"b": 1}} tail {"c": 2}') == '{"a": {"b": 1}}'
@@ -0,0 +1,66 @@
+"""
+Result cache backends (result_cache.py): LRU bound, TTL and per-user scoping, for
+both the in-memory and the SQLite cache.
+
+    python -m pytest test_result_cache.py
+"""
+import time
+
+import pytest
+from PIL import Image
+
+from result_cache import MemoryResultCache, SQLiteResultCache, image_fingerprint
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time.time() for created_at / last_used."""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryResultCache(**kwargs)
+        return SQLiteResultCache(path=str(tmp_path / "cache.sqlite3"), **kwargs)
+    return make
+
+
+def fingerprint(shade):
+    return image_fingerprint(Image.new("RGB", (32, 24), (shade, 100, 200)))
+
+
+def test_least_recently_used_entry_is_evicted(make_cache, clock):
+    cache = make_cache(max_size=2)
+    a, b, c = fingerprint(10), fingerprint(20), fingerprint(30)
+    cache.put("u1", a, {"meal": "a"})
+    clock[0] += 1
+    cache.put("u1", b, {"meal": "b"})
+    clock[0] += 1
+    assert cache.get("u1", a) == {"meal": "a"}  # "b" is now the least recently used
+    clock[0] += 1
+    cache.put("u1", c, {"meal": "c"})
+    assert cache.get("u1", b) is None
+    assert cache.get("u1", a) == {"meal": "a"} and cache.get("u1", c) == {"meal": "c"}
+    assert cache.stats()["size"] == 2 and cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(make_cache, clock):
+    cache = make_cache(ttl=60)
+    a = fingerprint(10)
+    cache.put("u1", a, {"meal": "a"})
+    clock[0] += 60
+    assert cache.get("u1", a) == {"meal": "a"}
+    clock[0] += 1
+    assert cache.get("u1", a) is None
+
+
+def test_entries_are_scoped_per_user(make_cache, clock):
+    cache = make_cache()
+    a = fingerprint(10)
+    cache.put("u1", a, {"meal": "a"})
+    assert cache.get("u2", a) is None
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,90 @@
+"""
+Meal log rollups (meal_log.py, rollups.py): the day / week / all-time rows upserted
+with every write, and rebuild_rollups agreeing with them.
+
+    python -m pytest test_rollups.py
+"""
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+import cgm_store
+import rollups
+from meal_log import GLUCOSE, INSULIN, MealLog, daily_rollups, user_totals, weekly_rollups
+
+UID = "u1"
+SUNDAY = datetime(2024, 3, 10, 12, 0)   # ISO week starting Monday 4 March
+MONDAY = datetime(2024, 3, 11, 8, 0)    # next week
+
+
+def meal(carbs, glycemic_load):
+    return {"meal_summary": "test", "total_carbs_est": carbs, "risk_check": {"glycemic_load": glycemic_load}}
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+    monkeypatch.setattr(cgm_store, "_cgm_store", cgm_store.CGMStore(str(tmp_path / "cgm")))
+    return MealLog(f"sqlite:///{tmp_path / 'meal_log.sqlite3'}")
+
+
+def rollup_rows(log, table):
+    with log.engine.connect() as conn:
+        rows = conn.execute(select(table).where(table.c.uid == UID)).all()
+    return sorted(tuple(row) for row in rows)
+
+
+def test_writes_upsert_day_week_and_total(log):
+    log.log_meal(UID, meal(40, 20.0), ts=SUNDAY, insulin_units=4)
+    log.log_meal(UID, meal(60, 30.0), ts=SUNDAY.replace(hour=19))
+    log.log_reading(UID, GLUCOSE, 150, ts=SUNDAY.replace(hour=21))
+    log.log_reading(UID, GLUCOSE, 250, ts=MONDAY)
+    log.log_reading(UID, INSULIN, 2, ts=MONDAY)
+
+    sunday, monday = log.daily(UID, date(2024, 3, 10), date(2024, 3, 11))
+    assert (sunday["meal_count"], sunday["carbs_total"], sunday["glycemic_load_total"]) == (2, 100, 50)
+    assert (sunday["insulin_total"], sunday["glucose_avg"], sunday["glucose_in_range"]) == (4, 150, 1)
+    assert (monday["meal_count"], monday["insulin_total"], monday["glucose_avg"], monday["glucose_in_range"]) == (0, 2, 250, 0)
+
+    weeks = {row["week"]: row for row in log.last_weeks(UID, weeks=2, today=MONDAY.date())}
+    assert weeks[date(2024, 3, 4)]["meal_count"] == 2 and weeks[date(2024, 3, 11)]["glucose_count"] == 1
+
+    totals = log.totals(UID)
+    assert (totals["meal_count"], totals["carbs_total"], totals["insulin_total"], totals["glucose_count"]) == (2, 100, 6, 2)
+    assert totals["time_in_range"] == 50.0 and totals["carb_ratio"] == 100 / 6
+
+
+def test_one_row_per_key_however_many_writes(log):
+    for hour in range(24):
+        log.log_meal(UID, meal(10, 5.0), ts=SUNDAY.replace(hour=hour))
+    assert len(rollup_rows(log, daily_rollups)) == 1
+    assert len(rollup_rows(log, weekly_rollups)) == 1
+    assert rollup_rows(log, user_totals)[0][1:3] == (24, 240)
+
+
+def test_add_rollups_pre_aggregates_by_week(log):
+    log.add_rollups(UID, {
+        SUNDAY.date(): rollups.delta(glucose=100),
+        MONDAY.date(): rollups.delta(glucose=200),
+        date(2024, 3, 12): rollups.delta(glucose=300),
+    })
+    weeks = {row["week"]: row["glucose_sum"] for row in log.last_weeks(UID, weeks=2, today=MONDAY.date())}
+    assert weeks == {date(2024, 3, 4): 100, date(2024, 3, 11): 500}
+    assert log.totals(UID)["glucose_avg"] == 200
+
+
+def test_rebuild_matches_incremental_rollups(log):
+    log.log_meal(UID, meal(40, 20.0), ts=SUNDAY, insulin_units=4, glucose_mg_dl=120)
+    log.log_meal(UID, meal(70, 35.5), ts=MONDAY)
+    log.log_reading(UID, INSULIN, 3, ts=MONDAY)
+    # an hour of 5-minute CGM readings on Monday (naive wall-clock seconds, like cgm_store)
+    ts = np.datetime64(MONDAY, "s").astype(np.int64) + 300 * np.arange(12, dtype=np.int64)
+    ts = ts.astype(np.uint32)
+    mg_dl = np.full(12, 190, dtype=np.int16)
+    added_ts, added_mg_dl = cgm_store.get_cgm_store().add(UID, ts, mg_dl)
+    log.add_rollups(UID, cgm_store.daily_deltas(added_ts, added_mg_dl))
+
+    before = [rollup_rows(log, table) for table in (daily_rollups, weekly_rollups, user_totals)]
+    log.rebuild_rollups(UID)
+    assert [rollup_rows(log, table) for table in (daily_rollups, weekly_rollups, user_totals)] == before
@@ -0,0 +1,62 @@
+"""
+TokenCache (token_cache.py): LRU bound and per-token expiry.
+
+    python -m pytest test_token_cache.py
+"""
+import time
+
+import pytest
+
+from token_cache import TokenCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time.time() for the cache's expiry checks."""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_token_is_evicted(clock):
+    cache = TokenCache(max_size=2)
+    cache.put("a", "uid-a")
+    cache.put("b", "uid-b")
+    assert cache.get("a") == "uid-a"  # "b" is now the least recently used
+    cache.put("c", "uid-c")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("uid-a", "uid-c")
+    assert cache.stats()["evictions"] == 1 and cache.stats()["size"] == 2
+
+
+def test_entry_expires_at_token_exp(clock):
+    cache = TokenCache(max_ttl=3600)
+    cache.put("a", "uid-a", exp=clock[0] + 60)
+    clock[0] += 59
+    assert cache.get("a") == "uid-a"
+    clock[0] += 1
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_max_ttl_caps_a_long_lived_token(clock):
+    cache = TokenCache(max_ttl=300)
+    cache.put("a", "uid-a", exp=clock[0] + 3600)
+    clock[0] += 301
+    assert cache.get("a") is None
+
+
+def test_already_expired_token_is_not_stored(clock):
+    cache = TokenCache()
+    cache.put("a", "uid-a", exp=clock[0] - 1)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_hit_ratio(clock):
+    cache = TokenCache()
+    cache.put("a", "uid-a")
+    cache.get("a")
+    cache.get("missing")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
@@ -0,0 +1,276 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from jose import jwt
+
+# --- CONFIGURATION ---
+# Google publishes the x509 certificates used to sign Firebase ID tokens here.
+GOOGLE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+DEFAULT_CERTS_TTL = 3600  # seconds, used when Cache-Control has no max-age
+UNKNOWN_KID_COOLDOWN = 60  # seconds between refetches triggered by an unknown kid
+IDENTITY_TOOLKIT_URL = "https://identitytoolkit.googleapis.com"
+
+
+def hash_token(token):
+    """SHA-256 of the raw token, so raw credentials never sit in memory as dict keys."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified Firebase ID tokens -> uid.
+    Each entry expires at the token's own `exp` claim (capped by max_ttl).
+    """
+
+    def __init__(self, max_size=1024, max_ttl=3600):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()  # token_hash -> (uid, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        key = hash_token(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            uid, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return uid
+
+    def put(self, token, uid, exp=None):
+        now = time.time()
+        expires_at = now + self.max_ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        if expires_at <= now:
+            return
+        key = hash_token(token)
+        with self._lock:
+            self._entries[key] = (uid, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class GooglePublicKeys:
+    """
+    Caches Google's token-signing certificates, honouring the Cache-Control max-age.
+
+    Certificates are refetched when they expire. A token with an unknown `kid` can
+    trigger at most one early refetch per `unknown_kid_cooldown` seconds (key
+    rotation); otherwise it is rejected without a network call, so forged kids
+    cannot turn every request into a fetch. The fetch runs outside the main lock:
+    one thread fetches while others keep reading the current certificates.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, unknown_kid_cooldown=UNKNOWN_KID_COOLDOWN):
+        self.url = url
+        self.unknown_kid_cooldown = unknown_kid_cooldown
+        self._certs = {}
+        self._expires_at = 0.0
+        self._fetched_at = float("-inf")
+        self._lock = threading.Lock()          # guards the fields above
+        self._refresh_lock = threading.Lock()  # single-flight fetch
+        self.refreshes = 0
+
+    def _fetch(self):
+        response = requests.get(self.url, timeout=5)
+        response.raise_for_status()
+        max_age = DEFAULT_CERTS_TTL
+        for directive in response.headers.get("Cache-Control", "").split(","):
+            directive = directive.strip()
+            if directive.startswith("max-age="):
+                try:
+                    max_age = int(directive.split("=", 1)[1])
+                except ValueError:
+                    pass
+        return response.json(), max_age
+
+    def _needs_refresh(self, kid, now):
+        if now >= self._expires_at:
+            return True
+        return kid not in self._certs and now - self._fetched_at >= self.unknown_kid_cooldown
+
+    def get(self, kid):
+        with self._lock:
+            if not self._needs_refresh(kid, time.time()):
+                return self._certs.get(kid)
+
+        with self._refresh_lock:
+            # another thread may have refreshed while we waited
+            with self._lock:
+                if not self._needs_refresh(kid, time.time()):
+                    return self._certs.get(kid)
+                self._fetched_at = time.time()
+            try:
+                certs, max_age = self._fetch()
+            except Exception as e:
+                with self._lock:
+                    if not self._certs:
+                        raise
+                    # keep serving the previous certificates; retry after the cooldown
+                    print(f"Certificate refresh failed, using cached keys: {e}")
+                    self._expires_at = max(self._expires_at, time.time() + self.unknown_kid_cooldown)
+                    return self._certs.get(kid)
+            with self._lock:
+                self._certs = certs
+                self._expires_at = time.time() + max_age
+                self.refreshes += 1
+                return self._certs.get(kid)
+
+
+def verify_token_locally(token, project_id, public_keys):
+    """
+    Verifies a Firebase ID token signature and claims without a network round trip
+    (apart from the occasional certificate refresh).
+    Returns (uid, exp). Raises jose.JWTError / ValueError on invalid tokens.
+    """
+    header = jwt.get_unverified_header(token)
+    cert = public_keys.get(header.get("kid"))
+    if cert is None:
+        raise ValueError("Unknown signing key")
+
+    claims = jwt.decode(
+        token,
+        cert,
+        algorithms=["RS256"],
+        audience=project_id,
+        issuer=f"https://securetoken.google.com/{project_id}",
+    )
+    uid = claims.get("sub")
+    if not uid:
+        raise ValueError("Token has no subject")
+    return uid, claims.get("exp")
+
+
+def unverified_expiry(token):
+    """Reads `exp` from a token that has already been verified remotely."""
+    try:
+        return jwt.get_unverified_claims(token).get("exp")
+    except Exception:
+        return None
+
+
+class InvalidToken(Exception):
+    """The token was rejected; str(e) is safe to show the caller."""
+
+
+def identity_toolkit_url(emulator_host=None):
+    """Identity Toolkit base URL, or the Firebase Auth emulator's when a host is given."""
+    if emulator_host:
+        return f"http://{emulator_host}/identitytoolkit.googleapis.com"
+    return IDENTITY_TOOLKIT_URL
+
+
+class FirebaseTokenVerifier:
+    """
+    Firebase ID token -> uid, shared by the API (main.get_current_user) and the
+    Streamlit dashboard. Verified tokens are kept in `cache` until they expire.
+
+    With a project id the signature is checked locally against Google's public keys;
+    otherwise the token is looked up through the Identity Toolkit REST API with the
+    web API key. With neither configured every token maps to DEV_UID (dev only).
+    """
+
+    DEV_UID = "dev-user-uid"
+
+    def __init__(self, cache, project_id=None, web_api_key=None, identity_toolkit_url=IDENTITY_TOOLKIT_URL,
+                 public_keys=None):
+        self.cache = cache
+        self.project_id = project_id
+        self.web_api_key = web_api_key
+        self.identity_toolkit_url = identity_toolkit_url
+        self.public_keys = public_keys or GooglePublicKeys()
+
+    @classmethod
+    def from_env(cls):
+        """Same settings main.py reads: FIREBASE_PROJECT_ID, FIREBASE_WEB_API_KEY, ..."""
+        return cls(
+            TokenCache(max_size=int(os.getenv("TOKEN_CACHE_SIZE", "1024"))),
+            project_id=os.getenv("FIREBASE_PROJECT_ID"),
+            web_api_key=os.getenv("FIREBASE_WEB_API_KEY"),
+            identity_toolkit_url=identity_toolkit_url(os.getenv("FIREBASE_AUTH_EMULATOR_HOST")),
+        )
+
+    @property
+    def configured(self):
+        return bool(self.project_id or self.web_api_key)
+
+    def cached(self, token):
+        """uid of an already verified token, without blocking; None on a miss."""
+        return self.cache.get(token)
+
+    def verify_uncached(self, token):
+        """
+        Verifies `token` (blocking: certificate refresh or REST lookup) and caches it.
+        Raises InvalidToken when it is rejected or cannot be checked.
+        """
+        try:
+            if self.project_id:
+                try:
+                    uid, exp = verify_token_locally(token, self.project_id, self.public_keys)
+                except (jwt.JWTError, ValueError) as e:
+                    print(f"Token verification failed: {e}")
+                    raise InvalidToken("Invalid authentication credentials")
+                self.cache.put(token, uid, exp)
+                return uid
+
+            url = f"{self.identity_toolkit_url}/v1/accounts:lookup?key={self.web_api_key}"
+            response = requests.post(url, json={"idToken": token}, timeout=10)
+            if response.status_code != 200:
+                print(f"Token verification failed: {response.text}")
+                raise InvalidToken("Invalid authentication credentials (API check failed)")
+
+            users = response.json().get("users")
+            if not users:
+                raise InvalidToken("Invalid token: user not found")
+            uid = users[0]["localId"]
+            self.cache.put(token, uid, unverified_expiry(token))
+            return uid
+        except InvalidToken:
+            raise
+        except Exception as e:
+            print(f"Token verification error: {e}")
+            raise InvalidToken("Authentication server error")
+
+    def verify(self, token):
+        """uid for `token` (blocking on a cache miss). Raises InvalidToken."""
+        if not token:
+            raise InvalidToken("Missing authentication token")
+        if not self.configured:
+            print("WARNING: FIREBASE_WEB_API_KEY missing. Verifying token blindly (INSECURE - DEV ONLY).")
+            return self.DEV_UID
+        return self.cached(token) or self.verify_uncached(token)